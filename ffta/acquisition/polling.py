@@ -48,9 +48,12 @@ class MyHandler(FileSystemEventHandler):
     wait_per_line : int
         The number of seconds to wait after a new file event (avoids OS errors)
     
+    n_threads : int, optional
+        Number of threads used to analyze the pixels of each line (see Line)
+    
     '''
 
-    def __init__(self, parameters, wait_per_line=5):
+    def __init__(self, parameters, wait_per_line=5, n_threads=1):
         '''
         Increments lines_loaded every time a new file is corrected
         This method provides a (crude) flag for checking when to stop
@@ -64,6 +67,7 @@ class MyHandler(FileSystemEventHandler):
         self.n_pixels = parameters['n_pixels']
 
         self.wait_per_line = int(wait_per_line)
+        self.n_threads = n_threads
 
         # initialize the FFtrEFM line data
         self.tfp = np.empty(n_pixels)
@@ -82,7 +86,7 @@ class MyHandler(FileSystemEventHandler):
             path = event.src_path.split('\\')
 
             signal = pixel_utils.load.signal(event.src_path)
-            this_line = line.Line(signal, self.parameters, self.n_pixels)
+            this_line = line.Line(signal, self.parameters, self.n_pixels, n_threads=self.n_threads)
             self.tfp, self.shift, _ = this_line.analyze()
             print('Analyzed', path[-1], 'tFP avg =', np.mean(self.tfp),
                   ' s; shift =', np.mean(self.shift), 'Hz')
@@ -94,8 +98,10 @@ if __name__ == '__main__':
 
     parser = argparse.ArgumentParser()
     parser.add_argument('path', help='Path where data are being saved')
+    parser.add_argument('-t', help='number of threads per line', type=int, default=1)
 
-    path_to_watch = parser.parse_args().path
+    args = parser.parse_args()
+    path_to_watch = args.path
     print('Loading data from ', path_to_watch)
 
     params_file = path_to_watch + r'\parameters.cfg'
@@ -113,7 +119,7 @@ if __name__ == '__main__':
 
     # initialize event handler
     my_observer = Observer()
-    my_event_handler = MyHandler(parameters)
+    my_event_handler = MyHandler(parameters, n_threads=args.t)
     my_observer.schedule(my_event_handler, path_to_watch, recursive=False)
     my_observer.start()
 
@@ -67,9 +67,9 @@ class dist_cluster:
 		self.h5_main = h5_main
 
 		if isinstance(data_avg, str):
-			self.data_avg = usid.hdf_utils.find_dataset(h5_main.parent, data_avg)[0].value
+			self.data_avg = get_utils.find_dataset(h5_main.parent, data_avg)[0].value
 		elif isinstance(data_avg, np.ndarray):
-			self.data_avg = usid.hdf_utils.find_dataset(h5_main.parent, 'tfp')[0].value
+			self.data_avg = get_utils.find_dataset(h5_main.parent, 'tfp')[0].value
 		else:
 			raise ValueError('Wrong format for data_avg')
 
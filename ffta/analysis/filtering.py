@@ -80,8 +80,9 @@ def test_filter(hdf_file, freq_filts, parameters={}, pixelnum=[0, 0], noise_tole
 	ftype = str(type(hdf_file))
 	if ('h5py' in ftype) or ('Dataset' in ftype):  # hdf file
 
-		parameters = get_utils.get_params(hdf_file)
-		hdf_file = get_utils.get_pixel(hdf_file, [pixelnum[0], pixelnum[1]], array_form=True, transpose=False)
+		pixels = get_utils.PixelAccessor(hdf_file, cache_lines=0)
+		parameters = pixels.parameters
+		hdf_file = pixels.get_pixel([pixelnum[0], pixelnum[1]], array_form=True, transpose=False)
 		hdf_file = hdf_file.flatten()
 
 	if len(hdf_file.shape) == 2:
@@ -291,7 +292,8 @@ def _get_pixel_for_filtering(hdf_file, parameters={}, pixelnum=[0, 0]):
 	if ('h5py' in ftype) or ('Dataset' in ftype):  # hdf file
 
 		parameters = usid.hdf_utils.get_attributes(hdf_file)
-		hdf_file = get_utils.get_pixel(hdf_file, [pixelnum[0], pixelnum[1]], array_form=True, transpose=False)
+		pixels = get_utils.PixelAccessor(hdf_file, cache_lines=0)
+		hdf_file = pixels.get_pixel([pixelnum[0], pixelnum[1]], array_form=True, transpose=False)
 		hdf_file = hdf_file.flatten()
 
 	if len(hdf_file.shape) == 2:
@@ -137,8 +137,8 @@ def plot_svd(h5_main, savefig=False, num_plots=16, **kwargs):
 
 	if isinstance(h5_main, h5py.Group):
 
-		_U = usid.hdf_utils.find_dataset(h5_main, 'U')[-1]
-		_V = usid.hdf_utils.find_dataset(h5_main, 'V')[-1]
+		_U = get_utils.find_dataset(h5_main, 'U')[-1]
+		_V = get_utils.find_dataset(h5_main, 'V')[-1]
 		units = 'arbitrary (a.u.)'
 		h5_spec_vals = np.arange(_V.shape[1])
 		h5_svd_group = _U.parent
@@ -5,7 +5,7 @@ Created on Thu Mar  8 13:17:12 2018
 @author: Raj
 """
 
-from ffta.hdf_utils import hdf_utils
+from ffta.load import get_utils
 from matplotlib import pyplot as plt
 
 def test_pixel(h5_file, param_changes={}, pxls = 1, showplots = True, 
@@ -33,11 +33,12 @@ def test_pixel(h5_file, param_changes={}, pxls = 1, showplots = True,
 		Whether to do filtering (FIR) or not
 	
 	"""
-	# get_pixel can work on Datasets or the H5_File
+	# PixelAccessor can work on Datasets or the H5_File
 	if any(param_changes):
-		hdf_utils.change_params(h5_file, new_vals=param_changes)
-		
-	parameters = hdf_utils.get_params(h5_file)
+		get_utils.change_params(h5_file, new_vals=param_changes)
+	
+	pixel_data = get_utils.PixelAccessor(h5_file)
+	parameters = pixel_data.parameters
 	cols = parameters['num_cols']
 	rows = parameters['num_rows']
 	
@@ -57,7 +58,7 @@ def test_pixel(h5_file, param_changes={}, pxls = 1, showplots = True,
 	# Analyzes all pixels
 	for rc in pixels:
 		
-		h5_px = hdf_utils.get_pixel(h5_file, rc=rc)
+		h5_px = pixel_data.get_pixel(rc)
 		
 		if clear_filter:
 			h5_px.clear_filter_flags()
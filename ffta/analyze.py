@@ -1,4 +1,13 @@
-"""analyze.py: Runs the FF-trEFM Analysis for a set of given files."""
+"""analyze.py: Runs the FF-trEFM Analysis for a set of given files.
+
+Installed as the ffta-analyze console script. Each path given is one job:
+a folder of .ibw lines and a .cfg file, or an .h5 file processed with
+FFtrEFM. With -p, one pool of worker processes is started for the whole
+queue and shared by the jobs. Nothing is plotted unless --plot is given.
+
+Example usage:
+    ffta-analyze E:/Data/scan1 E:/Data/scan2 E:/Data/image.h5 -p 8 --method stft
+"""
 
 __author__ = "Rajiv Giridharagopal"
 __copyright__ = "Copyright 2019, Ginger Lab"
@@ -15,14 +24,10 @@ import argparse as ap
 import numpy as np
 import ffta.line as line
 from ffta.pixel_utils import load
-import badpixels
-
-# Plotting imports
-import matplotlib as mpl
-#mpl.use('WxAgg')
-from matplotlib import pyplot as plt
-from matplotlib import gridspec as gs
-
+from ffta.pixel_utils import liveplot
+from ffta.pixel_utils import output
+from ffta.pixel_utils import workers
+from ffta.pixel_utils.parameters import PixelParameters, METHODS, FIT_FORMS
 
 def process_line(args):
     """Wrapper function for line class, used in parallel processing."""
@@ -36,34 +41,120 @@ def process_line(args):
     return tfp, shift
 
 
-def main(argv=None):
-    """Main function of the executable file."""
-    logging.basicConfig(filename='error.log', level=logging.INFO)
+def _process_line_shared(args):
+    """
+    Analyzes one line in a worker and writes it into the shared image.
 
-    # Get the CPU count to display in help.
-    cpu_count = multiprocessing.cpu_count()
+    args is the line number, the file name, and the job: the parameters, the
+    number of pixels, the workers.SharedArray spec of the (2, n_lines, n_pixels)
+    tfp/shift image, whether inst_freq is kept, and the threads per line.
+    The job is the same for every line of a folder; the pool is not, so that
+    one pool can serve a queue of folders.
 
-    if argv is None:
-        argv = sys.argv[1:]
+    Returns the line number, and the inst_freq traces if they are being saved.
+    """
 
-    # Parse arguments from the command line, and print out help.
-    parser = ap.ArgumentParser(description='Analysis software for FF-trEFM')
-    parser.add_argument('path', nargs='?', default=os.getcwd(),
-                        help='path to directory')
-    parser.add_argument('-p', help='parallel computing option should be'
-                        'followed by the number of CPUs.', type=int,
-                        choices=range(2, cpu_count + 1))
-    parser.add_argument('-v', action='version',
-                        version='FFtr-EFM 2.0 Release Candidate')
-    args = parser.parse_args(argv)
+    i, signal_file, job = args
+    config, n_pixels, image_spec, keep_inst_freq, n_threads = job
+    signal_array = load.signal(signal_file)
+
+    line_inst = line.Line(signal_array, config, n_pixels, n_threads=n_threads)
+    tfp, shift, inst_freq = line_inst.analyze()
+
+    image = workers.attach(image_spec)
+    image[0, i, :] = tfp
+    image[1, i, :] = shift
+
+    if keep_inst_freq:
+        return i, np.asarray(inst_freq, dtype=np.float32)
+
+    return i, None
+
+
+def _open_store(store_path, fmt, data_files, n_pixels, n_points, run, rows, params):
+    """
+    Opens the binary result store in the data folder for this run.
+
+    Lines of unchanged files (rows: {index in data_files: stored line}) are
+    kept; the store is rebuilt if they moved or the number of lines changed.
+    """
+
+    n_lines = len(data_files)
+
+    if rows:
+
+        store = output.LineWriter(store_path, fmt=fmt)
+        traces = None if store.inst_freq is None else store.inst_freq.shape[2]
+        if (store.tfp.shape == (n_lines, n_pixels) and traces == n_points and
+                all(i == j for i, j in rows.items())):
+            return store
+
+        store.close()
+        store = output.rebuild(store_path, n_lines, n_pixels, n_points, rows, fmt)
+
+    else:
+
+        store = output.LineWriter(store_path, n_lines, n_pixels, n_points,
+                                  fmt=fmt, mode='w')
+
+    run.reset(params, rows, data_files)
+
+    return store
+
+
+def _options(args):
+    """The parameters set on the command line, which override the stored ones."""
+
+    options = {}
+    if args.method:
+        options['method'] = args.method
+    if args.fit_form:
+        options['fit_form'] = args.fit_form
+
+    return options
+
+
+def _configure(parameters, args):
+    """Validated parameters, with the method and fit form from the command line."""
+
+    config = PixelParameters.from_dict(parameters)
+
+    options = _options(args)
+    if options:
+        config = config._replace(**options)
+        config.validate()
+
+    return config
+
+
+def folder_job(path, args, pool=None):
+    """
+    Analyzes a folder of .ibw lines into a binary store in that folder.
+
+    With a pool, each worker writes its lines into a tfp/shift image in
+    shared memory (see _process_line_shared).
+
+    Parameters
+    ----------
+    path : str
+        Folder with the .ibw files and one .cfg file
+    args : argparse.Namespace
+        Parsed command line options, see main
+    pool : ffta.pixel_utils.workers.WorkerPool, optional
+        Workers shared by the jobs of main; the lines are analyzed in this
+        process if None
 
+    Returns
+    -------
+    int
+        Number of lines analyzed
+    """
 
     # Scan the path for .ibw and .cfg files.
-    path = args.path
     filelist = os.listdir(path)
 
-    data_files = [os.path.join(path, name)
-                  for name in filelist if name[-3:] == 'ibw']
+    data_files = sorted(os.path.join(path, name)
+                        for name in filelist if name[-3:] == 'ibw')
 
     config_file = [os.path.join(path, name)
                    for name in filelist if name[-3:] == 'cfg'][0]
@@ -78,114 +169,258 @@ def main(argv=None):
 
     print( 'ROI: ', parameters['roi'])
 
-    if not args.p:
+    # Validate once for the whole image; this is also what is sent to workers.
+    config = _configure(parameters, args)
 
-        # Initialize arrays.
-        tfp = np.zeros((len(data_files), n_pixels))
-        shift = np.zeros((len(data_files), n_pixels))
+    n_files = len(data_files)
 
-        # Initialize plotting.
-        plt.ion()
+    # Only new or changed files (or all, if the parameters changed) are analyzed.
+    params = config.digest(n_pixels)
+    store_path = os.path.join(path, 'ffta_results.h5' if args.format == 'h5' else 'ffta_results')
+    run = output.Manifest(store_path)
+    rows = {} if args.force else run.rows(data_files, params)
 
-        fig = plt.figure(figsize=(12, 6), tight_layout=True)
-        grid = gs.GridSpec(1, 2)
-        tfp_ax = plt.subplot(grid[0, 0])
-        shift_ax = plt.subplot(grid[0, 1])
+    if rows and args.inst_freq:
+        with output.LineWriter(store_path, fmt=args.format) as stored:
+            if stored.inst_freq is None:
+                rows = {}  # the kept lines would have no traces
 
-        plt.setp(tfp_ax.get_xticklabels(), visible=False)
-        plt.setp(tfp_ax.get_yticklabels(), visible=False)
-        plt.setp(shift_ax.get_xticklabels(), visible=False)
-        plt.setp(shift_ax.get_yticklabels(), visible=False)
+    todo = [i for i in range(n_files) if i not in rows]
 
-        tfp_ax.set_title('tFP Image')
-        shift_ax.set_title('Shift Image')
+    print('{0:d} of {1:d} lines to analyze.'.format(len(todo), n_files))
 
-        kwargs = {'origin': 'lower', 'aspect': 'equal'}
+    if not todo:
 
-        tfp_image = tfp_ax.imshow(tfp * 1e6, cmap='afmhot', **kwargs)
-        shift_image = shift_ax.imshow(shift, cmap='cubehelix', **kwargs)
-        text = plt.figtext(0.4, 0.1, '')
-        plt.show()
+        store = output.LineWriter(store_path, fmt=args.format)
+        if args.csv:
+            store.to_csv(path)
+        store.close()
 
-        # Load every file in the file list one by one.
-        for i, data_file in enumerate(data_files):
+        return 0
 
-            signal_array = load.signal(data_file)
-            line_inst = line.Line(signal_array, parameters, n_pixels)
-            tfp[i, :], shift[i, :], _ = line_inst.analyze()
-#            line_inst = line.Line(signal_array, parameters, n_pixels,fitphase=True)
-#            tfpphase[i, :], _, _ = line_inst.analyze()
+    n_points = None
+    if args.inst_freq:
+        n_points = load.signal(data_files[todo[0]]).shape[0]
 
-            tfp_image = tfp_ax.imshow(tfp * 1e6, cmap='inferno', **kwargs)
-            shift_image = shift_ax.imshow(shift, cmap='cubehelix', **kwargs)
+    # Results are stored as each line finishes.
+    store = _open_store(store_path, args.format, data_files, n_pixels, n_points, run, rows, params)
 
-            tfp_sc = tfp[tfp.nonzero()] * 1e6
-            tfp_image.set_clim(vmin=tfp_sc.min(), vmax=tfp_sc.max())
+    # Results of this run, with the lines kept from the last run.
+    shape = (2, n_files, n_pixels)
+    image = None
+    if pool is not None:
+        image = workers.SharedArray(shape, np.float64)
+        tfp, shift = image.array
+    else:
+        tfp, shift = np.zeros(shape)
 
-            shift_sc = shift[shift.nonzero()]
-            shift_image.set_clim(vmin=shift_sc.min(), vmax=shift_sc.max())
+    tfp[:] = np.nan_to_num(store.tfp[()])
+    shift[:] = np.nan_to_num(store.shift[()])
 
-            tfpmean = 1e6 * tfp[i, :].mean()
-            tfpstd = 1e6 * tfp[i, :].std()
+    live = None
+    if args.plot:
+        live = liveplot.LiveImages((n_files, n_pixels))
+        for i in rows:
+            live.update(i, tfp[i, :], shift[i, :])
 
-            string = ("Line {0:.0f}, average tFP (us) ="
-                      " {1:.2f} +/- {2:.2f}".format(i + 1, tfpmean, tfpstd))
+    def analyze_lines():
 
-            text.remove()
-            text = plt.figtext(0.35, 0.1, string)
+        if pool is None:
 
-            plt.draw()
-            plt.pause(0.0001)
+            # Load every file in the file list one by one.
+            for i in todo:
 
-            del line_inst  # Delete the instance to open up memory.
+                data_file = data_files[i]
+                signal_array = load.signal(data_file)
+                line_inst = line.Line(signal_array, config, n_pixels, n_threads=args.t)
+                tfp[i, :], shift[i, :], inst_freq = line_inst.analyze()
+#                line_inst = line.Line(signal_array, parameters, n_pixels,fitphase=True)
+#                tfpphase[i, :], _, _ = line_inst.analyze()
 
-    elif args.p:
+                store.write_line(i, tfp[i, :], shift[i, :], inst_freq)
+                run.record(data_file, i)
 
-        print('Starting parallel processing, using {0:1d} \
-               CPUs.'.format(args.p))
-        start_time = time.time()  # Keep when it's started.
+                if live is not None:
+                    live.update(i, tfp[i, :], shift[i, :])
 
-        # Create a pool of workers.
-        pool = multiprocessing.Pool(processes=args.p)
+                del line_inst  # Delete the instance to open up memory.
 
-        # Create the iterable and map onto the function.
-        n_files = len(data_files)
-        iterable = zip(data_files, [parameters] * n_files,
-                       [n_pixels] * n_files)
-        result = pool.map(process_line, iterable)
+        else:
 
-        # Do not forget to close spawned processes.
-        pool.close()
-        pool.join()
+            # Lines are stored (and displayed) as they finish, in whatever order.
+            job = (config, n_pixels, image.spec, args.inst_freq, args.t)
+            tasks = ((i, data_files[i], job) for i in todo)
+            lines_done = pool.imap_unordered(_process_line_shared, tasks, chunksize=args.lines_per_task)
+            for n_done, (i, inst_freq) in enumerate(lines_done, 1):
+
+                store.write_line(i, tfp[i, :], shift[i, :], inst_freq)
+                run.record(data_files[i], i)
+
+                print('Line {0:d} done ({1:d}/{2:d})'.format(i + 1, n_done, len(todo)))
+                if live is not None:
+                    live.update(i, tfp[i, :], shift[i, :])
+
+        return
+
+    try:
+
+        # With plots, the lines are analyzed on a thread while this one draws.
+        if live is None:
+            analyze_lines()
+        else:
+            live.run(analyze_lines)
+
+    finally:
+
+        # The pool is kept for the next job, only the image is freed.
+        if image is not None:
+            tfp = shift = None
+            image.close()
+
+    print('Results saved in', store.path)
+
+    # Save csv files, with bad pixels filtered in tfp_fixed.
+    if args.csv:
+        store.to_csv(path)
+
+    store.close()
+
+    return len(todo)
 
-        # Unzip the result.
-        tfp_list, shift_list = zip(*result)
 
-        # Initialize arrays.
-        tfp = np.zeros((n_files, n_pixels))
-        shift = np.zeros((n_files, n_pixels))
+def h5_job(path, args, pool=None):
+    """
+    Processes the last dataset named args.dataset in an .h5 file with FFtrEFM.
+    Results are written into the file, as with FFtrEFM.compute. With a pool
+    (see folder_job), FFtrEFM analyzes its blocks of pixels on it.
 
-        # Convert list of arrays to 2D array.
-        for i in range(n_files):
+    Returns
+    -------
+    int
+        Number of pixels processed
+    """
+    import h5py
+    import pyUSID as usid
+    from ffta.hdf_utils.process import FFtrEFM, save_CSV_from_file
 
-            tfp[i, :] = tfp_list[i]
-            shift[i, :] = shift_list[i]
+    with h5py.File(path, 'r+') as h5_file:
 
-        elapsed_time = time.time() - start_time
+        h5_main = usid.hdf_utils.find_dataset(h5_file, args.dataset)[-1]
+        h5_main = usid.USIDataset(h5_main)
 
-        print ('It took {0:.1f} seconds.'.format(elapsed_time))
+        if pool is None:
+            data = FFtrEFM(h5_main, cores=1, verbose=False)
+        else:
+            data = FFtrEFM(h5_main, cores=pool.processes, worker_pool=pool, verbose=False)
 
-    # Filter bad pixels
-    tfp_fixed, _ = badpixels.fix_array(tfp, threshold=2)
-    tfp_fixed = np.array(tfp_fixed)
+        data.update_parm(**_options(args))
+
+        if args.max_pixels:
+            data._max_pos_per_read = min(data._max_pos_per_read, args.max_pixels)
+
+        data.compute(override=args.force)
+        data.close()
+
+        if args.csv:
+            save_CSV_from_file(data)
+
+        return h5_main.shape[0]
+
+
+def main(argv=None):
+    """Main function of the executable file."""
+    logging.basicConfig(filename='error.log', level=logging.INFO)
+
+    # Get the CPU count to display in help.
+    cpu_count = multiprocessing.cpu_count()
 
-    # Save csv files.
-    os.chdir(path)
-    np.savetxt('tfp.csv', np.fliplr(tfp).T, delimiter=',')
-    np.savetxt('shift.csv', np.fliplr(shift).T, delimiter=',')
-    np.savetxt('tfp_fixed.csv', np.fliplr(tfp_fixed).T, delimiter=',')
+    if argv is None:
+        argv = sys.argv[1:]
+
+    # Parse arguments from the command line, and print out help.
+    parser = ap.ArgumentParser(description='Analysis software for FF-trEFM')
+    parser.add_argument('paths', nargs='*', default=[os.getcwd()],
+                        help='folders of .ibw files and/or .h5 files, '
+                        'processed in order')
+    parser.add_argument('-p', help='parallel computing option should be'
+                        'followed by the number of CPUs.', type=int,
+                        choices=range(2, cpu_count + 1))
+    parser.add_argument('-t', help='number of threads used for the pixels of '
+                        'each line (folders; in each process with -p).',
+                        type=int, default=1)
+    parser.add_argument('--method', choices=METHODS,
+                        help='instantaneous frequency method (default: as '
+                        'in the parameters).')
+    parser.add_argument('--fit-form', choices=FIT_FORMS,
+                        help='tFP fit form (default: as in the parameters).')
+    parser.add_argument('--lines-per-task', type=int, default=1,
+                        help='lines sent to a worker at once (folders, with -p).')
+    parser.add_argument('--max-pixels', type=int,
+                        help='most pixels read and processed at once (.h5 '
+                        'files; default: as FFtrEFM).')
+    parser.add_argument('--dataset', default='FF_Avg',
+                        help='dataset processed in .h5 files.')
+    parser.add_argument('--format', help='binary store for the results, '
+                        'written line by line.', choices=output.FORMATS,
+                        default='npy')
+    parser.add_argument('--inst-freq', action='store_true',
+                        help='also store the instantaneous frequency traces.')
+    parser.add_argument('--no-csv', dest='csv', action='store_false',
+                        help='do not write tfp, shift and tfp_fixed as CSV at '
+                        'the end (written by default).')
+    parser.add_argument('--force', action='store_true',
+                        help='reanalyze every line, even if unchanged since '
+                        'the last run.')
+    parser.add_argument('--plot', action='store_true',
+                        help='show the images live while folders are analyzed.')
+    parser.add_argument('-v', action='version',
+                        version='FFtr-EFM 2.0 Release Candidate')
+    args = parser.parse_args(argv)
+
+    # FFtrEFM has no threads of its own, so -t would be silently ignored.
+    if args.t > 1 and any(path.endswith('.h5') for path in args.paths):
+        parser.error('-t only applies to folders of .ibw files; '
+                     'use -p for .h5 files')
+
+    # One pool for the whole queue: folders send it lines, .h5 files blocks of pixels.
+    pool = None
+    if args.p:
+
+        print('Starting parallel processing, using {0:1d} CPUs.'.format(args.p))
+        pool = workers.WorkerPool(args.p)
+
+    failed = 0
+    try:
+
+        for n, path in enumerate(args.paths, 1):
+
+            print('Job {0:d}/{1:d}: {2}'.format(n, len(args.paths), path))
+            start_time = time.time()  # Keep when it's started.
+
+            try:
+                if path.endswith('.h5'):
+                    count, unit = h5_job(path, args, pool), 'pixels'
+                else:
+                    count, unit = folder_job(path, args, pool), 'lines'
+            except Exception:
+                logging.exception('Job %s failed', path)
+                print('Job {0} failed, see error.log'.format(path))
+                failed += 1
+                continue
+
+            elapsed_time = time.time() - start_time
+
+            print('It took {0:.1f} seconds ({1:.2f} {2}/s).'.format(elapsed_time,
+                                                                    count / elapsed_time,
+                                                                    unit))
+
+    finally:
+
+        # Do not forget to close spawned processes.
+        if pool is not None:
+            pool.close()
 
-    return
+    return 1 if failed else 0
 
 if __name__ == '__main__':
 
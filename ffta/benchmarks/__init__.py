@@ -0,0 +1,7 @@
+from . import synthetic
+from . import bench
+from . import accuracy
+
+__all__ = ['synthetic',
+		   'bench',
+		   'accuracy']
@@ -0,0 +1,5 @@
+"""Runs the benchmarks: python -m ffta.benchmarks --help"""
+
+from ffta.benchmarks import bench
+
+bench.main()
@@ -0,0 +1,287 @@
+"""accuracy.py: Speed-versus-accuracy sweep of inst_freq methods and fit forms on simulated data."""
+
+__author__ = "Rajiv Giridharagopal"
+__copyright__ = "Copyright 2020"
+__maintainer__ = "Rajiv Giridharagopal"
+__email__ = "rgiri@uw.edu"
+__status__ = "Development"
+
+import argparse
+import time
+
+import numpy as np
+
+from ffta.pixel import Pixel
+from ffta.pixel_utils.parameters import PixelParameters, METHODS
+from ffta.benchmarks import synthetic
+from ffta.benchmarks.bench import FIT_FORMS, save_json
+
+"""
+Sweeps processing configurations against simulated ground-truth tau
+
+tFP is not tau, and every method/fit has its own offset, so each configuration
+is first calibrated on noise-free signals (tFP versus tau on a log grid). The
+tFP measured on noisy signals is then converted back to tau with that curve and
+compared to the true tau. Users can pick the fastest configuration that meets
+an accuracy target.
+
+Example usage:
+	>> from ffta.benchmarks import accuracy
+	>> records = accuracy.sweep(noises=[0, 0.1], averages=[1, 10])
+	>> table = accuracy.pareto(records)
+	>> accuracy.print_table(table)
+	>> accuracy.fastest(records, max_error=0.1)
+"""
+
+CALIBRATION_TAUS = np.logspace(-6, -3.5, 11)
+
+
+def calibrate(config, taus=CALIBRATION_TAUS, drive='mechanical'):
+	"""
+	tFP of noise-free simulated signals for one processing configuration
+
+	Parameters
+	----------
+	config : PixelParameters
+	taus : array_like, optional
+		Calibration grid, in seconds. Should span the taus of the sweep.
+	drive : str, optional
+
+	Returns
+	-------
+	taus : ndarray
+	tfps : ndarray
+		NaN where the fit failed
+	"""
+	tfps = np.zeros(len(taus))
+
+	for i, tau in enumerate(taus):
+		Z, _ = synthetic.simulate_signal(tau, drive)
+		tfps[i] = Pixel(Z, config).analyze()[0]
+
+	return np.asarray(taus, dtype=float), tfps
+
+
+def tfp_to_tau(tfp, taus, tfps):
+	"""
+	Inverts a calibration curve by log-log interpolation
+
+	Only the strictly increasing part of the curve is used: points that do not
+	exceed every earlier tFP (e.g. saturated at the roi) are dropped. Returns
+	NaN for tFP outside the calibrated range.
+	"""
+	ok = np.isfinite(tfps) & (tfps > 0)
+	taus, tfps = taus[ok], tfps[ok]
+
+	rising = tfps > np.maximum.accumulate(np.append(-np.inf, tfps[:-1]))
+	taus, tfps = taus[rising], tfps[rising]
+
+	if taus.shape[0] < 2:
+		return np.full(np.shape(tfp), np.nan)
+
+	tfp = np.asarray(tfp, dtype=float)
+	with np.errstate(invalid='ignore', divide='ignore'):
+		log_tau = np.interp(np.log(tfp), np.log(tfps), np.log(taus), left=np.nan, right=np.nan)
+
+	return np.exp(log_tau)
+
+
+def sweep(methods=METHODS, fit_forms=FIT_FORMS, taus=(3e-6, 2e-5, 1e-4),
+		  noises=(0.0, 0.1), averages=(1, 10), n_pixels=4, drive='mechanical',
+		  calibration_taus=CALIBRATION_TAUS, seed=0, verbose=True):
+	"""
+	Measures tau error and speed over every combination of the inputs
+
+	Parameters
+	----------
+	methods : list of str
+		Instantaneous frequency methods ('hilbert', 'wavelet', 'stft')
+	fit_forms : list of str
+	taus : list of float
+		Ground-truth time constants, in seconds
+	noises : list of float
+		Noise standard deviation relative to the signal's
+	averages : list of int
+		Number of averages per pixel
+	n_pixels : int
+		Independent noisy pixels per condition
+	drive : str, optional
+		'mechanical' or 'electric'
+	calibration_taus : array_like, optional
+	seed : int, optional
+	verbose : bool, optional
+
+	Returns
+	-------
+	records : list of dict
+		One per (method, fit_form, tau, noise, n_avgs) with tfp_mean, tfp_std,
+		tau_est, error (median absolute relative tau error), failed (fraction of
+		pixels without a finite tFP), and pixels_per_s
+	"""
+	records = []
+	_, params = synthetic.simulate_signal(taus[0], drive)
+
+	for method in methods:
+		for fit_form in fit_forms:
+
+			config = PixelParameters.from_dict(params, method=method, fit_form=fit_form)
+			cal_taus, cal_tfps = calibrate(config, calibration_taus, drive)
+
+			if verbose:
+				print('Calibrated', method, fit_form)
+
+			for tau in taus:
+				for noise in noises:
+					for n_avgs in averages:
+
+						tfp = np.zeros(n_pixels)
+						t0 = time.perf_counter()
+
+						for i in range(n_pixels):
+							signal_array, _ = synthetic.simulate_pixel(tau, n_avgs, noise, drive, seed + i)
+							tfp[i] = Pixel(signal_array, config).analyze()[0]
+
+						seconds = time.perf_counter() - t0
+
+						tau_est = tfp_to_tau(tfp, cal_taus, cal_tfps)
+						error = np.abs(tau_est - tau) / tau
+						ok = np.isfinite(error)
+
+						records.append({'method': method, 'fit_form': fit_form,
+										'tau': tau, 'noise': noise, 'n_avgs': n_avgs,
+										'tfp_mean': float(np.nanmean(tfp)) if np.any(np.isfinite(tfp)) else np.nan,
+										'tfp_std': float(np.nanstd(tfp)) if np.any(np.isfinite(tfp)) else np.nan,
+										'tau_est': float(np.nanmedian(tau_est)) if np.any(ok) else np.nan,
+										'error': float(np.median(error[ok])) if np.any(ok) else np.nan,
+										'failed': float(1 - ok.mean()),
+										'pixels_per_s': n_pixels / seconds})
+
+	return records
+
+
+def pareto(records, max_failed=0.5):
+	"""
+	Summarizes a sweep per configuration and marks the Pareto-optimal ones
+
+	A configuration is Pareto-optimal if no other one is both at least as fast
+	and at least as accurate (and strictly better in one). Failed fits count as
+	100% error.
+
+	Parameters
+	----------
+	records : list of dict
+		Output of sweep
+	max_failed : float, optional
+		Configurations whose fits fail on a larger fraction of pixels are
+		neither Pareto-optimal nor compared against, as failing fast is not a
+		trade-off
+
+	Returns
+	-------
+	table : list of dict
+		One per (method, fit_form), sorted fastest first, with error (mean over
+		conditions), worst_error, failed, pixels_per_s, and pareto (bool)
+	"""
+	configs = {}
+	for rec in records:
+		configs.setdefault((rec['method'], rec['fit_form']), []).append(rec)
+
+	table = []
+	for (method, fit_form), recs in configs.items():
+		err = np.array([r['error'] if np.isfinite(r['error']) else 1.0 for r in recs])
+		table.append({'method': method, 'fit_form': fit_form,
+					  'error': float(err.mean()),
+					  'worst_error': float(err.max()),
+					  'failed': float(np.mean([r['failed'] for r in recs])),
+					  'pixels_per_s': float(np.mean([r['pixels_per_s'] for r in recs]))})
+
+	valid = [row for row in table if row['failed'] <= max_failed]
+	for row in table:
+		row['pareto'] = row['failed'] <= max_failed and not any(
+			(o['pixels_per_s'] >= row['pixels_per_s'] and o['error'] <= row['error'] and
+			 (o['pixels_per_s'] > row['pixels_per_s'] or o['error'] < row['error']))
+			for o in valid)
+
+	table.sort(key=lambda r: -r['pixels_per_s'])
+
+	return table
+
+
+def fastest(records, max_error=0.1, noise=None, n_avgs=None):
+	"""
+	The fastest configuration whose error meets a target
+
+	Parameters
+	----------
+	records : list of dict
+		Output of sweep
+	max_error : float, optional
+		Largest acceptable relative tau error, in every matching condition
+	noise, n_avgs : float, int, optional
+		Only consider these conditions (e.g. the noise level of your data)
+
+	Returns
+	-------
+	dict or None
+		The row of pareto() for the chosen configuration
+	"""
+	recs = [r for r in records if (noise is None or r['noise'] == noise) and
+			(n_avgs is None or r['n_avgs'] == n_avgs)]
+
+	for row in pareto(recs):
+		if row['worst_error'] <= max_error:
+			return row
+
+	return None
+
+
+def print_table(table):
+
+	print('{:<10}{:<10}{:>12}{:>14}{:>10}{:>14}{:>8}'.format('Method', 'Fit', 'Error (%)', 'Worst (%)',
+															 'Failed', 'Pixels/s', 'Pareto'))
+	for row in table:
+		print('{:<10}{:<10}{:>12.2f}{:>14.2f}{:>10.2f}{:>14.1f}{:>8}'.format(row['method'], row['fit_form'],
+																			 100 * row['error'],
+																			 100 * row['worst_error'],
+																			 row['failed'], row['pixels_per_s'],
+																			 '*' if row['pareto'] else ''))
+
+	return
+
+
+def main(argv=None):
+
+	parser = argparse.ArgumentParser(description='Speed versus accuracy of ffta processing configurations')
+	parser.add_argument('--out', default='', help='Path of the JSON output (records and Pareto table)')
+	parser.add_argument('--methods', nargs='+', default=list(METHODS), choices=METHODS)
+	parser.add_argument('--fit-forms', nargs='+', default=list(FIT_FORMS))
+	parser.add_argument('--taus', nargs='+', type=float, default=[3e-6, 2e-5, 1e-4])
+	parser.add_argument('--noises', nargs='+', type=float, default=[0.0, 0.1])
+	parser.add_argument('--averages', nargs='+', type=int, default=[1, 10])
+	parser.add_argument('--pixels', type=int, default=4, help='Noisy pixels per condition')
+	parser.add_argument('--drive', default='mechanical', choices=list(synthetic.DRIVES))
+	parser.add_argument('--max-error', type=float, default=0.1,
+						help='Accuracy target for choosing the fastest configuration')
+	parser.add_argument('--max-failed', type=float, default=0.5,
+						help='Largest fraction of failed fits for a Pareto-optimal configuration')
+	args = parser.parse_args(argv)
+
+	records = sweep(args.methods, args.fit_forms, args.taus, args.noises,
+					args.averages, args.pixels, args.drive)
+	table = pareto(records, args.max_failed)
+	print_table(table)
+
+	best = fastest(records, args.max_error)
+	if best is None:
+		print('No configuration meets an error of', args.max_error)
+	else:
+		print('Fastest within {:.0%}: {} / {}'.format(args.max_error, best['method'], best['fit_form']))
+
+	if args.out:
+		save_json({'records': records, 'pareto': table}, args.out)
+
+	return table
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,263 @@
+"""bench.py: Throughput and peak-memory benchmarks of Pixel, Line and FFtrEFM on simulated data."""
+
+__author__ = "Rajiv Giridharagopal"
+__copyright__ = "Copyright 2020"
+__maintainer__ = "Rajiv Giridharagopal"
+__email__ = "rgiri@uw.edu"
+__status__ = "Development"
+
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import scipy
+
+from ffta.pixel import Pixel
+from ffta.line import Line
+from ffta.pixel_utils.parameters import PixelParameters, METHODS
+from ffta.benchmarks import synthetic
+
+"""
+Benchmarks the processing chain on reproducible simulated data
+
+Example usage:
+	From the command line
+	>> python -m ffta.benchmarks --out before.json
+	>> python -m ffta.benchmarks --out after.json --compare before.json
+
+	From Python
+	>> from ffta.benchmarks import bench
+	>> report = bench.run(n_pixels=8)
+	>> bench.save_json(report, 'bench.json')
+"""
+
+# 'ringdown' expects ringdown data, not an FF-trEFM transient
+FIT_FORMS = ('product', 'sum', 'exp', 'phase')
+
+
+def measure(func, n_pixels, repeats=3):
+	"""
+	Times func (best of repeats) and then measures its peak traced memory in one extra call
+
+	Parameters
+	----------
+	func : callable
+		Called with no arguments; processes n_pixels pixels
+	n_pixels : int
+	repeats : int, optional
+
+	Returns
+	-------
+	dict
+		n_pixels, seconds, pixels_per_s, and peak_mb (Python allocations in this process)
+	"""
+	times = []
+	for _ in range(repeats):
+		t0 = time.perf_counter()
+		func()
+		times.append(time.perf_counter() - t0)
+
+	tracemalloc.start()
+	func()
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	seconds = min(times)
+
+	return {'n_pixels': int(n_pixels),
+			'seconds': seconds,
+			'pixels_per_s': n_pixels / seconds,
+			'peak_mb': peak / 1e6}
+
+
+def bench_pixel(methods=METHODS, fit_forms=FIT_FORMS, n_pixels=8, tau=1e-5,
+				n_avgs=1, noise=0.0, drive='mechanical', repeats=3):
+	"""
+	Times Pixel.analyze for every combination of method and fit_form
+
+	Returns
+	-------
+	list of dict
+	"""
+	signal_array, params = synthetic.simulate_pixel(tau, n_avgs, noise, drive)
+	records = []
+
+	for method in methods:
+		for fit_form in fit_forms:
+
+			config = PixelParameters.from_dict(params, method=method, fit_form=fit_form)
+
+			def func():
+				for _ in range(n_pixels):
+					Pixel(signal_array, config).analyze()
+
+			rec = {'name': 'pixel', 'method': method, 'fit_form': fit_form}
+			rec.update(measure(func, n_pixels, repeats))
+			records.append(rec)
+
+	return records
+
+
+def bench_line(n_pixels=32, taus=(1e-6, 1e-5, 1e-4), n_avgs=4, noise=0.05,
+			   drive='mechanical', repeats=3):
+	"""
+	Times Line.analyze on a simulated line
+
+	Returns
+	-------
+	list of dict
+	"""
+	line_taus = synthetic.tau_map(1, n_pixels, taus).ravel()
+	signal_array, params = synthetic.simulate_line(line_taus, n_avgs, noise, drive)
+
+	def func():
+		Line(signal_array, params, n_pixels).analyze()
+
+	rec = {'name': 'line', 'method': 'hilbert', 'fit_form': 'product', 'n_avgs': n_avgs}
+	rec.update(measure(func, n_pixels, repeats))
+
+	return [rec]
+
+
+def bench_process(n_rows=4, n_cols=16, taus=(1e-6, 1e-5, 1e-4), noise=0.05,
+				  drive='mechanical', cores=1, repeats=1):
+	"""
+	Times FFtrEFM.compute on a simulated image in a temporary HDF5 file
+
+	Returns
+	-------
+	list of dict
+	"""
+	import pyUSID as usid
+	from ffta.hdf_utils.process import FFtrEFM
+
+	signals, params, _ = synthetic.simulate_image(n_rows, n_cols, taus, noise, drive)
+	n_pixels = n_rows * n_cols
+
+	with tempfile.TemporaryDirectory() as tmp:
+
+		h5_avg = synthetic.write_h5(os.path.join(tmp, 'bench.h5'), signals, params, n_rows, n_cols)
+
+		def func():
+			parm_dict = usid.hdf_utils.get_attributes(h5_avg)
+			data = FFtrEFM(h5_avg, parm_dict=parm_dict, override=True, cores=cores, verbose=False)
+			data.compute(override=True)
+
+		try:
+			rec = {'name': 'process', 'method': 'hilbert', 'fit_form': 'product', 'cores': cores}
+			rec.update(measure(func, n_pixels, repeats))
+		finally:
+			h5_avg.file.close()
+
+	return [rec]
+
+
+def run(n_pixels=8, methods=METHODS, fit_forms=FIT_FORMS, drive='mechanical',
+		repeats=3, process=True, verbose=True):
+	"""
+	Runs all benchmarks
+
+	Returns
+	-------
+	report : dict
+		'environment' (versions, platform), 'settings', and 'results' (list of records)
+	"""
+	settings = {'n_pixels': n_pixels, 'methods': list(methods), 'fit_forms': list(fit_forms),
+				'drive': drive, 'repeats': repeats}
+
+	results = bench_pixel(methods, fit_forms, n_pixels, drive=drive, repeats=repeats)
+	results += bench_line(4 * n_pixels, drive=drive, repeats=repeats)
+
+	if process:
+		results += bench_process(n_cols=2 * n_pixels, drive=drive)
+
+	report = {'environment': {'python': platform.python_version(),
+							  'numpy': np.__version__,
+							  'scipy': scipy.__version__,
+							  'platform': platform.platform(),
+							  'time': time.strftime('%Y-%m-%d %H:%M:%S')},
+			  'settings': settings,
+			  'results': results}
+
+	if verbose:
+		print_table(results)
+
+	return report
+
+
+def _key(rec):
+
+	return '{}/{}/{}'.format(rec['name'], rec['method'], rec['fit_form'])
+
+
+def print_table(results):
+
+	print('{:<28}{:>10}{:>14}{:>12}'.format('Benchmark', 'Pixels', 'Pixels/s', 'Peak (MB)'))
+	for rec in results:
+		print('{:<28}{:>10d}{:>14.1f}{:>12.2f}'.format(_key(rec), rec['n_pixels'],
+													   rec['pixels_per_s'], rec['peak_mb']))
+
+	return
+
+
+def save_json(report, path):
+
+	with open(path, 'w') as f:
+		json.dump(report, f, indent=2)
+
+	return
+
+
+def compare(old, new):
+	"""
+	Compares two reports (dicts or paths to JSON files)
+
+	Returns
+	-------
+	dict
+		Maps each benchmark present in both to its speed-up (new pixels/s over old)
+	"""
+	reports = []
+	for r in (old, new):
+		if isinstance(r, str):
+			with open(r) as f:
+				r = json.load(f)
+		reports.append({_key(rec): rec for rec in r['results']})
+
+	speedup = {}
+	for key, rec in reports[1].items():
+		if key in reports[0]:
+			speedup[key] = rec['pixels_per_s'] / reports[0][key]['pixels_per_s']
+
+	return speedup
+
+
+def main(argv=None):
+
+	parser = argparse.ArgumentParser(description='Benchmarks ffta on simulated FF-trEFM data')
+	parser.add_argument('--out', default='', help='Path of the JSON report')
+	parser.add_argument('--compare', default='', help='Earlier JSON report to compare against')
+	parser.add_argument('--pixels', type=int, default=8, help='Pixels per Pixel benchmark')
+	parser.add_argument('--methods', nargs='+', default=list(METHODS), choices=METHODS)
+	parser.add_argument('--fit-forms', nargs='+', default=list(FIT_FORMS))
+	parser.add_argument('--drive', default='mechanical', choices=list(synthetic.DRIVES))
+	parser.add_argument('--repeats', type=int, default=3)
+	parser.add_argument('--no-process', action='store_true', help='Skip the FFtrEFM benchmark')
+	args = parser.parse_args(argv)
+
+	report = run(args.pixels, args.methods, args.fit_forms, args.drive,
+				 args.repeats, process=not args.no_process)
+
+	if args.out:
+		save_json(report, args.out)
+
+	if args.compare:
+		for key, ratio in compare(args.compare, report).items():
+			print('{:<28}{:>8.2f}x'.format(key, ratio))
+
+	return report
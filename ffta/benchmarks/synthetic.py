@@ -0,0 +1,223 @@
+"""synthetic.py: Reproducible simulated FF-trEFM pixels, lines and images with known tau."""
+
+__author__ = "Rajiv Giridharagopal"
+__copyright__ = "Copyright 2020"
+__maintainer__ = "Rajiv Giridharagopal"
+__email__ = "rgiri@uw.edu"
+__status__ = "Development"
+
+import os
+from functools import lru_cache
+
+import numpy as np
+
+from ffta.simulation import load
+from ffta.simulation.mechanical_drive import MechanicalDrive
+from ffta.simulation.electric_drive import ElectricDrive
+
+_SIM_DIR = os.path.dirname(load.__file__)
+
+# Simulation configuration used for each drive type
+DRIVES = {'mechanical': (MechanicalDrive, os.path.join(_SIM_DIR, 'example_sim_params.cfg')),
+		  'electric': (ElectricDrive, os.path.join(_SIM_DIR, 'example_sim_params_roundnumbers_elec.cfg'))}
+
+# Keys of Cantilever.parameters that the Pixel class uses
+PIXEL_KEYS = ['trigger', 'total_time', 'sampling_rate', 'drive_freq', 'roi',
+			  'window', 'bandpass_filter', 'filter_bandwidth', 'n_taps']
+
+# Short enough to simulate quickly, long enough for the default roi after the trigger
+TOTAL_TIME = 1e-3
+
+
+@lru_cache(maxsize=64)
+def _simulate(tau, drive, total_time):
+
+	cls, path = DRIVES[drive]
+	can_params, force_params, sim_params = load.simulation_configuration(path)
+	force_params['tau'] = tau
+	sim_params['total_time'] = total_time
+
+	if drive == 'electric':
+		cant = cls(can_params, force_params, sim_params, v_step=0.0)
+	else:
+		cant = cls(can_params, force_params, sim_params)
+
+	Z, _ = cant.simulate()
+	Z.setflags(write=False)  # cached, shared between callers
+
+	params = {k: cant.parameters[k] for k in PIXEL_KEYS}
+
+	return Z, params
+
+
+def simulate_signal(tau, drive='mechanical', total_time=TOTAL_TIME):
+	"""
+	Simulates one noise-free cantilever response. Results are cached per tau.
+
+	Parameters
+	----------
+	tau : float
+		Time constant of the single-exponential excitation, in seconds
+	drive : str, optional
+		'mechanical' (MechanicalDrive) or 'electric' (ElectricDrive)
+	total_time : float, optional
+		Length of the signal, in seconds
+
+	Returns
+	-------
+	Z : (n_points,) ndarray
+		Cantilever deflection (read-only)
+	params : dict
+		Pixel-compatible processing parameters for this signal
+	"""
+	if drive not in DRIVES:
+		raise ValueError('drive must be one of ' + ', '.join(DRIVES))
+
+	Z, params = _simulate(float(tau), drive, float(total_time))
+
+	return Z, dict(params)
+
+
+def add_noise(Z, n_avgs=1, noise=0.0, seed=0):
+	"""
+	Repeats a signal as n_avgs averages with additive Gaussian noise
+
+	Parameters
+	----------
+	Z : (n_points,) ndarray
+	n_avgs : int, optional
+		Number of averages (columns) to return
+	noise : float, optional
+		Standard deviation of the noise relative to the standard deviation of Z
+	seed : int, optional
+		Seed of the random generator, for reproducibility
+
+	Returns
+	-------
+	signal_array : (n_points, n_avgs) ndarray
+	"""
+	signal_array = np.repeat(Z[:, np.newaxis], n_avgs, axis=1)
+
+	if noise > 0:
+		rng = np.random.default_rng(seed)
+		signal_array += rng.normal(0, noise * Z.std(), signal_array.shape)
+
+	return signal_array
+
+
+def simulate_pixel(tau=1e-5, n_avgs=1, noise=0.0, drive='mechanical', seed=0):
+	"""
+	Returns
+	-------
+	signal_array : (n_points, n_avgs) ndarray
+		Input to ffta.pixel.Pixel
+	params : dict
+	"""
+	Z, params = simulate_signal(tau, drive)
+
+	return add_noise(Z, n_avgs, noise, seed), params
+
+
+def simulate_line(taus, n_avgs=1, noise=0.0, drive='mechanical', seed=0):
+	"""
+	Simulates a line with one tau per pixel
+
+	Parameters
+	----------
+	taus : array_like
+		Ground-truth tau of each pixel, in seconds
+	n_avgs, noise, drive, seed :
+		See simulate_pixel. Each pixel uses seed + its index.
+
+	Returns
+	-------
+	signal_array : (n_points, n_pixels * n_avgs) ndarray
+		Input to ffta.line.Line
+	params : dict
+	"""
+	blocks = []
+	for i, tau in enumerate(taus):
+		signal_array, params = simulate_pixel(tau, n_avgs, noise, drive, seed + i)
+		blocks.append(signal_array)
+
+	return np.hstack(blocks), params
+
+
+def tau_map(n_rows, n_cols, taus=(1e-6, 1e-5, 1e-4)):
+	"""
+	Ground-truth tau image: columns step through taus, so every row is the same
+
+	Returns
+	-------
+	(n_rows, n_cols) ndarray
+	"""
+	taus = np.asarray(taus, dtype=float)
+	col_taus = taus[np.arange(n_cols) * taus.shape[0] // n_cols]
+
+	return np.tile(col_taus, (n_rows, 1))
+
+
+def simulate_image(n_rows, n_cols, taus=(1e-6, 1e-5, 1e-4), noise=0.0,
+				   drive='mechanical', seed=0):
+	"""
+	Simulates a pixel-averaged image in the FF_Avg layout
+
+	Returns
+	-------
+	signals : (n_rows * n_cols, n_points) ndarray
+		One (averaged) signal per pixel, rows in scan order
+	params : dict
+	taus : (n_rows, n_cols) ndarray
+		Ground-truth tau of each pixel
+	"""
+	taus = tau_map(n_rows, n_cols, taus)
+
+	signals, params = simulate_line(taus.ravel(), 1, noise, drive, seed)
+
+	return signals.T, params, taus
+
+
+def write_h5(h5_path, signals, params, n_rows, n_cols):
+	"""
+	Writes simulated signals as an FF_Avg USID main dataset, e.g. for FFtrEFM
+
+	Parameters
+	----------
+	h5_path : str
+		File to create
+	signals : (n_rows * n_cols, n_points) ndarray
+	params : dict
+		Processing parameters, saved as attributes
+	n_rows, n_cols : int
+
+	Returns
+	-------
+	h5_avg : USIDataset
+		The main dataset. The file is left open; close it with h5_avg.file.close()
+	"""
+	import h5py
+	import pyUSID as usid
+	from pyUSID.io.write_utils import Dimension
+
+	parm_dict = dict(params)
+	parm_dict.update({'num_rows': n_rows, 'num_cols': n_cols,
+					  'pnts_per_avg': signals.shape[1], 'pnts_per_pixel': 1,
+					  'pnts_per_line': n_cols,
+					  'FastScanSize': 1e-6, 'SlowScanSize': 1e-6})
+
+	pos_desc = [Dimension('X', 'm', np.linspace(0, parm_dict['FastScanSize'], n_cols)),
+				Dimension('Y', 'm', np.linspace(0, parm_dict['SlowScanSize'], n_rows))]
+	spec_desc = [Dimension('Time', 's', np.linspace(0, parm_dict['total_time'], signals.shape[1]))]
+
+	h5_file = h5py.File(h5_path, 'w')
+	ff_avg_group = h5_file.create_group('FF_Group').create_group('FF_Avg')
+	for p in parm_dict:
+		ff_avg_group.attrs[p] = parm_dict[p]
+
+	h5_avg = usid.hdf_utils.write_main_dataset(ff_avg_group, signals.astype(np.float32),
+											   'FF_Avg', 'Deflection', 'V',
+											   pos_desc, spec_desc,
+											   main_dset_attrs=parm_dict)
+	h5_file.flush()
+
+	return h5_avg
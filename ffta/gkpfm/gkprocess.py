@@ -10,6 +10,7 @@ import ffta
 from ffta.pixel import Pixel
 from ffta.gkpfm.gkpixel import GKPixel
 from ffta.pixel_utils import badpixels
+from ffta.pixel_utils.results import PixelResults
 import os
 import numpy as np
 from ffta.load import get_utils
@@ -164,8 +165,8 @@ class GKPFM(FFtrEFM):
 		_gk = GKPixel(defl, self.parm_dict, exc_wfm=self.exc_wfm,
 					  TF_norm=self.TF_norm)
 
-        _gk.min_phase(phases_to_test=phases_to_test, noise_tolerance=self.parm_dict['noise_tolerance'])
-        _gk.force_out(plot=True, noise_tolerance=self.parm_dict['noise_tolerance'])
+		_gk.min_phase(phases_to_test=phases_to_test, noise_tolerance=self.parm_dict['noise_tolerance'])
+		_gk.force_out(plot=True, noise_tolerance=self.parm_dict['noise_tolerance'])
 
 		if self.parm_dict['denoise']:
 			print('aa')
@@ -181,7 +182,7 @@ class GKPFM(FFtrEFM):
 
 		self.cpd_dict = _gk._calc_cpd_params(return_dict=True, periods=self.parm_dict['periods'])
 
-		_, _, _, = self._map_function(defl, self.parm_dict, self.TF_norm, self.exc_wfm)
+		self._map_function(defl, self.parm_dict, self.TF_norm, self.exc_wfm)
 
 		return _gk
 
@@ -296,17 +297,19 @@ class GKPFM(FFtrEFM):
 		In this case, there isn't any more additional post-processing required
 		'''
 		# Find out the positions to write to:
-		pos_in_batch = self._get_pixels_in_current_batch()
+		pos_in_batch = self._batch_selection()
 
-		# unflatten the list of results, which are [inst_freq array, amp, phase, tfp, shift]
-		_force = np.array([j for i in self._results for j in i[:1]])
-		_cpd = np.array([j for i in self._results for j in i[1:2]])
-		_capacitance = np.array([j for i in self._results for j in i[2:3]])
+		# self._results is a PixelResults record for the whole batch
+		self._write_batch(pos_in_batch, self._results)
 
-		# write the results to the file
-		self.h5_force[pos_in_batch, :] = _force
-		self.h5_cpd[pos_in_batch, :] = _cpd[:, :self.h5_cpd.shape[1]]
-		self.h5_cap[pos_in_batch, :] = _capacitance[:, :self.h5_cap.shape[1]]
+		return
+
+	def _write_batch(self, pos_in_batch, results):
+		'''Writes the PixelResults record of one batch (also used by pipeline=True)'''
+
+		self.h5_force[pos_in_batch, :] = results['force']
+		self.h5_cpd[pos_in_batch, :] = results['cpd'][:, :self.h5_cpd.shape[1]]
+		self.h5_cap[pos_in_batch, :] = results['capacitance'][:, :self.h5_cap.shape[1]]
 
 		return
 
@@ -338,13 +341,39 @@ class GKPFM(FFtrEFM):
 		if self.verbose and self.mpi_rank == 0:
 			print("Rank {} at Process class' default _unit_computation() that "
 				  "will call parallel_compute()".format(self.mpi_rank))
-		self._results = parallel_compute(self.data, self._map_function, cores=self._cores,
-										 lengthy_computation=False,
-										 func_args=args, func_kwargs=kwargs,
-										 verbose=self.verbose)
+		if self._use_pool():
+			self._results = self._pool_compute(self._map_block, args)
+			return
+
+		_results = parallel_compute(self.data, self._map_function, cores=self._cores,
+									lengthy_computation=False,
+									func_args=args, func_kwargs=kwargs,
+									verbose=self.verbose)
+
+		# One record for the batch, rows in the same order as self.data
+		self._results = PixelResults.concatenate(_results, out=self._last_results())
+
+	def _trace_datasets(self):
+		'''The (PixelResults trace name, h5 dataset) pairs that are written'''
+
+		return [('force', self.h5_force), ('cpd', self.h5_cpd), ('capacitance', self.h5_cap)]
+
+	@staticmethod
+	def _map_block(block, *args, **kwargs):
+		'''Analyzes a block of pixels one by one, for the worker pool'''
+
+		return PixelResults.concatenate([GKPFM._map_function(defl, *args) for defl in block])
 
 	@staticmethod
 	def _map_function(defl, *args, **kwargs):
+		'''
+		Analyzes one pixel
+
+		Returns
+		-------
+		results : PixelResults
+			Single-row record with the force, cpd, and capacitance traces
+		'''
 
 		parm_dict = args[0]
 		TF_norm = args[1]
@@ -362,10 +391,12 @@ class GKPFM(FFtrEFM):
 		if parm_dict['filter_cpd']:
 			cpd = gaussian_filter1d(gk.CPD, 1)[:gk.num_CPD]
 
-		capacitance = gk.capacitance
-		force = gk.force
+		traces = {'force': gk.force, 'cpd': cpd, 'capacitance': gk.capacitance}
+		results = PixelResults(1, {k: len(v) for k, v in traces.items()}, dtype=np.float32)
+		for name, values in traces.items():
+			results.set_trace(name, 0, values)
 
-		return [force, cpd, capacitance]
+		return results
 
 
 def save_CSV_from_file(h5_file, h5_path='/', append='', mirror=False):
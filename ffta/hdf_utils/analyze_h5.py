@@ -14,6 +14,7 @@ from matplotlib import pyplot as plt
 from ffta.load import get_utils
 from ffta.hdf_utils import hdf_utils
 from ffta.pixel_utils import badpixels
+from ffta.pixel_utils import liveplot
 import pycroscopy as px
 import pyUSID as usid
 
@@ -26,7 +27,7 @@ Analyzes an HDF_5 format trEFM data set and writes the result into that file
 
 
 def process(h5_file, ds='FF_Raw', ref='', clear_filter=False,
-			verbose=True, liveplots=True, **kwargs):
+			verbose=True, liveplots=True, n_threads=1, **kwargs):
 	"""
 	Processes FF_Raw dataset in the HDF5 file
 	
@@ -41,7 +42,7 @@ def process(h5_file, ds='FF_Raw', ref='', clear_filter=False,
 	>> import pycroscopy as px
 	>> h5_file = px.io.HDFwriter('path_to_h5_file.h5').file
 	>> from ffta import analyze_h5
-	>> tfp, shift, inst_freq = analyze_h5.process(h5_file, ref = '/FF_Group/FF_Avg/FF_Avg')
+	>> tfp, shift, h5_if = analyze_h5.process(h5_file, ref = '/FF_Group/FF_Avg/FF_Avg')
 	
 	Parameters
 	----------
@@ -64,7 +65,14 @@ def process(h5_file, ds='FF_Raw', ref='', clear_filter=False,
 	
 	liveplots : bool
 		Displaying can sometimes cause the window to pop in front of other active windows
-		in Matplotlib. This disables it, with an obvious drawback of no feedback.
+		in Matplotlib. This disables it, with an obvious drawback of no feedback;
+		no figure is made at all, so it also suits headless runs.
+		When on, the images are redrawn a few times per second at most (see
+		ffta.pixel_utils.liveplot) while the lines are analyzed on another thread.
+	
+	n_threads : int, optional
+		Number of threads used to analyze the pixels of each line (see Line).
+		The threads are shared between lines.
 	
 	Returns
 	-------
@@ -72,10 +80,13 @@ def process(h5_file, ds='FF_Raw', ref='', clear_filter=False,
 		time-to-first-peak image array
 	shift : ndarray
 		frequency shift image array
-	inst_freq : ndarray (2D)
-		instantaneous frequency array, an N x p array of N=rows\*cols points
-			and where p = points_per_signal (e.g. 16000 for 1.6 ms @10 MHz sampling)
 	h5_if : USIDataset of h5_if (instantaneous frequency)
+		instantaneous frequency, an N x p array of N=rows\*cols points
+			and where p = points_per_signal (e.g. 16000 for 1.6 ms @10 MHz sampling)
+		Each line is written to the file as it is analyzed, so this is read
+		from disk on demand, e.g. h5_if[()] to load it all into memory.
+		This replaces the former (inst_freq, h5_if) pair: an in-memory inst_freq
+		array no longer fits for large images.
 	
 	"""
 	#    logging.basicConfig(filename='error.log', level=logging.INFO)
@@ -95,7 +106,7 @@ def process(h5_file, ds='FF_Raw', ref='', clear_filter=False,
 		parameters = get_utils.get_params(h5_ds)
 
 	elif ds != 'FF_Raw':
-		h5_ds = usid.hdf_utils.find_dataset(h5_file, ds)[-1]
+		h5_ds = get_utils.find_dataset(h5_file, ds)[-1]
 		parameters = get_utils.get_params(h5_ds)
 
 	else:
@@ -123,92 +134,90 @@ def process(h5_file, ds='FF_Raw', ref='', clear_filter=False,
 	# Initialize arrays.
 	tfp = np.zeros([num_rows, num_cols])
 	shift = np.zeros([num_rows, num_cols])
-	inst_freq = np.zeros([num_rows * num_cols, pnts_per_avg])
 
-	# Initialize plotting.
+	# inst_freq is written into the file line by line rather than held in memory
+	h5_if = save_IF(h5_ds.parent, (num_rows * num_cols, pnts_per_avg), parameters)
 
-	plt.ion()
-	fig, a = plt.subplots(nrows=2, ncols=2, figsize=(13, 6))
+	# Initialize plotting. With liveplots off no figure is made at all.
+	live = None
+	if liveplots:
 
-	tfp_ax = a[0][1]
-	shift_ax = a[1][1]
+		plt.ion()
+		fig, a = plt.subplots(nrows=2, ncols=2, figsize=(13, 6))
 
-	img_length = parameters['FastScanSize']
-	img_height = parameters['SlowScanSize']
-	kwargs = {'origin': 'lower', 'x_vec': img_length * 1e6,
-			  'y_vec': img_height * 1e6, 'num_ticks': 5, 'stdevs': 3}
+		tfp_ax = a[0][1]
+		shift_ax = a[1][1]
 
-	try:
-		ht = h5_file['/height/Raw_Data'][:, 0]
-		ht = np.reshape(ht, [num_cols, num_rows]).transpose()
-		ht_ax = a[0][0]
-		ht_image, cbar = usid.viz.plot_utils.plot_map(ht_ax, ht * 1e9, cmap='gray', **kwargs)
-		cbar.set_label('Height (nm)', rotation=270, labelpad=16)
-	except:
-		pass
+		img_length = parameters['FastScanSize']
+		img_height = parameters['SlowScanSize']
+		kwargs = {'origin': 'lower', 'x_vec': img_length * 1e6,
+				  'y_vec': img_height * 1e6, 'num_ticks': 5, 'stdevs': 3}
 
-	tfp_ax.set_title('tFP Image')
-	shift_ax.set_title('Shift Image')
+		try:
+			ht = h5_file['/height/Raw_Data'][:, 0]
+			ht = np.reshape(ht, [num_cols, num_rows]).transpose()
+			ht_ax = a[0][0]
+			ht_image, cbar = usid.viz.plot_utils.plot_map(ht_ax, ht * 1e9, cmap='gray', **kwargs)
+			cbar.set_label('Height (nm)', rotation=270, labelpad=16)
+		except:
+			pass
 
-	tfp_image, cbar_tfp = usid.viz.plot_utils.plot_map(tfp_ax, tfp * 1e6,
-													   cmap='inferno', show_cbar=False, **kwargs)
-	shift_image, cbar_sh = usid.viz.plot_utils.plot_map(shift_ax, shift,
-														cmap='inferno', show_cbar=False, **kwargs)
-	text = tfp_ax.text(num_cols / 2, num_rows + 3, '')
-	plt.show()
+		tfp_ax.set_title('tFP Image')
+		shift_ax.set_title('Shift Image')
 
-	print('Analyzing with roi of', parameters['roi'])
+		tfp_image, cbar_tfp = usid.viz.plot_utils.plot_map(tfp_ax, tfp * 1e6,
+														   cmap='inferno', show_cbar=False, **kwargs)
+		shift_image, cbar_sh = usid.viz.plot_utils.plot_map(shift_ax, shift,
+															cmap='inferno', show_cbar=False, **kwargs)
+		plt.show()
 
-	# Load every file in the file list one by one.
-	for i in range(num_rows):
+		live = liveplot.LiveImages((num_rows, num_cols), artists=[tfp_image, shift_image])
 
-		line_inst = get_utils.get_line(h5_ds, i, params=parameters)
-
-		if clear_filter:
-			line_inst.clear_filter_flags()
+	print('Analyzing with roi of', parameters['roi'])
 
-		_tfp, _shf, _if = line_inst.analyze()
-		tfp[i, :] = _tfp.T
-		shift[i, :] = _shf.T
-		inst_freq[i * num_cols:(i + 1) * num_cols, :] = _if.T
+	def analyze_lines():
 
-		if liveplots:
-			tfp_image, _ = usid.viz.plot_utils.plot_map(tfp_ax, tfp * 1e6,
-														cmap='inferno', show_cbar=False, **kwargs)
-			shift_image, _ = usid.viz.plot_utils.plot_map(shift_ax, shift,
-														  cmap='inferno', show_cbar=False, **kwargs)
+		# Load every line one by one; the next line is read while this one is analyzed.
+		for i, line_inst in get_utils.iter_lines(h5_ds, params=parameters, n_threads=n_threads):
 
-			tfp_sc = tfp[tfp.nonzero()] * 1e6
-			tfp_image.set_clim(vmin=tfp_sc.min(), vmax=tfp_sc.max())
+			if clear_filter:
+				line_inst.clear_filter_flags()
 
-			shift_sc = shift[shift.nonzero()]
-			shift_image.set_clim(vmin=shift_sc.min(), vmax=shift_sc.max())
+			_tfp, _shf, _if = line_inst.analyze()
+			tfp[i, :] = _tfp.T
+			shift[i, :] = _shf.T
+			h5_if[i * num_cols:(i + 1) * num_cols, :] = _if.T
 
-			tfpmean = 1e6 * tfp[i, :].mean()
-			tfpstd = 1e6 * tfp[i, :].std()
+			if live is not None:
+				live.update(i, tfp[i, :], shift[i, :])
 
 			if verbose:
-				string = ("Line {0:.0f}, average tFP (us) ="
-						  " {1:.2f} +/- {2:.2f}".format(i + 1, tfpmean, tfpstd))
-				print(string)
+				tfpmean = 1e6 * tfp[i, :].mean()
+				tfpstd = 1e6 * tfp[i, :].std()
+				print("Line {0:.0f}, average tFP (us) ="
+					  " {1:.2f} +/- {2:.2f}".format(i + 1, tfpmean, tfpstd))
 
-				text.remove()
-				text = tfp_ax.text((num_cols - len(string)) / 2, num_rows + 4, string)
+			del line_inst  # Delete the instance to open up memory.
 
-			# plt.draw()
-			plt.pause(0.0001)
+		return
 
-		del line_inst  # Delete the instance to open up memory.
+	# Live images are drawn from this thread, at a capped rate, while the lines
+	# are analyzed on another
+	if live is None:
+		analyze_lines()
+	else:
+		live.run(analyze_lines)
 
-	tfp_image, cbar_tfp = usid.viz.plot_utils.plot_map(tfp_ax, tfp * 1e6, cmap='inferno', **kwargs)
-	cbar_tfp.set_label('Time (us)', rotation=270, labelpad=16)
-	shift_image, cbar_sh = usid.viz.plot_utils.plot_map(shift_ax, shift, cmap='inferno', **kwargs)
-	cbar_sh.set_label('Frequency Shift (Hz)', rotation=270, labelpad=16)
-	text = tfp_ax.text(num_cols / 2, num_rows + 3, '')
+	if liveplots:
 
-	plt.show()
+		tfp_image, cbar_tfp = usid.viz.plot_utils.plot_map(tfp_ax, tfp * 1e6, cmap='inferno', **kwargs)
+		cbar_tfp.set_label('Time (us)', rotation=270, labelpad=16)
+		shift_image, cbar_sh = usid.viz.plot_utils.plot_map(shift_ax, shift, cmap='inferno', **kwargs)
+		cbar_sh.set_label('Frequency Shift (Hz)', rotation=270, labelpad=16)
 
-	h5_if = save_IF(h5_ds.parent, inst_freq, parameters)
+		plt.show()
+
+	h5_if.file.flush()
 	_, _, tfp_fixed = save_ht_outs(h5_if.parent, tfp, shift)
 
 	# save_CSV(h5_path, tfp, shift, tfp_fixed, append=ds)
@@ -219,11 +228,30 @@ def process(h5_file, ds='FF_Raw', ref='', clear_filter=False,
 			  'h5_if.file.close()',
 			  '...and then reopen the file as needed.')
 
-	return tfp, shift, inst_freq, h5_if
+	return tfp, shift, h5_if
 
 
 def save_IF(h5_gp, inst_freq, parm_dict):
-	""" Adds Instantaneous Frequency as a main dataset """
+	"""
+	Adds Instantaneous Frequency as a main dataset
+
+	Parameters
+	----------
+	h5_gp : h5Py Group
+		The new 'processed' group is made in this group
+
+	inst_freq : ndarray or tuple
+		The (rows\*cols, pnts_per_avg) inst_freq array, or only its shape to make
+		an empty dataset to be filled in later (e.g. line by line, see process).
+		The dataset is chunked by pixel either way.
+
+	parm_dict : dict
+		Scan parameters, saved as attributes
+
+	Returns
+	-------
+	h5_if : USIDataset
+	"""
 	# Error check
 	if isinstance(h5_gp, h5py.Dataset):
 		raise ValueError('Must pass an h5Py group')
@@ -252,11 +280,13 @@ def save_IF(h5_gp, inst_freq, parm_dict):
 											  pos_desc,  # Position dimensions
 											  spec_desc,  # Spectroscopic dimensions
 											  dtype=np.float32,  # data type / precision
-											  main_dset_attrs=parm_dict)
+											  main_dset_attrs=parm_dict,
+											  chunks=(1, pnts_per_avg))
 
 	usid.hdf_utils.copy_attributes(h5_if, h5_gp)
 
 	h5_if.file.flush()
+	get_utils.invalidate(h5_if)
 
 	return h5_if
 
@@ -289,6 +319,7 @@ def save_ht_outs(h5_gp, tfp, shift):
 	shift_px = h5_gp.create_dataset('shift', data=shift, dtype=np.float32)
 	tfp_fixed_px = h5_gp.create_dataset('tfp_fixed', data=tfp_fixed, dtype=np.float32)
 	h5_gp.attrs['timestamp'] = get_time_stamp()
+	get_utils.invalidate(h5_gp)
 
 	return tfp_px, shift_px, tfp_fixed_px
 
@@ -309,11 +340,11 @@ def save_CSV_from_file(h5_file, h5_path='/', append='', mirror=False):
 		text to append to file name
 	"""
 
-	tfp = usid.hdf_utils.find_dataset(h5_file[h5_path], 'tfp')[0][()]
-	tfp_fixed = usid.hdf_utils.find_dataset(h5_file[h5_path], 'tfp_fixed')[0][()]
-	shift = usid.hdf_utils.find_dataset(h5_file[h5_path], 'shift')[0][()]
+	tfp = get_utils.find_dataset(h5_file[h5_path], 'tfp')[0][()]
+	tfp_fixed = get_utils.find_dataset(h5_file[h5_path], 'tfp_fixed')[0][()]
+	shift = get_utils.find_dataset(h5_file[h5_path], 'shift')[0][()]
 
-	print(usid.hdf_utils.find_dataset(h5_file[h5_path], 'shift')[0].parent.name)
+	print(get_utils.find_dataset(h5_file[h5_path], 'shift')[0].parent.name)
 
 	path = h5_file.file.filename.replace('\\', '/')
 	path = '/'.join(path.split('/')[:-1]) + '/'
@@ -354,17 +385,17 @@ def plot_tfps(h5_file, h5_path='/', append='', savefig=True, stdevs=2):
 	h5_file = px.io.HDFwriter(h5_file).file
 	
 	try:
-		h5_if = usid.hdf_utils.find_dataset(h5_file[h5_path], 'Inst_Freq')[0]
+		h5_if = get_utils.find_dataset(h5_file[h5_path], 'Inst_Freq')[0]
 	except:
-		h5_if = usid.hdf_utils.find_dataset(h5_file[h5_path], 'inst_freq')[0]
+		h5_if = get_utils.find_dataset(h5_file[h5_path], 'inst_freq')[0]
 	parm_dict = get_utils.get_params(h5_if)
   #  parm_dict = usid.hdf_utils.get_attributes(h5_file[h5_path])
 
 	if 'Dataset' in str(type(h5_file[h5_path])):
 		h5_path = h5_file[h5_path].parent.name
 
-	tfp = usid.hdf_utils.find_dataset(h5_file[h5_path], 'tfp')[0][()]
-	shift = usid.hdf_utils.find_dataset(h5_file[h5_path], 'shift')[0][()]
+	tfp = get_utils.find_dataset(h5_file[h5_path], 'tfp')[0][()]
+	shift = get_utils.find_dataset(h5_file[h5_path], 'shift')[0][()]
 	
 	if tfp.shape[1] == 1:
 		# Forgot to reconvert and/or needs to be converted
@@ -373,7 +404,7 @@ def plot_tfps(h5_file, h5_path='/', append='', savefig=True, stdevs=2):
 		shift = np.reshape(shift, [ysz, xsz])
 	
 	try:
-		tfp_fixed = usid.hdf_utils.find_dataset(h5_file[h5_path], 'tfp_fixed')[0][()]
+		tfp_fixed = get_utils.find_dataset(h5_file[h5_path], 'tfp_fixed')[0][()]
 	except:
 		tfp_fixed, _ = badpixels.fix_array(tfp, threshold=2)
 		tfp_fixed = np.array(tfp_fixed)
@@ -54,7 +54,7 @@ def _which_h5_group(h5_path):
 	# h5_path is a file path
 	if 'str' in ftype:
 		hdf = px.io.HDFwriter(h5_path)
-		p = usid.hdf_utils.find_dataset(hdf.file, 'FF_Raw')[0]
+		p = get_utils.find_dataset(hdf.file, 'FF_Raw')[0]
 
 		return p.parent
 
@@ -64,7 +64,7 @@ def _which_h5_group(h5_path):
 
 	# h5_path is an HDF File
 	elif 'File' in ftype:
-		p = usid.hdf_utils.find_dataset(h5_path, 'FF_Raw')[0]
+		p = get_utils.find_dataset(h5_path, 'FF_Raw')[0]
 
 		p = p.parent
 
@@ -173,7 +173,7 @@ def add_standard_sets(h5_path, group, fast_x=32e-6, slow_y=8e-6,
 	h5_main = hdf.file[grp.name]
 
 	if any(ds):
-		h5_main = usid.hdf_utils.find_dataset(hdf.file[grp.name], ds)[0]
+		h5_main = get_utils.find_dataset(hdf.file[grp.name], ds)[0]
 
 	try:
 		usid.hdf_utils.link_h5_objects_as_attrs(h5_main, usid.hdf_utils.get_h5_obj_refs(aux_ds_names, h5_refs))
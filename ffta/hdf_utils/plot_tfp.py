@@ -36,9 +36,9 @@ def plot_tfps(h5_file, h5_path='/', append='', savefig=True, stdevs=2):
 	"""
 
 	try:
-		h5_if = usid.hdf_utils.find_dataset(h5_file[h5_path], 'Inst_Freq')[0]
+		h5_if = get_utils.find_dataset(h5_file[h5_path], 'Inst_Freq')[0]
 	except:
-		h5_if = usid.hdf_utils.find_dataset(h5_file[h5_path], 'inst_freq')[0]
+		h5_if = get_utils.find_dataset(h5_file[h5_path], 'inst_freq')[0]
 
 	parm_dict = get_utils.get_params(h5_if)
 	#  parm_dict = usid.hdf_utils.get_attributes(h5_file[h5_path])
@@ -46,8 +46,8 @@ def plot_tfps(h5_file, h5_path='/', append='', savefig=True, stdevs=2):
 	if 'Dataset' in str(type(h5_file[h5_path])):
 		h5_path = h5_file[h5_path].parent.name
 
-	tfp = usid.hdf_utils.find_dataset(h5_file[h5_path], 'tfp')[0][()]
-	shift = usid.hdf_utils.find_dataset(h5_file[h5_path], 'shift')[0][()]
+	tfp = get_utils.find_dataset(h5_file[h5_path], 'tfp')[0][()]
+	shift = get_utils.find_dataset(h5_file[h5_path], 'shift')[0][()]
 
 	if tfp.shape[1] == 1:
 		# Forgot to reconvert and/or needs to be converted
@@ -56,7 +56,7 @@ def plot_tfps(h5_file, h5_path='/', append='', savefig=True, stdevs=2):
 		shift = np.reshape(shift, [ysz, xsz])
 
 	try:
-		tfp_fixed = usid.hdf_utils.find_dataset(h5_file[h5_path], 'tfp_fixed')[0][()]
+		tfp_fixed = get_utils.find_dataset(h5_file[h5_path], 'tfp_fixed')[0][()]
 	except:
 		tfp_fixed, _ = badpixels.fix_array(tfp, threshold=2)
 		tfp_fixed = np.array(tfp_fixed)
@@ -8,17 +8,44 @@ Created on Tue Feb 11 18:07:06 2020
 import pyUSID as usid
 import ffta
 from ffta.pixel import Pixel
+from ffta.line import Line
 from ffta.pixel_utils import badpixels
+from ffta.pixel_utils import output
+from ffta.pixel_utils.parameters import PixelParameters, STAGES
+from ffta.pixel_utils import results as pixel_results
+from ffta.pixel_utils.results import PixelResults
+from ffta.pixel_utils import timing
+from ffta.pixel_utils import workers
+from ffta.pixel_utils.timing import StageTimer
 import os
+import json
+import weakref
 import numpy as np
 from ffta.load import get_utils
 from pyUSID.processing.comp_utils import parallel_compute
 from pyUSID.io.write_utils import Dimension
 import h5py
+from concurrent.futures import ThreadPoolExecutor
 
 from matplotlib import pyplot as plt
 
 
+# Trace outputs of FFtrEFM: PixelResults name -> (dataset name, quantity, units, attribute)
+TRACE_DATASETS = {'inst_freq': ('Inst_Freq', 'Frequency', 'Hz', 'h5_if'),
+				  'amplitude': ('Amplitude', 'Amplitude', 'nm', 'h5_amp'),
+				  'phase': ('Phase', 'Phase', 'degrees', 'h5_phase'),
+				  'power_dissipated': ('PowerDissipation', 'Power', 'W', 'h5_pwrdis')}
+
+OUTPUTS = ('tfp', 'shift') + tuple(TRACE_DATASETS)
+
+# Traces a cached results group needs for its pixels to be refit, see FFtrEFM(cache=True)
+CACHED_TRACES = ('inst_freq', 'amplitude', 'phase')
+
+# Maps stored for every variant of a ParameterSweep; status is the fit status
+# code (see ffta.pixel_utils.results), e.g. to tell a failed fit from a NaN tfp
+SWEEP_MAPS = ('tfp', 'shift', 'rms', 'status')
+
+
 class FFtrEFM(usid.Process):
 	"""
 	Implements the pixel-by-pixel processing using ffta.pixel routines
@@ -42,7 +69,9 @@ class FFtrEFM(usid.Process):
 
 	def __init__(self, h5_main, parm_dict={}, can_params={},
 				 pixel_params={}, if_only=False, override=False, process_name='Fast_Free',
-				 **kwargs):
+				 timer=None, chunks=None, compression=None, compression_opts=None,
+				 shuffle=None, scaleoffset=None, outputs=None, trace_window=None,
+				 pipeline=False, block_size=64, worker_pool=False, cache=False, **kwargs):
 		"""
 		Parameters
 		----------
@@ -81,18 +110,81 @@ class FFtrEFM(usid.Process):
 		override : bool, optional
 			If True, forces creation of new results group. Use in _get_existing_datasets
 	
+		timer : ffta.pixel_utils.timing.StageTimer, optional
+			If given, records the time of the read, compute, and write stages of each
+			batch and of every Pixel stage (aggregated over all pixels and workers).
+			The summary table is written to the results group as 'stage_timing'.
+	
+		chunks : tuple, optional
+			(pixels, points) chunk shape of the Inst_Freq, Amplitude, Phase, and
+			PowerDissipation datasets. By default see results_chunks, which keeps
+			both a single pixel's trace and a time slice of the image cheap to read.
+			Compute batches are trimmed to whole chunks of pixels.
+	
+		compression : str, optional
+			'lzf' (fast) or 'gzip' (smaller) filter for those datasets. Default none.
+	
+		compression_opts : int, optional
+			gzip level, 0-9
+	
+		shuffle : bool, optional
+			Byte shuffle before compressing, which helps floats compress.
+			Default True when compressing.
+	
+		scaleoffset : int or dict, optional
+			Lossy HDF5 scale-offset filter: the number of decimal digits kept,
+			either for every trace dataset or as {dataset name: digits},
+			e.g. {'Inst_Freq': 2, 'Phase': 3}. Not suited to PowerDissipation (W).
+	
+		outputs : list of str, optional
+			Traces to store, any of 'inst_freq', 'amplitude', 'phase', and
+			'power_dissipated' (default: all). tfp and shift are always stored,
+			e.g. outputs=[] for the maps alone.
+	
+		trace_window : tuple, optional
+			(t_start, t_stop) in s, on the same time axis as the stored traces.
+			Only this part of each trace is stored, and the Time dimension is
+			trimmed to match. Default is the whole trace.
+	
+		pipeline : bool, optional
+			If True, compute reads the next batch and writes the last one while
+			the current batch is computed (see _compute_pipelined). Not with MPI.
+	
+		block_size : int, optional
+			Most pixels sent to a worker at once; each block is analyzed with
+			array operations over all its pixels (see _map_block). None sends
+			one pixel at a time to _map_function.
+	
+		worker_pool : bool or WorkerPool, optional
+			If True (and cores > 1, without MPI), the blocks are analyzed by a pool
+			of processes started on the first batch and kept until close(). Each
+			batch is passed to the workers, and the results back, in shared memory
+			instead of being pickled (see ffta.pixel_utils.workers). A WorkerPool
+			that is already running can be given instead, e.g. to share one between
+			several datasets; it is used, but not stopped by close().
+	
+		cache : bool, optional
+			If True, compute reuses earlier results of this dataset, found by the
+			hashes of their parameters that every results group records (see
+			_cached_group). A complete group made with the same parameters is
+			returned as is. If only the fit parameters changed (e.g. roi, fit_form,
+			recombination), the Inst_Freq, Amplitude, and Phase of a group with the
+			same instantaneous frequency parameters are refit instead of analyzing
+			the deflection again, each pixel with the drive frequency it was analyzed
+			with (see Pixel.check_drive_freq), which is stored in 'drive_freq'. With
+			cache, the traces are stored as float64 rather than float32, twice the
+			size, so that a refit gives the same tfp as a full analysis; groups
+			with float32 traces are not refit. Not with MPI or override.
+	
 		kwargs : dictionary or variable
 			Keyword pairs to pass to Process constructor
 		"""
 
-		self.parm_dict = parm_dict
-		self.parm_dict['if_only'] = if_only
-		if not any(parm_dict):
+		# A copy, so neither the caller's dictionary nor the default is changed
+		self.parm_dict = dict(parm_dict)
+		if not any(self.parm_dict):
 			self.parm_dict = usid.hdf_utils.get_attributes(h5_main)
-			self.parm_dict.update({'if_only': if_only})
-
-		for key, val in parm_dict.items():
-			self.parm_dict.update({key: val})
+		self.parm_dict['if_only'] = if_only
 
 		if any(can_params):
 			if 'Initial' in can_params:  # only care about the initial conditions
@@ -104,6 +196,37 @@ class FFtrEFM(usid.Process):
 
 		self.pixel_params = pixel_params
 		self.override = override
+		self.timer = timer
+		self.pipeline = pipeline
+		self.block_size = block_size
+		self.worker_pool = worker_pool
+		self._pool = None
+		self.cache = cache
+		self._trace_source = None  # results group whose traces are refit, see cache
+		self.h5_drive_freq = None  # drive frequency of each pixel, stored with cache
+		self._pixels = None  # PixelAccessor for test(), created on first use
+
+		# Layout and filters of the trace datasets
+		self.chunks = chunks
+		self.compression = compression
+		self.compression_opts = compression_opts
+		self.shuffle = shuffle
+		self.scaleoffset = scaleoffset
+
+		if outputs is None:
+			outputs = list(TRACE_DATASETS)
+		unknown = [name for name in outputs if name not in OUTPUTS]
+		if any(unknown):
+			raise ValueError('Unknown outputs {}, choose from {}'.format(unknown, OUTPUTS))
+		self.outputs = [name for name in TRACE_DATASETS if name in outputs]
+		self.trace_window = trace_window
+
+		# Recorded with the results (and so part of the duplicate check)
+		self.parm_dict['outputs'] = ','.join(self.outputs)
+		if trace_window is not None:
+			self.parm_dict['trace_window'] = [float(t) for t in trace_window]
+		else:
+			self.parm_dict.pop('trace_window', None)
 
 		super(FFtrEFM, self).__init__(h5_main, process_name, parms_dict=self.parm_dict, **kwargs)
 
@@ -127,6 +250,8 @@ class FFtrEFM(usid.Process):
 		if 'Spectroscopic_Values' in self.parm_dict:
 			del self.parm_dict['Spectroscopic_Values']
 
+		self._keep_groups_made_here()
+
 		return
 
 	def update_parm(self, **kwargs):
@@ -150,13 +275,9 @@ class FFtrEFM(usid.Process):
 
 		Returns
 		-------
-		[inst_freq, tfp, shift] : List
-			inst_freq : array
-				the instantaneous frequency array for that pixel
-			tfp : float
-				the time to first peak
-			shift : float
-				the frequency shift at time t=tfp (i.e. maximum frequency shift)
+		results : PixelResults
+			Single-row record of the pixel, e.g. results['tfp'], results['shift'],
+			and results['inst_freq'] (the instantaneous frequency array)
 
 		"""
 		# First read the HDF5 dataset to get the deflection for this pixel
@@ -166,15 +287,323 @@ class FFtrEFM(usid.Process):
 			row = int(np.floor(pixel_ind % self.parm_dict['num_rows']))
 			pixel_ind = [row, col]
 
-		# as an array, not an ffta.Pixel
-		defl = get_utils.get_pixel(self.h5_main, pixel_ind, array_form=True)
+		# as an array, not an ffta.Pixel; recently tested lines stay in memory
+		if self._pixels is None:
+			self._pixels = get_utils.PixelAccessor(self.h5_main)
+		defl = self._pixels.get_pixel(pixel_ind, array_form=True)
 
-		pix = Pixel(defl, self.parm_dict, **self.pixel_params)
+		config = self._pixel_config()
+		pix = Pixel(defl, config, **self.pixel_params)
 
 		tfp, shift, inst_freq = pix.analyze()
 		pix.plot()
 
-		return self._map_function(defl, self.parm_dict, self.pixel_params)
+		return self._map_function(defl, config, self.pixel_params)
+
+	def _pixel_config(self):
+		'''
+		Validates the current parameters once for the whole image
+
+		Returns
+		-------
+		PixelParameters
+			Shared by every Pixel; this is what is sent to the parallel workers
+		'''
+		options = {k: v for k, v in self.pixel_params.items() if k != 'pycroscopy'}
+
+		return PixelParameters.from_dict(self.parm_dict, **options)
+
+	def compute(self, override=False, *args, **kwargs):
+		'''
+		Runs the Process; see pyUSID.Process.compute.
+		If a timer was given, the stage timings are printed and saved to the results group.
+		'''
+		# The parameters may have changed since __init__, see update_parm
+		self._keep_groups_made_here()
+
+		if self._use_cache(override):
+
+			index = self._cached_group('tfp')
+			if index is not None:
+				self._get_existing_datasets(index)
+				print('Returned previously computed results at ' + self.h5_results_grp.name)
+				return self.h5_results_grp
+
+			index = None
+			if not self.parm_dict.get('if_only', False):
+				index = self._cached_group('inst_freq')
+			if index is not None:
+				self._trace_source = usid.hdf_utils.find_results_groups(self.h5_main, self.process_name)[index]
+				print('Refitting the traces in ' + self._trace_source.name)
+
+		try:
+			# Refits read the traces themselves, see _read_rows
+			if (self.pipeline and self.mpi_size == 1) or self._trace_source is not None:
+				h5_results_grp = self._compute_pipelined(override, *args, **kwargs)
+			else:
+				h5_results_grp = super(FFtrEFM, self).compute(override, *args, **kwargs)
+		finally:
+			self._trace_source = None
+
+		if self.timer is not None and self.h5_results_grp is not None:
+			self.timer.write(self.h5_results_grp)
+			print(self.timer)
+
+		return h5_results_grp
+
+	def _compute_pipelined(self, override=False, *args, **kwargs):
+		'''
+		Same as pyUSID.Process.compute, but batch k+1 is read on one thread and
+		batch k-1 written on another while batch k is computed.
+
+		At most three batches are in memory. The results of a batch are
+		flushed before its pixels are marked as done in the status dataset,
+		so an interrupted computation resumes exactly as with compute.
+		'''
+		if not override:
+			if len(self.duplicate_h5_groups) > 0:
+				print('Returned previously computed results at ' + self.duplicate_h5_groups[-1].name)
+				self.h5_results_grp = self.duplicate_h5_groups[-1]
+				return self.h5_results_grp
+			elif len(self.partial_h5_groups) > 0 and self.h5_results_grp is None:
+				print('Resuming computation in group: ' + self.partial_h5_groups[-1].name)
+				self.use_partial_computation()
+
+		if self.h5_results_grp is None:
+			self._create_results_datasets()
+		else:
+			self._get_existing_datasets()
+
+		h5_status = self._status_dataset()
+		jobs = np.where(h5_status[()] == 0)[0]
+		batches = [jobs[i:i + self._max_pos_per_read]
+				   for i in range(0, jobs.shape[0], self._max_pos_per_read)]
+
+		# The reader and writer threads keep their own timers, merged at the end
+		read_timer = write_timer = None
+		if self.timer is not None:
+			read_timer, write_timer = StageTimer(), StageTimer()
+
+		reader = ThreadPoolExecutor(1, thread_name_prefix='ffta-read')
+		writer = ThreadPoolExecutor(1, thread_name_prefix='ffta-write')
+		try:
+
+			next_read = None
+			if batches:
+				next_read = reader.submit(self._read_batch, batches[0], read_timer)
+
+			written = None  # the write in flight, and the results it is writing
+			spare = None  # results whose write has finished, refilled by the next batch
+			for k, positions in enumerate(batches):
+
+				self.data = next_read.result()
+				if k + 1 < len(batches):
+					next_read = reader.submit(self._read_batch, batches[k + 1], read_timer)
+
+				self._results = spare
+				self._unit_computation(*args, **kwargs)
+
+				if written is not None:
+					written[0].result()
+					spare = written[1]
+
+				written = (writer.submit(self._write_and_mark, positions, self._results,
+										 h5_status, write_timer), self._results)
+
+				print('{}% complete'.format(int(100 * (k + 1) / len(batches))))
+
+			if written is not None:
+				written[0].result()
+
+		finally:
+			reader.shutdown(wait=True)
+			writer.shutdown(wait=True)
+
+		self.data = None
+		if self.timer is not None:
+			self.timer.merge(read_timer).merge(write_timer)
+
+		print('Finished processing the entire dataset!')
+		self.h5_results_grp.attrs['last_pixel'] = self.h5_main.shape[0]
+
+		return self.h5_results_grp
+
+	def _status_dataset(self):
+		'''
+		The compute status dataset of the results group (1 = pixel done),
+		created as pyUSID.Process.compute would
+		'''
+		if self._status_dset_name in self.h5_results_grp:
+			self._h5_status_dset = self.h5_results_grp[self._status_dset_name]
+
+		else:
+			self._h5_status_dset = self.h5_results_grp.create_dataset(self._status_dset_name, dtype=np.uint8,
+																	  shape=(self.h5_main.shape[0],))
+			# Resuming from a computation from before the status dataset
+			completed_pixels = self.h5_results_grp.attrs.get('last_pixel', 0)
+			if completed_pixels > 0:
+				self._h5_status_dset[:completed_pixels] = 1
+
+		return self._h5_status_dset
+
+	def _read_batch(self, positions, timer=None):
+		'''Reads the pixels at positions (sorted) from h5_main, for _compute_pipelined'''
+
+		with timing.stage(timer, 'read'):
+			return self._read_rows(batch_selection(positions))
+
+	def _read_rows(self, selection):
+		'''
+		The deflection of the pixels at selection or, when refitting (see cache),
+		their stored traces
+
+		Returns
+		-------
+		data : ndarray
+			(pixels, points), or (pixels, 4, points) for the CACHED_TRACES and
+			the drive frequency of each pixel, repeated along the points
+		'''
+		if self._trace_source is None:
+			return self.h5_main[selection, :]
+
+		traces = [self._trace_source[TRACE_DATASETS[name][0]][selection, :] for name in CACHED_TRACES]
+		drive_freq = self._trace_source['drive_freq'][selection, :]
+		traces.append(np.broadcast_to(drive_freq, traces[0].shape))
+
+		return np.stack(traces, axis=1)
+
+	def _use_cache(self, override=False):
+		'''Whether compute looks for earlier results to reuse, see cache'''
+
+		return (self.cache and not override and not self.override and self.mpi_size == 1 and
+				self.h5_results_grp is None and len(self.partial_h5_groups) == 0 and
+				len(self.duplicate_h5_groups) == 0)
+
+	def _trace_dtype(self):
+		'''Data type of the stored traces: float64 with cache, so that they can be refit exactly'''
+
+		return np.float64 if self.cache else np.float32
+
+	def _stage_digest(self, stage):
+		'''
+		Hash of everything the results of one processing stage depend on: this
+		dataset and process (find_results_groups also lists the groups of
+		processes whose names start with process_name, e.g. sweeps), the
+		parameters (see PixelParameters.stage_digest), and, for the stored
+		tfp and traces, the outputs and trace window
+
+		Parameters
+		----------
+		stage : str
+			One of ffta.pixel_utils.parameters.STAGES
+
+		Returns
+		-------
+		str
+		'''
+		extra = [self.h5_main.name, self.process_name, self.h5_main.shape,
+				 bool(self.parm_dict.get('if_only', False))]
+		if stage == STAGES[-1]:
+			extra += [self.outputs, self.trace_window]
+
+		return self._pixel_config().stage_digest(stage, *extra)
+
+	def _made_here(self, h5_grp):
+		'''
+		Whether the results in h5_grp were made with the current parameters,
+		so that compute may resume (or return) that group
+
+		Groups from before the digests were recorded are checked by pyUSID,
+		which lists those with matching parameters in duplicate_h5_groups
+		and partial_h5_groups.
+		'''
+		if 'tfp_digest' in h5_grp.attrs:
+			return h5_grp.attrs['tfp_digest'] == self._stage_digest(STAGES[-1])
+
+		return any(h5_grp == other for other in self.duplicate_h5_groups + self.partial_h5_groups)
+
+	def _keep_groups_made_here(self):
+		'''
+		Keeps only the groups made with the current parameters (see _made_here)
+		in duplicate_h5_groups and partial_h5_groups, which both compute paths
+		return or resume. pyUSID lists the groups with the same parm_dict, but
+		pixel_params (e.g. fit_form) are not in it, so a rerun with other
+		pixel_params would otherwise return the earlier results.
+		'''
+		made_here = [h5_grp for h5_grp in self.duplicate_h5_groups + self.partial_h5_groups
+					 if self._made_here(h5_grp)]
+
+		self.duplicate_h5_groups = [h5_grp for h5_grp in self.duplicate_h5_groups if h5_grp in made_here]
+		self.partial_h5_groups = [h5_grp for h5_grp in self.partial_h5_groups if h5_grp in made_here]
+
+		return
+
+	def _cached_group(self, stage):
+		'''
+		The newest complete results group of this dataset whose results of
+		stage were made with the current parameters
+
+		Parameters
+		----------
+		stage : str
+			'tfp' for identical results, or 'inst_freq' for a group whose
+			CACHED_TRACES can be refit
+
+		Returns
+		-------
+		index : int or None
+			For find_results_groups (and _get_existing_datasets)
+		'''
+		digest = self._stage_digest(stage)
+		n_pixels = self.h5_main.shape[0]
+		ds_shape = (n_pixels, self.parm_dict['pnts_per_avg'])
+
+		groups = usid.hdf_utils.find_results_groups(self.h5_main, self.process_name)
+		for index in range(len(groups) - 1, -1, -1):
+
+			h5_grp = groups[index]
+			if h5_grp.attrs.get(stage + '_digest') != digest:
+				continue
+
+			if self._status_dset_name in h5_grp:
+				if not np.all(h5_grp[self._status_dset_name][()] == 1):
+					continue
+			elif h5_grp.attrs.get('last_pixel', 0) < n_pixels:
+				continue
+
+			if stage != STAGES[-1]:
+				names = [TRACE_DATASETS[name][0] for name in CACHED_TRACES]
+				if not all(name in h5_grp and h5_grp[name].shape == ds_shape and
+						   h5_grp[name].dtype == np.float64 for name in names):
+					continue
+				if 'drive_freq' not in h5_grp:
+					continue
+
+			return index
+
+		return None
+
+	def _write_and_mark(self, positions, results, h5_status, timer=None):
+		'''Writes one batch, then marks it as done once it is on disk, for _compute_pipelined'''
+
+		pos_in_batch = batch_selection(positions)
+
+		with timing.stage(timer, 'write'):
+			self._write_batch(pos_in_batch, results)
+			self.h5_main.file.flush()
+
+		h5_status[pos_in_batch] = 1
+		self.h5_results_grp.attrs['last_pixel'] = int(positions[-1]) + 1
+		self.h5_main.file.flush()
+
+		return
+
+	def _read_data_chunk(self):
+
+		with timing.stage(self.timer, 'read'):
+			super(FFtrEFM, self)._read_data_chunk()
+
+		return
 
 	def _create_results_datasets(self):
 		'''
@@ -193,91 +622,143 @@ class FFtrEFM(usid.Process):
 		'''
 
 		print('Creating results datasets')
+		if self.cache:
+			print('With cache, the traces are stored as float64, twice the size of float32')
 
 		# Get relevant parameters
 		num_rows = self.parm_dict['num_rows']
 		num_cols = self.parm_dict['num_cols']
 		pnts_per_avg = self.parm_dict['pnts_per_avg']
 
-		ds_shape = [num_rows * num_cols, pnts_per_avg]
+		window = self._trace_window()
+		ds_shape = [num_rows * num_cols, window.stop - window.start]
+
+		# Batches end on chunk boundaries, so no chunk is written twice
+		chunk_pixels = self._dataset_options('Inst_Freq', ds_shape)['chunks'][0]
+		if self._max_pos_per_read > chunk_pixels:
+			self._max_pos_per_read -= self._max_pos_per_read % chunk_pixels
 
 		self.h5_results_grp = usid.hdf_utils.create_results_group(self.h5_main, self.process_name)
 
 		# h5_meas_group = usid.hdf_utils.create_indexed_group(self.h5_main.parent, self.process_name)
 		usid.hdf_utils.copy_attributes(self.h5_main.parent, self.h5_results_grp)
 
+		# So that the same parameters are found as a duplicate, see pyUSID.Process
+		for key, val in self.parm_dict.items():
+			if val is not None:
+				self.h5_results_grp.attrs[key] = val
+
+		# For later runs with cache=True, see _cached_group
+		for stage in STAGES:
+			self.h5_results_grp.attrs[stage + '_digest'] = self._stage_digest(stage)
+
 		# Create dimensions
 		pos_desc = [Dimension('X', 'm', np.linspace(0, self.parm_dict['FastScanSize'], num_cols)),
 					Dimension('Y', 'm', np.linspace(0, self.parm_dict['SlowScanSize'], num_rows))]
 
 		# ds_pos_ind, ds_pos_val = build_ind_val_matrices(pos_desc, is_spectral=False)
-		spec_desc = [Dimension('Time', 's', np.linspace(0, self.parm_dict['total_time'], pnts_per_avg))]
+		time = np.linspace(0, self.parm_dict['total_time'], pnts_per_avg)
+		spec_desc = [Dimension('Time', 's', time[window])]
 		# ds_spec_inds, ds_spec_vals = build_ind_val_matrices(spec_desc, is_spectral=True)
 
-		# Writes main dataset
-		self.h5_if = usid.hdf_utils.write_main_dataset(self.h5_results_grp,
-													   ds_shape,
-													   'Inst_Freq',  # Name of main dataset
-													   'Frequency',  # Physical quantity contained in Main dataset
-													   'Hz',  # Units for the physical quantity
-													   pos_desc,  # Position dimensions
-													   spec_desc,  # Spectroscopic dimensions
-													   dtype=np.float32,  # data type / precision
-													   main_dset_attrs=self.parm_dict)
-
-		self.h5_amp = usid.hdf_utils.write_main_dataset(self.h5_results_grp,
-														ds_shape,
-														'Amplitude',  # Name of main dataset
-														'Amplitude',  # Physical quantity contained in Main dataset
-														'nm',  # Units for the physical quantity
-														None,  # Position dimensions
-														None,  # Spectroscopic dimensions
-														h5_pos_inds=self.h5_main.h5_pos_inds,  # Copy Pos Dimensions
-														h5_pos_vals=self.h5_main.h5_pos_vals,
-														h5_spec_inds=self.h5_main.h5_spec_inds,
-														# Copy Spectroscopy Dimensions
-														h5_spec_vals=self.h5_main.h5_spec_vals,
-														dtype=np.float32,  # data type / precision
-														main_dset_attrs=self.parm_dict)
-
-		self.h5_phase = usid.hdf_utils.write_main_dataset(self.h5_results_grp,
-														  ds_shape,
-														  'Phase',  # Name of main dataset
-														  'Phase',  # Physical quantity contained in Main dataset
-														  'degrees',  # Units for the physical quantity
-														  None,  # Position dimensions
-														  None,  # Spectroscopic dimensions
-														  h5_pos_inds=self.h5_main.h5_pos_inds,  # Copy Pos Dimensions
-														  h5_pos_vals=self.h5_main.h5_pos_vals,
-														  h5_spec_inds=self.h5_main.h5_spec_inds,
-														  # Copy Spectroscopy Dimensions
-														  h5_spec_vals=self.h5_main.h5_spec_vals,
-														  dtype=np.float32,  # data type / precision
-														  main_dset_attrs=self.parm_dict)
-
-		self.h5_pwrdis = usid.hdf_utils.write_main_dataset(self.h5_results_grp,
-														   ds_shape,
-														   'PowerDissipation',  # Name of main dataset
-														   'Power',  # Physical quantity contained in Main dataset
-														   'W',  # Units for the physical quantity
-														   None,  # Position dimensions
-														   None,  # Spectroscopic dimensions
-														   h5_pos_inds=self.h5_main.h5_pos_inds,  # Copy Pos Dimensions
-														   h5_pos_vals=self.h5_main.h5_pos_vals,
-														   h5_spec_inds=self.h5_main.h5_spec_inds,
-														   # Copy Spectroscopy Dimensions
-														   h5_spec_vals=self.h5_main.h5_spec_vals,
-														   dtype=np.float32,  # data type / precision
-														   main_dset_attrs=self.parm_dict)
+		# Only the requested traces are stored, within the trace window
+		for _, _, _, attr in TRACE_DATASETS.values():
+			setattr(self, attr, None)
+
+		first = None
+		for name in self.outputs:
+
+			ds_name, quantity, units, attr = TRACE_DATASETS[name]
+
+			if first is None:
+				dims = {'pos_dims': pos_desc, 'spec_dims': spec_desc}
+			else:
+				dims = {'pos_dims': None, 'spec_dims': None,
+						'h5_pos_inds': first.h5_pos_inds, 'h5_pos_vals': first.h5_pos_vals,
+						'h5_spec_inds': first.h5_spec_inds, 'h5_spec_vals': first.h5_spec_vals}
+
+			h5_trace = usid.hdf_utils.write_main_dataset(self.h5_results_grp,
+														 ds_shape,
+														 ds_name,  # Name of main dataset
+														 quantity,  # Physical quantity contained in Main dataset
+														 units,  # Units for the physical quantity
+														 dtype=self._trace_dtype(),  # data type / precision
+														 main_dset_attrs=self.parm_dict,
+														 **dims,
+														 **self._dataset_options(ds_name, ds_shape))
+			setattr(self, attr, h5_trace)
+			first = h5_trace if first is None else first
 
 		_arr = np.zeros([num_rows * num_cols, 1])
 		self.h5_tfp = self.h5_results_grp.create_dataset('tfp', data=_arr, dtype=np.float32)
 		self.h5_shift = self.h5_results_grp.create_dataset('shift', data=_arr, dtype=np.float32)
 
-		self.h5_if.file.flush()
+		# The traces of each pixel are refit with the drive frequency they were made with
+		self.h5_drive_freq = None
+		if self.cache:
+			self.h5_drive_freq = self.h5_results_grp.create_dataset('drive_freq', data=_arr, dtype=np.float64)
+
+		self.h5_results_grp.file.flush()
+		get_utils.invalidate(self.h5_results_grp)
 
 		return
 
+	def _trace_window(self):
+		'''
+		The points of each trace that are stored, from trace_window
+
+		Returns
+		-------
+		slice
+			slice(start, stop) into the pnts_per_avg points of a trace
+		'''
+		return window_slice(self.trace_window, self.parm_dict['total_time'],
+							self.parm_dict['pnts_per_avg'])
+
+	def _trace_datasets(self):
+		'''The (PixelResults trace name, h5 dataset) pairs that are stored'''
+
+		return [(name, getattr(self, attr)) for name, (_, _, _, attr) in TRACE_DATASETS.items()
+				if getattr(self, attr, None) is not None]
+
+	def _dataset_options(self, name, ds_shape):
+		'''
+		Keyword arguments for creating one of the trace datasets, see __init__
+
+		Parameters
+		----------
+		name : str
+			Dataset name, e.g. 'Inst_Freq'
+		ds_shape : list
+			[num_rows * num_cols, pnts_per_avg]
+
+		Returns
+		-------
+		dict
+			chunks, and compression, shuffle, and scaleoffset if they are used
+		'''
+		chunks = self.chunks
+		if chunks is None:
+			chunks = results_chunks(self.parm_dict['num_cols'], *ds_shape)
+
+		options = {'chunks': tuple(min(c, n) for c, n in zip(chunks, ds_shape))}
+
+		if self.compression is not None:
+			options['compression'] = self.compression
+			if self.compression_opts is not None:
+				options['compression_opts'] = self.compression_opts
+
+		if self.shuffle or (self.shuffle is None and self.compression is not None):
+			options['shuffle'] = True
+
+		scaleoffset = self.scaleoffset
+		if isinstance(scaleoffset, dict):
+			scaleoffset = scaleoffset.get(name)
+		if scaleoffset is not None:
+			options['scaleoffset'] = scaleoffset
+
+		return options
+
 	def reshape(self):
 		'''
 		Reshapes the tFP and shift data to be a matrix, then saves that dataset instead of the 1D
@@ -306,47 +787,72 @@ class FFtrEFM(usid.Process):
 		In this case, there isn't any more additional post-processing required
 		'''
 		# Find out the positions to write to:
-		pos_in_batch = self._get_pixels_in_current_batch()
-
-		# unflatten the list of results, which are [inst_freq array, amp, phase, tfp, shift]
-		_results = np.array([j for i in self._results for j in i[:1]])
-		_amp = np.array([j for i in self._results for j in i[1:2]])
-		_phase = np.array([j for i in self._results for j in i[2:3]])
-		_tfp = np.array([j for i in self._results for j in i[3:4]])
-		_shift = np.array([j for i in self._results for j in i[4:5]])
-		_pwr = np.array([j for i in self._results for j in i[5:]])
-
-		# write the results to the file
-		self.h5_if[pos_in_batch, :] = _results
-		self.h5_amp[pos_in_batch, :] = _amp
-		self.h5_pwrdis[pos_in_batch, :] = _pwr
-		self.h5_phase[pos_in_batch, :] = _phase
-		self.h5_tfp[pos_in_batch, 0] = _tfp
-		self.h5_shift[pos_in_batch, 0] = _shift
+		pos_in_batch = self._batch_selection()
+
+		with timing.stage(self.timer, 'write'):
+			self._write_batch(pos_in_batch, self._results)
+
+		return
+
+	def _write_batch(self, pos_in_batch, results):
+		'''
+		Writes the PixelResults record of one batch, one write per dataset
+
+		Parameters
+		----------
+		pos_in_batch : slice or ndarray
+			Positions of the batch, see _batch_selection
+		results : PixelResults
+		'''
+		for name, h5_trace in self._trace_datasets():
+			h5_trace[pos_in_batch, :] = results[name]
+		self.h5_tfp[pos_in_batch, 0] = results['tfp']
+		self.h5_shift[pos_in_batch, 0] = results['shift']
+		if self.h5_drive_freq is not None:
+			self.h5_drive_freq[pos_in_batch, 0] = results['drive_freq']
 
 		return
 
+	def _batch_selection(self):
+		'''
+		The positions of the current batch, as a slice if they are consecutive
+
+		Returns
+		-------
+		slice or ndarray
+		'''
+		return batch_selection(self._get_pixels_in_current_batch())
+
 	def _get_existing_datasets(self, index=-1):
 		"""
 		Extracts references to the existing datasets that hold the results
 		
-		index = which existing dataset to get
+		index = which existing dataset to get. By default this is the newest
+		results group made with the current parameters (see _made_here); if
+		there is none, h5_results_grp is left as None for compute to create one.
 		
 		"""
 
 		if not self.override:
 
-			self.h5_results_grp = usid.hdf_utils.find_dataset(self.h5_main.parent, 'Inst_Freq')[index].parent
-			self.h5_new_spec_vals = self.h5_results_grp['Spectroscopic_Values']
+			groups = usid.hdf_utils.find_results_groups(self.h5_main, self.process_name)
+			if index == -1:
+				groups = [h5_grp for h5_grp in groups if self._made_here(h5_grp)]
+				if not any(groups):
+					self.h5_results_grp = None
+					return
+
+			# Not every results group has all the traces (see outputs)
+			self.h5_results_grp = groups[index]
 			self.h5_tfp = self.h5_results_grp['tfp']
 			self.h5_shift = self.h5_results_grp['shift']
-			self.h5_if = self.h5_results_grp['Inst_Freq']
-			self.h5_amp = self.h5_results_grp['Amplitude']
-			self.h5_phase = self.h5_results_grp['Phase']
-			try:
-				self.h5_pwrdis = self.h5_results_grp['PowerDissipation']
-			except:
-				pass
+			self.h5_drive_freq = self.h5_results_grp.get('drive_freq')
+			if 'Spectroscopic_Values' in self.h5_results_grp:
+				self.h5_new_spec_vals = self.h5_results_grp['Spectroscopic_Values']
+
+			for ds_name, _, _, attr in TRACE_DATASETS.values():
+				setattr(self, attr, self.h5_results_grp.get(ds_name))
+
 		return
 
 	def _unit_computation(self, *args, **kwargs):
@@ -357,91 +863,1014 @@ class FFtrEFM(usid.Process):
 		# TODO: Try to use the functools.partials to preconfigure the map function
 		# cores = number of processes / rank here
 
-		args = [self.parm_dict, self.pixel_params]
+		# Workers time into their own empty timer, returned with each record
+		worker_timer = None
+		if self.timer is not None:
+			worker_timer = StageTimer(self.timer.allocations)
+
+		args = [self._pixel_config(), self.pixel_params, worker_timer,
+				self.outputs, self._trace_window(), self._trace_dtype()]
 
 		if self.verbose and self.mpi_rank == 0:
 			print("Rank {} at Process class' default _unit_computation() that "
 				  "will call parallel_compute()".format(self.mpi_rank))
-		self._results = parallel_compute(self.data, self._map_function, cores=self._cores,
-										 lengthy_computation=False,
-										 func_args=args, func_kwargs=kwargs,
-										 verbose=self.verbose)
+
+		# Stored traces only need to be fit, see cache
+		map_block = self._map_block if self._trace_source is None else self._fit_block
+
+		if self._use_pool():
+			with timing.stage(self.timer, 'compute'):
+				self._results = self._pool_compute(map_block, args, dtype=self._trace_dtype())
+			if self.timer is not None:
+				self.timer.merge(self._results.timer)
+			return
+
+		with timing.stage(self.timer, 'compute'):
+			if self.block_size is None and self._trace_source is None:
+				_results = parallel_compute(self.data, self._map_function, cores=self._cores,
+											lengthy_computation=False,
+											func_args=args, func_kwargs=kwargs,
+											verbose=self.verbose)
+			else:
+				_results = parallel_compute(self._pixel_blocks(), map_block, cores=self._cores,
+											lengthy_computation=True,
+											func_args=args, func_kwargs=kwargs,
+											verbose=self.verbose)
+
+			# One record for the batch, rows in the same order as self.data;
+			# the buffers of the last batch are refilled if the size matches
+			self._results = PixelResults.concatenate(_results, out=self._last_results())
+
+		if self.timer is not None:
+			self.timer.merge(self._results.timer)
+
+	def _use_pool(self):
+		'''Whether batches go to the persistent worker pool, see worker_pool'''
+
+		return self.worker_pool and self._cores is not None and self._cores > 1 and self.mpi_size == 1
+
+	def _pool_compute(self, func, args, trace_points=None, dtype=np.float32):
+		'''
+		Analyzes self.data in blocks on the persistent worker pool
+
+		Parameters
+		----------
+		func : callable
+			Static method analyzing a block of rows, e.g. _map_block
+		args : list
+			Passed to func with each block
+		trace_points : dict, optional
+			Length of each trace func returns; by default the widths of the
+			trace datasets
+		dtype : numpy dtype, optional
+			Data type of those traces
+
+		Returns
+		-------
+		PixelResults
+			The batch, in shared memory that is reused two batches later
+		'''
+		if self._pool is None:
+			if isinstance(self.worker_pool, workers.WorkerPool):
+				self._pool = self.worker_pool
+			else:
+				self._pool = workers.WorkerPool(self._cores)
+				weakref.finalize(self, self._pool.close)
+
+		if trace_points is None:
+			trace_points = {name: h5_trace.shape[1] for name, h5_trace in self._trace_datasets()}
+		block_size = self.block_size if self.block_size is not None else 64
+
+		return self._pool.map_blocks(func, self.data, block_size, args, trace_points, dtype)
+
+	def close(self):
+		'''Stops the worker pool, if one was started (see worker_pool)'''
+
+		if self._pool is not None:
+			if self._pool is not self.worker_pool:
+				self._pool.close()
+			self._pool = None
+			self._results = None  # it was in the pool's shared memory
+
+		return
+
+	def _pixel_blocks(self):
+		'''Splits self.data into blocks of at most block_size pixels, see pixel_blocks'''
+
+		block_size = self.block_size if self.block_size is not None else 64
+
+		return pixel_blocks(self.data, block_size, self._cores)
+
+	def _last_results(self):
+		'''The PixelResults of the previous batch, if any (written out already)'''
+		results = getattr(self, '_results', None)
+
+		return results if isinstance(results, PixelResults) else None
 
 	@staticmethod
-	def _map_function(defl, *args, **kwargs):
+	def _map_block(block, *args, **kwargs):
+		'''
+		Analyzes a block of pixels, as _map_function does one pixel
 
-		parm_dict = args[0]
-		pixel_params = args[1]
+		The instantaneous frequency, amplitude, and phase of all the pixels
+		are calculated at once (see Line.generate_pixels), then each is fit.
 
-		pix = Pixel(defl, parm_dict, **pixel_params)
+		Parameters
+		----------
+		block : (n_pixels, n_points) array_like
+			Contiguous rows of self.data
+		args : list
+			As for _map_function
 
-		if parm_dict['if_only']:
-			inst_freq, _, _ = pix.generate_inst_freq()
-			tfp = 0
-			shift = 0
-			amplitude = 0
-			phase = 0
-			pwr_diss = 0
-		else:
-			tfp, shift, inst_freq = pix.analyze()
-			pix.calculate_power_dissipation()
-			amplitude = pix.amplitude
-			phase = pix.phase
-			pwr_diss = pix.power_dissipated
+		Returns
+		-------
+		results : PixelResults
+			One row per pixel of the block
+		'''
+		config = args[0]
 
-		return [inst_freq, amplitude, phase, tfp, shift, pwr_diss]
+		timer = None
+		if len(args) > 2 and args[2] is not None:
+			timer = StageTimer(args[2].allocations)
 
+		outputs = args[3] if len(args) > 3 else pixel_results.FFTREFM_TRACES
+		window = args[4] if len(args) > 4 else slice(None)
+		dtype = args[5] if len(args) > 5 else np.float32
 
-def save_CSV_from_file(h5_file, h5_path='/', append='', mirror=False):
-	"""
-	Saves the tfp, shift, and fixed_tfp as CSV files
-	
-	Parameters
-	----------
-	h5_file : H5Py file of FFtrEFM class
-		Reminder you can always type: h5_svd.file or h5_avg.file for this
-	
-	h5_path : str, optional
-		specific folder path to search for the tfp data. Usually not needed.
-	
-	append : str, optional
-		text to append to file name
-	"""
+		block = np.asarray(block)
+		n_pixels, n_points = block.shape
 
-	h5_ff = h5_file
+		line_inst = Line(block.T, config, n_pixels, timer=timer)
 
-	if isinstance(h5_file, ffta.hdf_utils.process.FFtrEFM):
-		print('Saving from FFtrEFM Class')
-		h5_ff = h5_file.h5_main.file
-		h5_path = h5_file.h5_results_grp.name
+		n_points = len(range(n_points)[window])
+		results = PixelResults(n_pixels, {name: n_points for name in outputs}, dtype=dtype)
+		results.timer = timer
 
-	elif not isinstance(h5_file, h5py.File):
-		print('Saving from pyUSID object')
-		h5_ff = h5_file.file
+		if_only = config.extras.get('if_only', False)
+		for i, pix in enumerate(line_inst.generate_pixels()):
+
+			if if_only:
+				results.set_scalars(i, tfp=0, shift=0, status=pixel_results.FIT_SKIPPED,
+									drive_freq=pix.drive_freq)
+				if 'inst_freq' in outputs:
+					results.set_trace('inst_freq', i, pix.inst_freq[window])
+			else:
+				pix.fit_inst_freq()
+				if 'power_dissipated' in outputs:
+					pix.calculate_power_dissipation()
+				pix.fill_results(results, i, window)
 
-	tfp = usid.hdf_utils.find_dataset(h5_ff[h5_path], 'tfp')[0][()]
-	# tfp_fixed = usid.hdf_utils.find_dataset(h5_file[h5_path], 'tfp_fixed')[0][()]
-	shift = usid.hdf_utils.find_dataset(h5_ff[h5_path], 'shift')[0][()]
+		return results
 
-	tfp_fixed, _ = badpixels.fix_array(tfp, threshold=2)
-	tfp_fixed = np.array(tfp_fixed)
+	@staticmethod
+	def _fit_block(block, *args, **kwargs):
+		'''
+		Fits a block of pixels from their stored traces, as _map_block does
+		from the deflection (see cache)
 
-	print(usid.hdf_utils.find_dataset(h5_ff[h5_path], 'shift')[0].parent.name)
+		Parameters
+		----------
+		block : (n_pixels, 4, n_points) array_like
+			The CACHED_TRACES and drive frequency of contiguous pixels, see _read_rows
+		args : list
+			As for _map_function
 
-	path = h5_ff.file.filename.replace('\\', '/')
-	path = '/'.join(path.split('/')[:-1]) + '/'
-	os.chdir(path)
-
-	if mirror:
-		np.savetxt('tfp-' + append + '.csv', np.fliplr(tfp).T, delimiter=',')
-		np.savetxt('shift-' + append + '.csv', np.fliplr(shift).T, delimiter=',')
-		np.savetxt('tfp_fixed-' + append + '.csv', np.fliplr(tfp_fixed).T, delimiter=',')
-	else:
-		np.savetxt('tfp-' + append + '.csv', tfp.T, delimiter=',')
-		np.savetxt('shift-' + append + '.csv', shift.T, delimiter=',')
-		np.savetxt('tfp_fixed-' + append + '.csv', tfp_fixed.T, delimiter=',')
-
-	return
+		Returns
+		-------
+		results : PixelResults
+			One row per pixel of the block
+		'''
+		config = args[0]
+
+		timer = None
+		if len(args) > 2 and args[2] is not None:
+			timer = StageTimer(args[2].allocations)
+
+		outputs = args[3] if len(args) > 3 else pixel_results.FFTREFM_TRACES
+		window = args[4] if len(args) > 4 else slice(None)
+		dtype = args[5] if len(args) > 5 else np.float32
+
+		block = np.asarray(block)
+		n_points = len(range(block.shape[2])[window])
+		results = PixelResults(block.shape[0], {name: n_points for name in outputs}, dtype=dtype)
+		results.timer = timer
+
+		for i, (inst_freq, amplitude, phase, drive_freq) in enumerate(block):
+
+			pix = Pixel.from_traces(inst_freq, config, amplitude, phase, timer=timer,
+									drive_freq=drive_freq[0])
+			pix.fit_inst_freq()
+			if 'power_dissipated' in outputs:
+				pix.calculate_power_dissipation()
+			pix.fill_results(results, i, window)
+
+		return results
+
+	@staticmethod
+	def _map_function(defl, *args, **kwargs):
+		'''
+		Analyzes one pixel
+
+		Returns
+		-------
+		results : PixelResults
+			Single-row record with tfp, shift, rms, popt, status and the
+			requested traces (by default inst_freq, amplitude, phase, and
+			power_dissipated), within the trace window
+		'''
+		config = args[0]
+		pixel_params = args[1]
+
+		timer = None
+		if len(args) > 2 and args[2] is not None:
+			timer = StageTimer(args[2].allocations)
+
+		outputs = args[3] if len(args) > 3 else pixel_results.FFTREFM_TRACES
+		window = args[4] if len(args) > 4 else slice(None)
+		dtype = args[5] if len(args) > 5 else np.float32
+
+		pix = Pixel(defl, config, timer=timer, **pixel_params)
+
+		n_points = len(range(pix.n_points)[window])
+		results = PixelResults(1, {name: n_points for name in outputs}, dtype=dtype)
+		results.timer = timer
+
+		if config.extras.get('if_only', False):
+			pix.generate_inst_freq()
+			results.set_scalars(0, tfp=0, shift=0, status=pixel_results.FIT_SKIPPED,
+								drive_freq=pix.drive_freq)
+			if 'inst_freq' in outputs:
+				results.set_trace('inst_freq', 0, pix.inst_freq[window])
+		else:
+			pix.analyze()
+			if 'power_dissipated' in outputs:
+				pix.calculate_power_dissipation()
+			pix.fill_results(results, 0, window)
+
+		return results
+
+
+class TfpFit(usid.Process):
+	"""
+	Fits tfp and shift from the instantaneous frequency of an earlier FFtrEFM
+	analysis, without analyzing the deflection again
+
+	Only the fit runs, in blocks of pixels and in parallel as in FFtrEFM, so
+	trying another roi or fit_form is quick. The 'ringdown' and 'phase' fits
+	also read the Amplitude or Phase dataset next to Inst_Freq. The tfp,
+	shift, and rms are written to a new results group next to Inst_Freq.
+
+	Example usage:
+
+		>> from ffta.hdf_utils import process
+		>> data = process.FFtrEFM(h5_main, parm_dict=parm_dict, if_only=True)
+		>> data.compute()
+		>> fit = process.TfpFit(data.h5_if, parm_dict={'roi': 5e-4, 'fit_form': 'sum'}, cores=8)
+		>> fit.compute()
+		>> fit.h5_tfp[()], fit.h5_shift[()], fit.h5_rms[()]
+	"""
+
+	def __init__(self, h5_main, parm_dict={}, can_params={}, pixel_params={},
+				 process_name='Tfp_Fit', timer=None, block_size=64, **kwargs):
+		"""
+		Parameters
+		----------
+		h5_main : h5py.Dataset object
+			Inst_Freq dataset of an FFtrEFM results group
+
+		parm_dict : dict, optional
+			Changes to the parameters stored with h5_main, e.g. roi or fit_form
+
+		can_params : dict, optional
+			Cantilever parameters, as for FFtrEFM
+
+		pixel_params : dict, optional
+			Pixel keyword arguments, as for FFtrEFM
+
+		timer : ffta.pixel_utils.timing.StageTimer, optional
+			Records the read, compute, fit, and write stages, as for FFtrEFM
+
+		block_size : int, optional
+			Most pixels sent to a worker at once
+
+		kwargs : dictionary or variable
+			Keyword pairs to pass to Process constructor
+		"""
+
+		# The parameters the traces were made with, and those of the fit
+		self.source_parms = usid.hdf_utils.get_attributes(h5_main)
+		for key in ('Position_Indices', 'Position_Values', 'Spectroscopic_Indices', 'Spectroscopic_Values'):
+			self.source_parms.pop(key, None)
+
+		self.parm_dict = dict(self.source_parms)
+		self.parm_dict.update(parm_dict)
+
+		if 'Initial' in can_params:  # only care about the initial conditions
+			can_params = can_params['Initial']
+		self.parm_dict.update(can_params)
+
+		self.pixel_params = pixel_params
+		self.timer = timer
+		self.block_size = block_size
+
+		self.h5_amp = h5_main.parent.get('Amplitude')
+		self.h5_phase = h5_main.parent.get('Phase')
+		self.h5_tfp = None
+		self.h5_shift = None
+		self.h5_rms = None
+
+		super(TfpFit, self).__init__(h5_main, process_name, parms_dict=self.parm_dict, **kwargs)
+
+		self._source_datasets()  # checks the traces the fit needs are there
+		self._check_window()
+
+		return
+
+	def _pixel_config(self):
+		'''The parameters of the fit, validated once, see FFtrEFM._pixel_config'''
+
+		options = {k: v for k, v in self.pixel_params.items() if k != 'pycroscopy'}
+
+		return PixelParameters.from_dict(self.parm_dict, **options)
+
+	def _source_datasets(self):
+		'''
+		The traces the fit reads, Inst_Freq and Amplitude or Phase if needed
+
+		Returns
+		-------
+		list of (str, h5py.Dataset)
+			Pixel trace name and dataset
+		'''
+		fit_form = self._pixel_config().fit_form
+		sources = [('inst_freq', self.h5_main)]
+
+		for name, form, h5_trace in (('amplitude', 'ringdown', self.h5_amp), ('phase', 'phase', self.h5_phase)):
+
+			if fit_form != form:
+				continue
+
+			if h5_trace is None or self.source_parms.get('if_only', False):
+				raise ValueError("fit_form '{}' needs the {} of the same analysis, which is "
+								 "not stored next to {}".format(form, name, self.h5_main.name))
+			sources.append((name, h5_trace))
+
+		return sources
+
+	def _trace_window(self):
+		'''The points of the full traces that were stored, from the source's trace_window'''
+
+		return window_slice(self.source_parms.get('trace_window'), self.source_parms['total_time'],
+							int(self.source_parms['pnts_per_avg']))
+
+	def _check_window(self):
+		'''
+		Checks that the stored traces are the points of the source's
+		trace_window, and that they hold the trigger and the roi after it
+		'''
+		window = self._trace_window()
+		n_points = window.stop - window.start
+
+		if self.h5_main.shape[1] != n_points:
+			raise ValueError('{} has {} points per pixel, but the trace_window {} of its '
+							 'parameters has {}'.format(self.h5_main.name, self.h5_main.shape[1],
+														self.source_parms.get('trace_window'), n_points))
+
+		config = self._pixel_config()
+		tidx = self._trigger_index() - window.start
+		ridx = int((config.roi or 0) * config.sampling_rate)
+		if tidx < 0 or tidx + ridx > n_points:
+			raise ValueError('The traces of {} (trace_window {}) do not hold the trigger and the '
+							 'roi after it'.format(self.h5_main.name, self.source_parms.get('trace_window')))
+
+		return
+
+	def _trigger_index(self):
+		'''
+		Index of the trigger in the full traces. FFtrEFM restores the traces,
+		except with if_only, where the FIR filter has shifted them (see
+		Pixel.fir_filter); Pixel.fit_inst_freq then restores them. The stored
+		traces start at the first point of the trace_window, see _trace_window.
+		'''
+		source = PixelParameters.from_dict(self.source_parms)
+		tidx = int(source.trigger * source.sampling_rate)
+
+		if (self.source_parms.get('if_only', False) and source.method == 'hilbert' and
+				source.bandpass_filter == 1 and not source.filter_frequency):
+			tidx = int(tidx - (source.n_taps - 1) / 2)
+
+		return tidx
+
+	def compute(self, override=False, *args, **kwargs):
+		'''
+		Runs the Process; see pyUSID.Process.compute.
+		If a timer was given, the stage timings are printed and saved to the results group.
+		'''
+		h5_results_grp = super(TfpFit, self).compute(override, *args, **kwargs)
+
+		if self.timer is not None and self.h5_results_grp is not None:
+			self.timer.write(self.h5_results_grp)
+			print(self.timer)
+
+		return h5_results_grp
+
+	def _create_results_datasets(self):
+		'''Creates the results group next to Inst_Freq, with tfp, shift, and rms'''
+
+		print('Creating results datasets')
+
+		self.h5_results_grp = usid.hdf_utils.create_results_group(self.h5_main, self.process_name)
+
+		# So that the same fit is found as a duplicate, see pyUSID.Process
+		for key, val in self.parm_dict.items():
+			if val is not None:
+				self.h5_results_grp.attrs[key] = val
+
+		_arr = np.zeros([self.h5_main.shape[0], 1])
+		self.h5_tfp = self.h5_results_grp.create_dataset('tfp', data=_arr, dtype=np.float32)
+		self.h5_shift = self.h5_results_grp.create_dataset('shift', data=_arr, dtype=np.float32)
+		self.h5_rms = self.h5_results_grp.create_dataset('rms', data=_arr, dtype=np.float32)
+
+		self.h5_results_grp.file.flush()
+
+		return
+
+	def _get_existing_datasets(self, index=-1):
+		'''
+		Extracts references to the existing datasets that hold the results
+
+		index = which existing results group to get
+		'''
+		if self.h5_results_grp is None:
+			self.h5_results_grp = usid.hdf_utils.find_results_groups(self.h5_main, self.process_name)[index]
+
+		self.h5_tfp = self.h5_results_grp['tfp']
+		self.h5_shift = self.h5_results_grp['shift']
+		self.h5_rms = self.h5_results_grp['rms']
+
+		return
+
+	def _read_data_chunk(self):
+		'''Reads Inst_Freq, and Amplitude or Phase if the fit needs them, as (pixels, traces, points)'''
+
+		with timing.stage(self.timer, 'read'):
+
+			super(TfpFit, self)._read_data_chunk()
+
+			sources = self._source_datasets()
+			if self.data is not None and len(sources) > 1:
+				pos_in_batch = batch_selection(self._get_pixels_in_current_batch())
+				traces = [self.data] + [h5_trace[pos_in_batch, :] for _, h5_trace in sources[1:]]
+				self.data = np.stack(traces, axis=1)
+			elif self.data is not None:
+				self.data = self.data[:, np.newaxis, :]
+
+		return
+
+	def _unit_computation(self, *args, **kwargs):
+		'''Fits the pixels of self.data in blocks, see _map_block'''
+
+		worker_timer = None
+		if self.timer is not None:
+			worker_timer = StageTimer(self.timer.allocations)
+
+		names = [name for name, _ in self._source_datasets()]
+		args = [self._pixel_config(), worker_timer, names, self._trigger_index(), self._trace_window().start]
+
+		with timing.stage(self.timer, 'compute'):
+			_results = parallel_compute(pixel_blocks(self.data, self.block_size, self._cores),
+										self._map_block, cores=self._cores,
+										lengthy_computation=True,
+										func_args=args, func_kwargs=kwargs,
+										verbose=self.verbose)
+
+			self._results = PixelResults.concatenate(_results)
+
+		if self.timer is not None:
+			self.timer.merge(self._results.timer)
+
+		return
+
+	def _write_results_chunk(self):
+		'''Writes tfp, shift, and rms of the current batch'''
+
+		pos_in_batch = batch_selection(self._get_pixels_in_current_batch())
+
+		with timing.stage(self.timer, 'write'):
+			self.h5_tfp[pos_in_batch, 0] = self._results['tfp']
+			self.h5_shift[pos_in_batch, 0] = self._results['shift']
+			self.h5_rms[pos_in_batch, 0] = self._results['rms']
+
+		return
+
+	@staticmethod
+	def _map_block(block, *args, **kwargs):
+		'''
+		Fits a block of pixels
+
+		Parameters
+		----------
+		block : (n_pixels, n_traces, n_points) array_like
+			The traces of contiguous pixels, see _read_data_chunk
+		args : list
+			[config, timer, trace names, trigger index, first point of the
+			traces], see _unit_computation
+
+		Returns
+		-------
+		results : PixelResults
+			tfp, shift, rms, popt, and status of each pixel
+		'''
+		config, worker_timer, names, tidx = args[:4]
+		start = args[4] if len(args) > 4 else 0
+
+		timer = None
+		if worker_timer is not None:
+			timer = StageTimer(worker_timer.allocations)
+
+		block = np.asarray(block)
+		results = PixelResults(block.shape[0])
+		results.timer = timer
+
+		for i, pixel_traces in enumerate(block):
+
+			traces = dict(zip(names, pixel_traces))
+			pix = Pixel.from_traces(traces['inst_freq'], config, traces.get('amplitude'),
+									traces.get('phase'), tidx=tidx, timer=timer, start=start)
+			pix.fit_inst_freq()
+			pix.fill_results(results, i)
+
+		return results
+
+
+class ParameterSweep(FFtrEFM):
+	"""
+	Analyzes a dataset with several sets of parameters in a single pass
+
+	Each batch is read once. The instantaneous frequency is calculated once
+	per distinct setting of the parameters it depends on (e.g. method,
+	filter_bandwidth), and fit for every variant that shares it (e.g. each
+	roi or fit_form). Every variant gets its own tfp, shift, rms, and fit
+	status maps in one results group; no traces are stored.
+
+	Example usage:
+
+		>> from ffta.hdf_utils import process
+		>> variants = [{'roi': 3e-4}, {'roi': 5e-4}, {'fit_form': 'sum'}, {'filter_bandwidth': 10e3}]
+		>> sweep = process.ParameterSweep(h5_main, variants, cores=8)
+		>> sweep.compute()
+		>> sweep.h5_tfp[1][()]  # tfp of the second variant
+	"""
+
+	def __init__(self, h5_main, variants, parm_dict={}, can_params={}, pixel_params={},
+				 process_name='Fast_Free_Sweep', **kwargs):
+		"""
+		Parameters
+		----------
+		h5_main : h5py.Dataset object
+			Dataset to process
+
+		variants : list of dict
+			Changes to the parameters for each variant, e.g. [{'roi': 3e-4}, {'roi': 5e-4}];
+			{} is the parameters as they are
+
+		parm_dict : dict, optional
+			Parameters shared by all the variants, by default the attributes of h5_main
+
+		can_params, pixel_params : dict, optional
+			As for FFtrEFM
+
+		kwargs : dictionary or variable
+			Keyword pairs to pass to FFtrEFM (e.g. cores, pipeline, worker_pool,
+			block_size, timer), except outputs, trace_window, if_only, and cache
+		"""
+		if not any(variants):
+			variants = [{}]
+		self.variants = [dict(variant) for variant in variants]
+
+		parm_dict = dict(parm_dict)
+		if not any(parm_dict):
+			parm_dict = usid.hdf_utils.get_attributes(h5_main)
+
+		# Recorded with the results (and so part of the duplicate check)
+		parm_dict['variants'] = json.dumps(self.variants, sort_keys=True, default=str)
+
+		self.h5_rms = None
+		self.h5_fit_status = None
+
+		super(ParameterSweep, self).__init__(h5_main, parm_dict=parm_dict, can_params=can_params,
+											 pixel_params=pixel_params, process_name=process_name,
+											 outputs=[], **kwargs)
+
+		self._variant_configs()  # validates every variant
+
+		return
+
+	def _variant_configs(self):
+		'''
+		The parameters of each variant, validated
+
+		Returns
+		-------
+		list of PixelParameters
+		'''
+		options = {k: v for k, v in self.pixel_params.items() if k != 'pycroscopy'}
+
+		configs = []
+		for variant in self.variants:
+			params = dict(self.parm_dict)
+			params.update(variant)
+			configs.append(PixelParameters.from_dict(params, **options))
+
+		return configs
+
+	@staticmethod
+	def _variant_groups(configs):
+		'''
+		Groups the variants that share an instantaneous frequency
+
+		Returns
+		-------
+		list of list of int
+			Indices into configs, in order of first appearance
+		'''
+		groups = {}
+		for k, config in enumerate(configs):
+			groups.setdefault(config.stage_digest('inst_freq'), []).append(k)
+
+		return list(groups.values())
+
+	def _create_results_datasets(self):
+		'''
+		Creates the results group, with tfp_000, shift_000, rms_000, status_000,
+		... for each variant. The changes of a variant are attributes of its datasets.
+		'''
+		print('Creating results datasets')
+
+		self.h5_results_grp = usid.hdf_utils.create_results_group(self.h5_main, self.process_name)
+		usid.hdf_utils.copy_attributes(self.h5_main.parent, self.h5_results_grp)
+		self.h5_results_grp.attrs['variants'] = self.parm_dict['variants']
+		self.h5_results_grp.attrs[STAGES[-1] + '_digest'] = self._stage_digest(STAGES[-1])
+
+		_arr = np.zeros([self.h5_main.shape[0], 1])
+		maps = {name: [] for name in SWEEP_MAPS}
+		for k, variant in enumerate(self.variants):
+
+			for name in SWEEP_MAPS:
+
+				if name == 'status':
+					h5_map = self.h5_results_grp.create_dataset('{}_{:03d}'.format(name, k),
+																data=_arr + pixel_results.FIT_SKIPPED,
+																dtype=np.int8)
+				else:
+					h5_map = self.h5_results_grp.create_dataset('{}_{:03d}'.format(name, k), data=_arr,
+																dtype=np.float32)
+				for key, val in variant.items():
+					h5_map.attrs[key] = val
+				maps[name].append(h5_map)
+
+		self.h5_tfp, self.h5_shift, self.h5_rms, self.h5_fit_status = (maps[name] for name in SWEEP_MAPS)
+
+		self.h5_results_grp.file.flush()
+
+		return
+
+	def _get_existing_datasets(self, index=-1):
+		'''
+		Extracts references to the maps of each variant
+		
+		index = which existing results group to get. By default this is the
+		newest group of this sweep (see _made_here); if there is none,
+		h5_results_grp is left as None for compute to create one.
+		'''
+		if not self.override:
+
+			groups = usid.hdf_utils.find_results_groups(self.h5_main, self.process_name)
+			if index == -1:
+				groups = [h5_grp for h5_grp in groups if self._made_here(h5_grp)]
+				if not any(groups):
+					self.h5_results_grp = None
+					return
+
+			self.h5_results_grp = groups[index]
+
+			maps = [[self.h5_results_grp['{}_{:03d}'.format(name, k)] for k in range(len(self.variants))]
+					for name in SWEEP_MAPS]
+			self.h5_tfp, self.h5_shift, self.h5_rms, self.h5_fit_status = maps
+
+		return
+
+	def _made_here(self, h5_grp):
+		'''Whether h5_grp holds the maps of this sweep: the same variants of the same parameters'''
+
+		if h5_grp.attrs.get('variants') != self.parm_dict['variants']:
+			return False
+
+		return super(ParameterSweep, self)._made_here(h5_grp)
+
+	def _variant_maps(self):
+		'''The lists of maps of every variant, in the order of SWEEP_MAPS'''
+
+		return self.h5_tfp, self.h5_shift, self.h5_rms, self.h5_fit_status
+
+	def _use_cache(self, override=False):
+		'''Sweeps do not use FFtrEFM(cache=True)'''
+
+		return False
+
+	def _trace_datasets(self):
+		'''No traces are stored'''
+
+		return []
+
+	def reshape(self):
+		'''Reshapes the maps of every variant to num_rows x num_cols'''
+
+		shape = [self.parm_dict['num_rows'], self.parm_dict['num_cols']]
+
+		for maps in self._variant_maps():
+			for k, h5_map in enumerate(maps):
+
+				name, data, attrs = h5_map.name, np.reshape(h5_map[()], shape), dict(h5_map.attrs)
+				del self.h5_results_grp.file[name]
+				maps[k] = self.h5_results_grp.create_dataset(name, data=data, dtype=data.dtype)
+				maps[k].attrs.update(attrs)
+
+		return
+
+	def _write_batch(self, pos_in_batch, results):
+		'''
+		Writes the maps of every variant for one batch
+
+		Parameters
+		----------
+		pos_in_batch : slice or ndarray
+			Positions of the batch, see _batch_selection
+		results : PixelResults
+			One column per variant in each of SWEEP_MAPS
+		'''
+		for name, maps in zip(SWEEP_MAPS, self._variant_maps()):
+			for k, h5_map in enumerate(maps):
+				h5_map[pos_in_batch, 0] = results[name][:, k]
+
+		return
+
+	def _unit_computation(self, *args, **kwargs):
+		'''Analyzes self.data in blocks for every variant, see _map_block'''
+
+		worker_timer = None
+		if self.timer is not None:
+			worker_timer = StageTimer(self.timer.allocations)
+
+		configs = self._variant_configs()
+		args = [configs, self._variant_groups(configs), worker_timer]
+		trace_points = {name: len(configs) for name in SWEEP_MAPS}
+
+		with timing.stage(self.timer, 'compute'):
+
+			if self._use_pool():
+				self._results = self._pool_compute(self._map_block, args, trace_points)
+			else:
+				_results = parallel_compute(self._pixel_blocks(), self._map_block, cores=self._cores,
+											lengthy_computation=True,
+											func_args=args, func_kwargs=kwargs,
+											verbose=self.verbose)
+				self._results = PixelResults.concatenate(_results, out=self._last_results())
+
+		if self.timer is not None:
+			self.timer.merge(self._results.timer)
+
+		return
+
+	@staticmethod
+	def _map_block(block, *args, **kwargs):
+		'''
+		Analyzes a block of pixels for every variant
+
+		The instantaneous frequency of each group of variants is calculated for
+		the whole block at once (see Line.generate_pixels), then fit with the
+		parameters of each variant in the group, as FFtrEFM._map_block would.
+
+		Parameters
+		----------
+		block : (n_pixels, n_points) array_like
+			Contiguous rows of self.data
+		args : list
+			[configs, groups, timer], see _unit_computation
+
+		Returns
+		-------
+		results : PixelResults
+			(n_pixels, n_variants) traces named as SWEEP_MAPS
+		'''
+		configs, groups, worker_timer = args[:3]
+
+		timer = None
+		if worker_timer is not None:
+			timer = StageTimer(worker_timer.allocations)
+
+		block = np.asarray(block)
+		n_pixels = block.shape[0]
+
+		results = PixelResults(n_pixels, {name: len(configs) for name in SWEEP_MAPS}, dtype=np.float32)
+		results.timer = timer
+
+		for group in groups:
+
+			line_inst = Line(block.T, configs[group[0]], n_pixels, timer=timer)
+			for i, pix in enumerate(line_inst.generate_pixels()):
+
+				# Each fit restores its own copy of the traces
+				for k in group:
+
+					fit = Pixel.from_traces(pix.inst_freq, configs[k], pix.amplitude, pix.phase,
+											tidx=pix.tidx, timer=timer)
+					fit.drive_freq = pix.drive_freq
+					fit.fit_inst_freq()
+
+					results['tfp'][i, k] = fit.tfp
+					results['shift'][i, k] = fit.shift
+					results['rms'][i, k] = getattr(fit, 'rms', np.nan)
+					results['status'][i, k] = fit.fit_status
+
+		return results
+
+
+def pixel_blocks(data, block_size, cores=1):
+	'''
+	Splits a batch into contiguous blocks of at most block_size pixels, at
+	least one per core, for parallel_compute
+
+	Parameters
+	----------
+	data : ndarray
+		Batch, one pixel per row
+	block_size : int
+	cores : int, optional
+
+	Returns
+	-------
+	blocks : ndarray of objects
+		Views into data; parallel_compute maps over the first axis
+	'''
+	n_pixels = data.shape[0]
+	cores = cores if cores else 1
+	size = max(1, min(block_size, -(-n_pixels // cores)))
+
+	starts = range(0, n_pixels, size)
+	blocks = np.empty(len(starts), dtype=object)
+	for j, start in enumerate(starts):
+		blocks[j] = data[start:start + size]
+
+	return blocks
+
+
+def window_slice(trace_window, total_time, pnts_per_avg):
+	'''
+	The points of a trace within a trace_window, see FFtrEFM
+
+	Parameters
+	----------
+	trace_window : (t_start, t_stop) or None
+		Times in seconds, as stored with the traces; None for the whole trace
+	total_time : float
+		Duration of a trace, in seconds
+	pnts_per_avg : int
+		Points per trace
+
+	Returns
+	-------
+	slice
+		slice(start, stop) into the pnts_per_avg points of a trace
+	'''
+	if trace_window is None:
+		return slice(0, pnts_per_avg)
+
+	time = np.linspace(0, total_time, pnts_per_avg)
+	t_start, t_stop = trace_window
+	start = int(np.searchsorted(time, t_start, side='left'))
+	stop = int(np.searchsorted(time, t_stop, side='right'))
+
+	if stop <= start:
+		raise ValueError('trace_window {} contains no points'.format(tuple(trace_window)))
+
+	return slice(start, stop)
+
+
+def batch_selection(positions):
+	'''
+	Sorted pixel positions as a slice if they are consecutive, for h5py
+
+	h5py reads and writes a slice as one hyperslab, but a list of indices as a
+	point selection, which is far slower for the same rows.
+
+	Parameters
+	----------
+	positions : array_like
+		Sorted pixel positions, e.g. of one Process batch
+
+	Returns
+	-------
+	slice or ndarray
+	'''
+	positions = np.asarray(positions)
+
+	if positions.ndim == 1 and positions.shape[0] > 0:
+		start = int(positions[0])
+		stop = int(positions[-1]) + 1
+		if stop - start == positions.shape[0] and np.all(np.diff(positions) == 1):
+			return slice(start, stop)
+
+	return positions
+
+
+def results_chunks(num_cols, n_pixels, n_points, max_pixels=32, max_points=2048):
+	'''
+	Default (pixels, points) chunk shape of the FFtrEFM trace datasets
+
+	Reading one pixel's trace reads every chunk in its band of pixels, and a
+	time slice of the image every chunk in its band of points, so neither side
+	is allowed to be long: by default 32 pixels x 2048 points, 256 kB of float32.
+	The pixel side divides num_cols where possible so rows start on a chunk.
+
+	Parameters
+	----------
+	num_cols : int
+		Pixels per row
+	n_pixels : int
+		num_rows * num_cols
+	n_points : int
+		Points per trace (pnts_per_avg)
+	max_pixels, max_points : int, optional
+		Largest chunk side along each axis
+
+	Returns
+	-------
+	tuple
+	'''
+	chunk_pixels = min(max_pixels, num_cols, n_pixels)
+	while chunk_pixels > 1 and num_cols % chunk_pixels:
+		chunk_pixels -= 1
+
+	if chunk_pixels < max_pixels // 4:
+		chunk_pixels = min(max_pixels, n_pixels)  # e.g. a prime number of columns
+
+	return max(chunk_pixels, 1), max(min(max_points, n_points), 1)
+
+
+def save_CSV_from_file(h5_file, h5_path='/', append='', mirror=False, fmt='csv'):
+	"""
+	Saves the tfp, shift, and fixed_tfp as CSV files
+	
+	Parameters
+	----------
+	h5_file : H5Py file of FFtrEFM class
+		Reminder you can always type: h5_svd.file or h5_avg.file for this
+	
+	h5_path : str, optional
+		specific folder path to search for the tfp data. Usually not needed.
+	
+	append : str, optional
+		text to append to file name
+	
+	mirror : bool, optional
+		Flips the images left-right
+	
+	fmt : str, optional
+		'csv' (default) or 'npy' for binary files, which are much faster to
+		write and read back for large images
+	
+	Returns
+	-------
+	list of str
+		Paths written
+	"""
+
+	h5_ff = h5_file
+
+	if isinstance(h5_file, ffta.hdf_utils.process.FFtrEFM):
+		print('Saving from FFtrEFM Class')
+		h5_ff = h5_file.h5_main.file
+		h5_path = h5_file.h5_results_grp.name
+
+	elif not isinstance(h5_file, h5py.File):
+		print('Saving from pyUSID object')
+		h5_ff = h5_file.file
+
+	tfp = get_utils.find_dataset(h5_ff[h5_path], 'tfp')[0][()]
+	# tfp_fixed = get_utils.find_dataset(h5_file[h5_path], 'tfp_fixed')[0][()]
+	shift = get_utils.find_dataset(h5_ff[h5_path], 'shift')[0][()]
+
+	tfp_fixed = output.fix_tfp(tfp)
+
+	print(get_utils.find_dataset(h5_ff[h5_path], 'shift')[0].parent.name)
+
+	path = h5_ff.file.filename.replace('\\', '/')
+	path = '/'.join(path.split('/')[:-1]) + '/'
+
+	maps = {'tfp': tfp, 'shift': shift, 'tfp_fixed': tfp_fixed}
+
+	return output.save_maps(path, maps, '-' + append, mirror, fmt)
 
 
 def plot_tfp(ffprocess, scale_tfp=1e6, scale_shift=1, threshold=2, **kwargs):
@@ -8,6 +8,11 @@ __status__ = "Development"
 
 import numpy as np
 from ffta import pixel
+from ffta.pixel_utils import timing as pixel_timing
+from ffta.pixel_utils import threads
+from ffta.pixel_utils.timing import StageTimer
+from ffta.pixel_utils.parameters import PixelParameters
+from ffta.pixel_utils.results import PixelResults
 
 
 class Line:
@@ -22,8 +27,9 @@ class Line:
     ----------
     signal_array : (n_signals, n_points) array_like
         2D real-valued signal array, corresponds to a line
-    params : dict
-        Includes parameters for processing. The list of parameters is:
+    params : dict or PixelParameters
+        Includes parameters for processing. These are validated once per line
+        (or pass a PixelParameters to validate once per image). The list of parameters is:
 
         trigger = float (in seconds)
         total_time = float (in seconds)
@@ -42,6 +48,12 @@ class Line:
         Number of pixels in a line.
     pycroscopy : bool, optional
         Pycroscopy requires different orientation, so this corrects for this effect.
+    timer : ffta.pixel_utils.timing.StageTimer, optional
+        If given, the stage timings of every pixel in the line are recorded in it.
+    n_threads : int, optional
+        Processes blocks of pixels on a shared pool of this many threads.
+        Results are identical to, and in the same order as, n_threads=1.
+        Stage timings are still recorded, but not allocations.
         
     Attributes
     ----------
@@ -55,6 +67,9 @@ class Line:
         Time from trigger to first-peak, in seconds.
     shift : (n_pixels,) array_like
         Frequency shift from trigger to first-peak, in Hz.
+    results : PixelResults
+        Record of all per-pixel outputs (tfp, shift, rms, popt, fit status and
+        inst_freq). tfp, shift, and inst_freq are views into this record.
 
     See Also
     --------
@@ -77,7 +92,8 @@ class Line:
 
     """
 
-    def __init__(self, signal_array, params, n_pixels, pycroscopy=False):
+    def __init__(self, signal_array, params, n_pixels, pycroscopy=False, timer=None,
+                 n_threads=1):
 
         # Pass inputs to the object.
         self.signal_array = signal_array
@@ -85,11 +101,14 @@ class Line:
             self.signal_array = signal_array.T
         self.n_pixels = int(n_pixels)
         self.params = params
+        self.timer = timer
+        self.n_threads = n_threads
 
-        # Initialize tFP and shift arrays.
-        self.tfp = np.empty(self.n_pixels)
-        self.shift = np.empty(self.n_pixels)
-        self.inst_freq = np.empty((self.signal_array.shape[0], self.n_pixels))
+        # Initialize the results record; tFP, shift, and inst_freq are views into it.
+        self.results = PixelResults(self.n_pixels, {'inst_freq': self.signal_array.shape[0]})
+        self.tfp = self.results['tfp']
+        self.shift = self.results['shift']
+        self.inst_freq = self.results['inst_freq'].T
         
         self.avgs_per_pixel = int(self.signal_array.shape[1]/self.n_pixels)
         self.n_signals = self.signal_array.shape[0]
@@ -111,18 +130,144 @@ class Line:
 
         """
 
-        # Split the signal array into pixels.
-        pixel_signals = np.split(self.signal_array, self.n_pixels, axis=1)
+        # Validate the parameters once for the whole line.
+        config = self.params
+        if not isinstance(config, PixelParameters):
+            config = PixelParameters.from_dict(config)
 
-        # Iterate over pixels and return tFP and shift arrays.
-        for i, pixel_signal in enumerate(pixel_signals):
+        # (n_points, n_pixels, avgs) view of the line, no copy.
+        signals = self._pixel_block()
 
-            p = pixel.Pixel(pixel_signal, self.params)
-            
-            (self.tfp[i], self.shift[i], self.inst_freq[:, i]) = p.analyze()
+        if self.n_threads is None or self.n_threads <= 1:
+
+            self._analyze_block(signals, config, 0, self.timer)
+
+        else:
+
+            # Each block fills its own rows of self.results, and times into its own timer.
+            blocks = threads.split_blocks(self.n_pixels, self.n_threads)
+
+            def task(block):
+                timer = None if self.timer is None else StageTimer()
+                self._analyze_block(signals[:, block[0]:block[1]], config, block[0], timer)
+                return timer
+
+            for timer in threads.map_ordered(task, blocks, self.n_threads):
+                if self.timer is not None:
+                    self.timer.merge(timer)
 
         return (self.tfp, self.shift, self.inst_freq)
 
+    def _analyze_block(self, signals, config, start, timer):
+        """Analyzes the pixels of a (n_points, n, avgs) block into rows start:start+n"""
+
+        if config.method == 'hilbert':
+
+            # Instantaneous frequency of all pixels at once, then fit each pixel.
+            for i, p in enumerate(self._hilbert_pixels(signals, config, timer)):
+                p.fit_inst_freq()
+                self._fill(p, start + i)
+
+        else:
+
+            # Iterate over pixels and return tFP and shift arrays.
+            for i in range(signals.shape[1]):
+
+                p = pixel.Pixel(signals[:, i, :], config, timer=timer)
+                p.analyze()
+                self._fill(p, start + i)
+
+        return
+
+    def generate_pixels(self):
+        """
+        Generates the instantaneous frequency, amplitude, and phase of every
+        pixel, without fitting. With the Hilbert method this is done for all
+        pixels at once, as in analyze.
+
+        Returns
+        -------
+        pixels : list of Pixel
+            One per pixel, ready for Pixel.fit_inst_freq
+        """
+        config = self.params
+        if not isinstance(config, PixelParameters):
+            config = PixelParameters.from_dict(config)
+
+        signals = self._pixel_block()
+
+        if config.method == 'hilbert':
+            return self._hilbert_pixels(signals, config, self.timer)
+
+        pixels = []
+        for i in range(signals.shape[1]):
+
+            p = pixel.Pixel(signals[:, i, :], config, timer=self.timer)
+            p.inst_freq, p.amplitude, p.phase = p.generate_inst_freq()
+            pixels.append(p)
+
+        return pixels
+
+    def _fill(self, p, i):
+
+        p.fill_results(self.results, i)
+
+        if p.phase_fitting:
+            self.results.set_trace('inst_freq', i, p.phase)
+
+        return
+
+    def _pixel_block(self):
+        """Returns the line as a (n_points, n_pixels, avgs) array, a view when possible"""
+
+        if self.signal_array.shape[1] != self.n_pixels * self.avgs_per_pixel:
+            raise ValueError('signal_array has {} columns, which is not a whole number of '
+                             'averages for each of {} pixels'.format(self.signal_array.shape[1], self.n_pixels))
+
+        return self.signal_array.reshape(self.n_signals, self.n_pixels, self.avgs_per_pixel)
+
+    def _hilbert_pixels(self, signals, config, timer=None):
+        """
+        Runs the Hilbert-transform steps of Pixel.generate_inst_freq on every
+        pixel of the line at once, see Pixel.from_block
+
+        Parameters
+        ----------
+        signals : (n_points, n_pixels, avgs) array_like
+        config : PixelParameters
+        timer : StageTimer, optional
+
+        Returns
+        -------
+        pixels : list of Pixel
+            One per pixel, with signal, amplitude, phase, inst_freq, drive_freq
+            and tidx set as if Pixel.generate_inst_freq had been called
+        """
+        n_pixels = signals.shape[1]
+
+        block = pixel.Pixel.from_block(signals, config, timer=timer)
+        block.generate_inst_freq()
+
+        # One contiguous row per pixel
+        analytic, amplitude, phase, inst_freq_raw, inst_freq = [
+            np.ascontiguousarray(np.reshape(x, (x.shape[0], n_pixels)).T)
+            for x in (block.signal, block.amplitude, block.phase, block.inst_freq_raw, block.inst_freq)]
+
+        pixels = []
+        for i in range(n_pixels):
+
+            p = pixel.Pixel(signals[:, i, :], config, timer=timer)
+            p.drive_freq = block.drive_freq[i]
+            p.tidx = block.tidx
+            p.signal = analytic[i]
+            p.amplitude = amplitude[i]
+            p.phase = phase[i]
+            p.inst_freq_raw = inst_freq_raw[i]
+            p.inst_freq = inst_freq[i]
+            pixels.append(p)
+
+        return pixels
+
     def pixel_wise_avg(self):
         """
         Averages the line per pixel and saves the result as signal_avg_array
@@ -134,12 +279,7 @@ class Line:
             Returns signal_averaged time-domain signal at each pixel
         """
         
-        self.signal_avg_array = np.empty((self.signal_array.shape[0], self.n_pixels))
-                
-        for i in range(self.n_pixels):
-        
-            avg = self.signal_array[:, i*self.avgs_per_pixel:(i+1)*self.avgs_per_pixel]
-            self.signal_avg_array[:, i] = avg.mean(axis=1)
+        self.signal_avg_array = self._pixel_block().mean(axis=2)
         
         return self.signal_avg_array
     
@@ -147,6 +287,10 @@ class Line:
         """Removes flags from parameters for setting filters"""
         
         #self.params['window'] = 0
-        self.params['bandpass_filter'] = 0
+        if isinstance(self.params, PixelParameters):
+            self.params = self.params._replace(bandpass_filter=0)
+        else:
+            self.params['bandpass_filter'] = 0
         
-        return
\ No newline at end of file
+        return
+
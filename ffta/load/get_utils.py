@@ -11,34 +11,147 @@ from ffta.line import Line
 from ffta.pixel import Pixel
 
 import numpy as np
+import os
+import threading
+import h5py
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 '''
 Functions for extracting certain segments from an HDF FFtrEFM file
 '''
 
+# Per-file index of dataset paths and resolved parameters, see _FileIndex
+_INDEX = {}
+_INDEX_LOCK = threading.Lock()
 
-def get_params(h5_path, key='', verbose=False, del_indices=True):
+
+class _FileIndex:
 	"""
-	Gets dict of parameters from the FF-file
-	Returns a specific key-value if requested
+	Cached dataset paths and parameter dictionaries of one HDF5 file
+	
+	The index is rebuilt when the file changes size (on disk or as seen by the
+	open handle) or modification time. Not every write changes these, so
+	find_dataset also rebuilds once when a name is not found or a cached path
+	no longer exists, and the functions here that write to a file call
+	invalidate. Call invalidate yourself after editing attributes directly.
+	"""
+
+	def __init__(self, stamp):
+
+		self.stamp = stamp
+		self.paths = None  # every dataset path, in h5py visit order
+		self.params = {}  # object name: parameters dict
+
+		return
+
+	def dataset_paths(self, h5_file):
+
+		if self.paths is None:
+
+			paths = []
+
+			def _visit(name, obj):
+				if isinstance(obj, h5py.Dataset):
+					paths.append('/' + name)
+
+			h5_file.visititems(_visit)
+			self.paths = paths
+
+		return self.paths
+
+
+def _stamp(h5_file):
+	"""(size, mtime) of the file on disk and its size as seen by this handle"""
+
+	try:
+		info = os.stat(h5_file.filename)
+	except (OSError, TypeError):
+		return None
+
+	return info.st_size, info.st_mtime_ns, h5_file.id.get_filesize()
+
+
+def _file_index(h5_obj):
+	"""The index of the file containing h5_obj, rebuilt if the file changed"""
+
+	h5_file = h5_obj.file
+	key = h5_file.filename
+	stamp = _stamp(h5_file)
+
+	with _INDEX_LOCK:
+
+		index = _INDEX.get(key)
+		if index is None or stamp is None or index.stamp != stamp:
+			index = _INDEX[key] = _FileIndex(stamp)
+
+		return index
+
+
+def invalidate(h5_obj=None):
+	"""
+	Forgets the cached dataset paths and parameters
 	
 	Parameters
 	----------
-	h5_path : str or h5py
-		Can pass either an h5_path to a file or a file already in use
+	h5_obj : h5py File, Group or Dataset, optional
+		Only forget this file. Default is every file.
+	"""
+	with _INDEX_LOCK:
+
+		if h5_obj is None:
+			_INDEX.clear()
+		else:
+			_INDEX.pop(h5_obj.file.filename, None)
+
+	return
+
+
+def find_dataset(h5_group, dset_name):
+	"""
+	Finds all datasets in h5_group whose name contains dset_name
 	
-	key : str, optional
-		Returns specific key in the parameters dictionary
-		
-	verbose : bool, optional
-		Prints all parameters to console
-		
-	del_indices : bool, optional
-		Deletes relative links within the H5Py and any quantity/units
+	Same as pyUSID.hdf_utils.find_dataset, but the file is only walked once
+	and the dataset paths are cached until the file changes.
+	
+	Parameters
+	----------
+	h5_group : h5py File or Group
+	
+	dset_name : str
+	
+	Returns
+	-------
+	list
+		USIDatasets (or h5py Datasets if not USID main datasets), in the same
+		order as pyUSID.hdf_utils.find_dataset
 	"""
+	h5_file = h5_group.file
+	prefix = h5_group.name.rstrip('/') + '/'
 
-	if isinstance(h5_path, str):
-		h5_path = px.io.HDFwriter(h5_path).file
+	for attempt in range(2):
+
+		index = _file_index(h5_group)
+		paths = [path for path in index.dataset_paths(h5_file)
+				 if path.startswith(prefix) and dset_name in path.split('/')[-1]]
+
+		if any(paths) and all(path in h5_file for path in paths):
+			break
+
+		invalidate(h5_group)  # may be stale, e.g. new datasets not flushed yet
+
+	datasets = []
+	for path in paths:
+		try:
+			datasets.append(usid.USIDataset(h5_file[path]))
+		except TypeError:
+			datasets.append(h5_file[path])
+
+	return datasets
+
+
+def _resolve_params(h5_path):
+	"""Parameters of h5_path, searching the same fallback locations as get_params"""
 
 	parameters = usid.hdf_utils.get_attributes(h5_path)
 
@@ -66,6 +179,39 @@ def get_params(h5_path, key='', verbose=False, del_indices=True):
 		except:
 			raise TypeError('No proper parameters file found.')
 
+	return parameters
+
+
+def get_params(h5_path, key='', verbose=False, del_indices=True):
+	"""
+	Gets dict of parameters from the FF-file
+	Returns a specific key-value if requested
+	
+	Parameters
+	----------
+	h5_path : str or h5py
+		Can pass either an h5_path to a file or a file already in use
+	
+	key : str, optional
+		Returns specific key in the parameters dictionary
+		
+	verbose : bool, optional
+		Prints all parameters to console
+		
+	del_indices : bool, optional
+		Deletes relative links within the H5Py and any quantity/units
+	"""
+
+	if isinstance(h5_path, str):
+		h5_path = px.io.HDFwriter(h5_path).file
+
+	# Resolved once per object, until the file changes
+	index = _file_index(h5_path)
+	if h5_path.name not in index.params:
+		index.params[h5_path.name] = _resolve_params(h5_path)
+
+	parameters = dict(index.params[h5_path.name])
+
 	if any(key):
 		return parameters[key]
 
@@ -113,6 +259,8 @@ def change_params(h5_path, new_vals={}, verbose=False):
 	for key in new_vals:
 		h5_path.attrs[key] = new_vals[key]
 
+	invalidate(h5_path)
+
 	if verbose:
 		print('\nNew parameters:')
 		for key in new_vals:
@@ -122,7 +270,7 @@ def change_params(h5_path, new_vals={}, verbose=False):
 
 
 def get_line(h5_path, line_num, params={},
-			 array_form=False, avg=False, transpose=False):
+			 array_form=False, avg=False, transpose=False, n_threads=1):
 	"""
 	Gets a line of data.
 	
@@ -151,6 +299,9 @@ def get_line(h5_path, line_num, params={},
 	transpose : bool, optional
 		For legacy FFtrEFM code, pixel is required in (n_points, n_signals) format
 		
+	n_threads : int, optional
+		Number of threads the Line uses to analyze its pixels
+		
 	Returns
 	-------
 	signal_line : numpy 2D array, iff array_form == True
@@ -166,13 +317,13 @@ def get_line(h5_path, line_num, params={},
 		parameters = get_params(h5_path)
 		h5_file = px.io.HDFwriter(h5_path).file
 
-		d = usid.hdf_utils.find_dataset(h5_file, 'FF_Raw')[0]
+		d = find_dataset(h5_file, 'FF_Raw')[0]
 		c = parameters['num_cols']
 		pnts = parameters['pnts_per_line']
 
 	else:  # if a Dataset, extract parameters from the shape.
 
-		d = h5_path[()]
+		d = h5_path  # sliced below, so only this line is read
 		parameters = get_params(h5_path)
 
 		c = parameters['num_cols']
@@ -194,11 +345,107 @@ def get_line(h5_path, line_num, params={},
 		for key, val in params.items():
 			parameters[key] = val
 
-	line_inst = Line(signal_line, parameters, c, pycroscopy=True)
+	line_inst = Line(signal_line, parameters, c, pycroscopy=True, n_threads=n_threads)
 
 	return line_inst
 
 
+def iter_lines(h5_path, params={}, lines=None, array_form=False, n_threads=1, prefetch=True):
+	"""
+	Iterates over the lines of a dataset, reading one line (hyperslab) at a time
+	
+	The parameters and dataset are resolved once, and the next line is read on
+	a background thread while the current one is being analyzed.
+	
+	Parameters
+	----------
+	h5_path : str or h5py or Dataset
+		As in get_line
+	
+	params : dict, optional
+		Overwrites these parameters in every Line, as in get_line
+	
+	lines : iterable of int, optional
+		Line numbers to read. Default is every line (num_rows).
+	
+	array_form : bool, optional
+		Yields the raw (pnts_per_line, n_points) arrays rather than Line classes
+	
+	n_threads : int, optional
+		Number of threads each Line uses to analyze its pixels
+	
+	prefetch : bool, optional
+		Reads the next line in the background. Set False to read in the caller.
+	
+	Yields
+	------
+	line_num : int
+	
+	line_inst : Line, or numpy 2D array iff array_form == True
+	
+	Examples
+	--------
+	>>> for i, line_inst in get_utils.iter_lines(h5_avg):
+	>>>		tfp[i, :], shift[i, :], _ = line_inst.analyze()
+	"""
+
+	# If not a dataset, then find the associated Group
+	if 'Dataset' not in str(type(h5_path)):
+
+		parameters = get_params(h5_path)
+		h5_file = px.io.HDFwriter(h5_path).file
+		d = find_dataset(h5_file, 'FF_Raw')[0]
+
+	else:
+
+		d = h5_path
+		parameters = get_params(h5_path)
+
+	c = parameters['num_cols']
+	pnts = parameters['pnts_per_line']
+
+	if any(params):
+		for key, val in params.items():
+			parameters[key] = val
+
+	if lines is None:
+		lines = range(parameters['num_rows'])
+
+	lines = list(lines)
+
+	def read(line_num):
+		return d[line_num * pnts:(line_num + 1) * pnts, :]
+
+	reader = ThreadPoolExecutor(1, thread_name_prefix='ffta-read') if prefetch else None
+
+	try:
+
+		pending = None
+		if reader is not None and lines:
+			pending = reader.submit(read, lines[0])
+
+		for n, line_num in enumerate(lines):
+
+			if reader is None:
+				signal_line = read(line_num)
+			else:
+				signal_line = pending.result()
+				if n + 1 < len(lines):
+					pending = reader.submit(read, lines[n + 1])
+
+			if array_form:
+				yield line_num, signal_line
+			else:
+				yield line_num, Line(signal_line, parameters, c, pycroscopy=True, n_threads=n_threads)
+
+	finally:
+
+		if reader is not None:
+			reader.shutdown(wait=True)
+
+	return
+
+
 def get_pixel(h5_path, rc, params={}, pixel_params={},
 			  array_form=False, avg=False, transpose=False):
 	"""
@@ -247,14 +494,14 @@ def get_pixel(h5_path, rc, params={}, pixel_params={},
 		p = get_params(h5_path)
 		h5_file = px.io.HDFwriter(h5_path).file
 
-		d = usid.hdf_utils.find_dataset(h5_file, 'FF_Raw')[0]
+		d = find_dataset(h5_file, 'FF_Raw')[0]
 		c = p['num_cols']
 		pnts = int(p['pnts_per_pixel'])
 		parameters = usid.hdf_utils.get_attributes(d.parent)
 
 	else:
 
-		d = h5_path[()]
+		d = h5_path  # sliced below, so only this pixel is read
 		parameters = get_params(h5_path)
 
 		c = parameters['num_cols']
@@ -284,3 +531,149 @@ def get_pixel(h5_path, rc, params={}, pixel_params={},
 	pixel_inst = Pixel(signal_pixel, parameters, **pixel_params)
 
 	return pixel_inst
+
+
+class PixelAccessor:
+	"""
+	Random access to the pixels and lines of one dataset
+	
+	The dataset and its parameters are resolved once. Lines are read as
+	hyperslabs and the most recently used ones are kept in memory, so that
+	looking at neighbouring pixels (e.g. while tuning parameters) reads each
+	line from the file only once.
+	
+	Parameters
+	----------
+	h5_path : str or h5py or Dataset
+		As in get_line; a Dataset (e.g. FF_Avg) avoids searching the file
+	
+	params : dict, optional
+		Overwrites these parameters in every Line and Pixel returned
+	
+	pixel_params : dict, optional
+		Parameters 'fit', 'method', 'fit_form' for every Pixel, see get_pixel
+	
+	cache_lines : int, optional
+		Number of lines kept in memory
+	
+	Examples
+	--------
+	>>> pixels = get_utils.PixelAccessor(h5_avg)
+	>>> pix = pixels.get_pixel([10, 20])
+	>>> tfp, shift, inst_freq = pix.analyze()
+	>>> line_arr = pixels.get_line(10, array_form=True)
+	"""
+
+	def __init__(self, h5_path, params={}, pixel_params={}, cache_lines=8):
+
+		# If not a dataset, then find the associated Group
+		if 'Dataset' not in str(type(h5_path)):
+
+			h5_file = px.io.HDFwriter(h5_path).file
+			self.dataset = find_dataset(h5_file, 'FF_Raw')[0]
+
+		else:
+
+			self.dataset = h5_path
+
+		self.parameters = get_params(self.dataset)
+		for key, val in params.items():
+			self.parameters[key] = val
+
+		self.pixel_params = dict(pixel_params)
+		self.pixel_params.update({'pycroscopy': True})  # must be True in this specific case
+
+		self.num_rows = int(self.parameters['num_rows'])
+		self.num_cols = int(self.parameters['num_cols'])
+		self.pnts_per_line = int(self.parameters['pnts_per_line'])
+		self.pnts_per_pixel = int(self.parameters['pnts_per_pixel'])
+
+		self.cache_lines = cache_lines
+		self._lines = OrderedDict()
+		self._lock = threading.Lock()
+
+		return
+
+	def _line(self, line_num):
+		"""The (pnts_per_line, n_points) array of a line, from the cache when possible"""
+
+		with self._lock:
+
+			if line_num in self._lines:
+				self._lines.move_to_end(line_num)
+				return self._lines[line_num]
+
+			pnts = self.pnts_per_line
+			signal_line = self.dataset[line_num * pnts:(line_num + 1) * pnts, :]
+			signal_line.flags.writeable = False
+
+			if self.cache_lines > 0:
+				self._lines[line_num] = signal_line
+				while len(self._lines) > self.cache_lines:
+					self._lines.popitem(last=False)
+
+			return signal_line
+
+	def clear_cache(self):
+		"""Forgets the cached lines, e.g. after the dataset was changed"""
+
+		with self._lock:
+			self._lines.clear()
+
+		return
+
+	def get_line(self, line_num, array_form=False, avg=False, transpose=False, n_threads=1):
+		"""
+		Gets a line of data, see get_line
+		
+		Returns
+		-------
+		signal_line : numpy 2D array, iff array_form or avg
+		
+		line_inst : Line
+		"""
+		signal_line = np.array(self._line(line_num))
+
+		if avg == True:
+			signal_line = (signal_line.transpose() - signal_line.mean(axis=1)).transpose()
+			signal_line = signal_line.mean(axis=0)
+
+		if transpose == True:
+			signal_line = signal_line.transpose()
+
+		if array_form == True or avg == True:
+			return signal_line
+
+		return Line(signal_line, dict(self.parameters), self.num_cols, pycroscopy=True, n_threads=n_threads)
+
+	def get_pixel(self, rc, array_form=False, avg=False, transpose=False):
+		"""
+		Gets a pixel of data, with all the averages within that pixel, see get_pixel
+		
+		Parameters
+		----------
+		rc : list [r, c]
+			Pixel location in terms of ROW, COLUMN
+		
+		Returns
+		-------
+		signal_pixel : numpy array, iff array_form == True
+		
+		pixel_inst : Pixel
+		"""
+		start = rc[1] * self.pnts_per_pixel
+		signal_pixel = np.array(self._line(rc[0])[start:start + self.pnts_per_pixel, :])
+
+		if avg == True:
+			signal_pixel = signal_pixel.mean(axis=0)
+
+		if transpose == True:  # this does nothing is avg==True
+			signal_pixel = signal_pixel.transpose()
+
+		if array_form == True:
+			return signal_pixel
+
+		if signal_pixel.shape[0] == 1:
+			signal_pixel = np.reshape(signal_pixel, [signal_pixel.shape[1]])
+
+		return Pixel(signal_pixel, dict(self.parameters), **self.pixel_params)
@@ -18,6 +18,9 @@ from ffta.pixel_utils import parab
 from ffta.pixel_utils import fitting
 from ffta.pixel_utils import dwavelet
 from ffta.pixel_utils import tfp_calc
+from ffta.pixel_utils.parameters import PixelParameters
+from ffta.pixel_utils import results as pixel_results
+from ffta.pixel_utils import timing as pixel_timing
 
 from matplotlib import pyplot as plt
 
@@ -40,8 +43,10 @@ class Pixel:
 
 	signal_array : (n_points, n_signals) array_like
 		2D real-valued signal array, corresponds to a pixel.
-	params : dict
-		Includes parameters for processing. The list of parameters is:
+	params : dict or PixelParameters
+		Includes parameters for processing. A dict is validated into a
+		ffta.pixel_utils.parameters.PixelParameters; when processing many pixels,
+		build that once and pass it to every Pixel. The list of parameters is:
 
 		trigger = float (in seconds)
 		total_time = float (in seconds)
@@ -86,9 +91,16 @@ class Pixel:
 		The Hilbert Transform amplitude can sometimes have drive frequency artifact.
 	filter_frequency : bool, optional
 		Filters the instantaneous frequency to remove noise peaks
+	timer : ffta.pixel_utils.timing.StageTimer, optional
+		If given, records the time spent in each processing stage (average,
+		check_drive_freq, window, filter, hilbert, phase, inst_freq, fit, restore).
+		A timer can be shared by many pixels to aggregate over a line or image.
 
 	Attributes
 	----------
+	config : PixelParameters
+		Read-only processing parameters. These are also readable as attributes,
+		e.g. self.roi is self.config.roi
 	n_points : int
 		Number of points in a signal.
 	n_signals : int
@@ -150,59 +162,40 @@ class Pixel:
 
 	"""
 
+	__slots__ = ('config', 'signal_array', 'signal_orig', 'signal',
+				 'n_points', 'n_signals', '_n_points_orig',
+				 'tidx', 'tidx_orig', '_tidx_orig',
+				 'drive_freq', 'bandpass_filter', 'scales',
+				 'amplitude', 'phase', 'inst_freq', 'inst_freq_raw', 'power_dissipated',
+				 'tfp', 'shift', 'rms', 'popt', 'fit_status', 'best_fit', 'best_phase', 'ringdown_Q', 'cut',
+				 'cwt_matrix', 'spectrogram', 'wavelet_freq', 'stft_freq', 'stft_times',
+				 'timer', 'verbose')
+
 	def __init__(self, signal_array, params, can_params=None,
 				 fit=True, pycroscopy=False,
 				 method='hilbert', fit_form='product', filter_amplitude=False,
-				 filter_frequency=False):
-
-		# Create parameter attributes for optional parameters.
-		# These defaults are overwritten by values in 'params'
-
-		# FIR (Hilbert) filtering parameters
-		if can_params is None:
-			can_params = {}
-		self.n_taps = 1499
-		self.filter_bandwidth = 5000
-		self.filter_frequency = filter_frequency
-
-		# Wavelet parameters
-		self.wavelet_analysis = False
-		self.wavelet = 'cmor1-1'  # default complex Morlet wavelet
-		self.scales = np.arange(100, 2, -1)
-		self.wavelet_params = {}  # currently just optimize flag is supported
-
-		# Short Time Fourier Transform
-		self.fft_analysis = False
-		self.fft_cycles = 2
-		self.fft_params = {}  # for STFT
-
-		self.recombination = False
-		self.phase_fitting = False
-		self.check_drive = True
-
-		# Assign the fit parameter.
-		self.fit = fit
-		self.fit_form = fit_form
-		self.method = method
-		self.filter_amplitude = filter_amplitude
-
-		# Default Cantilever parameters, plugging in some reasonable defaults
-		self.AMPINVOLS = 122e-9
-		self.SpringConstant = 23.2
-		self.k = self.SpringConstant
-		self.DriveAmplitude = 1.7e-9
-		self.Mass = 4.55e-12
-		self.Beta = 3114
-		self.Q = 360
-
-		# Read parameter attributes from parameters dictionary.
-		for key, value in params.items():
-			setattr(self, key, value)
-
-		for key, value in can_params.items():
-			setattr(self, key, float(value))
-
-		if self.filter_frequency:
+				 filter_frequency=False, timer=None):
+
+		# Processing parameters are shared and validated once per image; setting
+		# one on a pixel gives it its own copy (see __setattr__). A dict is
+		# converted here; the keyword arguments are defaults that are
+		# overwritten by values in 'params'
+		if isinstance(params, PixelParameters):
+			self.config = params
+		else:
+			self.config = PixelParameters.from_dict(params, can_params, fit=fit, method=method,
+													 fit_form=fit_form,
+													 filter_amplitude=filter_amplitude,
+													 filter_frequency=filter_frequency)
+
+		# Per-pixel copies of parameters that processing can change
+		self.drive_freq = self.config.drive_freq
+		self.bandpass_filter = self.config.bandpass_filter
+		self.scales = self.config.scales
+		if self.scales is None:
+			self.scales = np.arange(100, 2, -1)
+
+		if self.config.filter_frequency:
 			self.bandpass_filter = 0  # turns off FIR
 
 		# Assign values from inputs.
@@ -236,20 +229,133 @@ class Pixel:
 		self.inst_freq = None
 		self.tfp = None
 		self.shift = None
+		self.fit_status = pixel_results.FIT_SKIPPED
 		self.cwt_matrix = None
 
+		self.timer = timer  # optional timing.StageTimer
 		self.verbose = False  # for console feedback
 
-		# For accidental passing ancillary datasets from Pycroscopy, this will fail
-		# when pickling
-		if hasattr(self, 'Position_Indices'):
-			del self.Position_Indices
-		if hasattr(self, 'Position_Values'):
-			del self.Position_Values
-		if hasattr(self, 'Spectroscopic_Indices'):
-			del self.Spectroscopic_Indices
-		if hasattr(self, 'Spectroscopic_Values'):
-			del self.Spectroscopic_Values
+		return
+
+	@classmethod
+	def from_traces(cls, inst_freq, params, amplitude=None, phase=None, tidx=None, timer=None,
+					drive_freq=None, start=0):
+		"""
+		A Pixel whose instantaneous frequency (and amplitude and phase) were
+		calculated already, e.g. the stored Inst_Freq of an earlier analysis,
+		ready for fit_inst_freq.
+
+		By default the traces are as analyze leaves them, with the trigger
+		restored to its original position, and the drive frequency is the one
+		in params.
+
+		Parameters
+		----------
+		inst_freq : (n_points,) array_like
+		params : PixelParameters or dict
+		amplitude, phase : (n_points,) array_like, optional
+			Needed by the 'ringdown' and 'phase' fits and by power dissipation
+		tidx : int, optional
+			Index of the trigger in traces that were not restored (e.g. the
+			Inst_Freq of FFtrEFM(if_only=True), shifted by the FIR filter);
+			fit_inst_freq restores them
+		timer : ffta.pixel_utils.timing.StageTimer, optional
+		drive_freq : float, optional
+			The drive frequency the traces were calculated with, e.g. the one
+			check_drive_freq measured (the 'drive_freq' of a PixelResults)
+		start : int, optional
+			Index of the first point of the traces in the full trace, e.g. for
+			the trace_window of FFtrEFM; the trigger (and tidx) move back by as
+			many points
+
+		Returns
+		-------
+		Pixel
+		"""
+		inst_freq = np.array(inst_freq, dtype=float).flatten()
+
+		pix = cls(inst_freq, params, timer=timer)
+		pix.inst_freq = inst_freq
+		pix.amplitude = None if amplitude is None else np.array(amplitude, dtype=float).flatten()
+		pix.phase = None if phase is None else np.array(phase, dtype=float).flatten()
+		if tidx is not None:
+			pix.tidx = int(tidx)
+		if drive_freq is not None and np.isfinite(drive_freq):
+			pix.drive_freq = float(drive_freq)
+
+		if start:
+			pix.tidx -= int(start)
+			pix._tidx_orig -= int(start)
+			pix.tidx_orig = pix._tidx_orig
+
+		return pix
+
+	@classmethod
+	def from_block(cls, signals, params, timer=None):
+		"""
+		A Pixel holding the signals of several pixels (e.g. a line), so that
+		generate_inst_freq with the Hilbert method processes all of them at once.
+
+		Every step of that method works along axis 0, so signal, amplitude,
+		phase and inst_freq are (n_points, n_pixels) arrays, and drive_freq
+		holds one value per pixel.
+
+		Parameters
+		----------
+		signals : (n_points, n_pixels, n_signals) array_like
+		params : PixelParameters or dict
+		timer : ffta.pixel_utils.timing.StageTimer, optional
+
+		Returns
+		-------
+		Pixel
+		"""
+		signals = np.asarray(signals)
+
+		pix = cls(signals[:, 0], params, timer=timer)
+		pix.n_points, n_pixels, pix.n_signals = signals.shape
+		pix._n_points_orig = pix.n_points
+		pix.signal_array = signals if pix.n_signals != 1 else signals[:, :, 0]
+		pix.drive_freq = np.full(n_pixels, pix.drive_freq, dtype=float)
+
+		return pix
+
+	def __getattr__(self, name):
+		"""Serves the processing parameters (e.g. self.roi) from self.config"""
+
+		# Guard against recursion before config is set (e.g. while unpickling)
+		if name.startswith('__') or name == 'config':
+			raise AttributeError(name)
+
+		config = self.config
+		if name in config._fields:
+			return getattr(config, name)
+		if name in config.extras:
+			return config.extras[name]
+
+		raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
+
+	def __setattr__(self, name, value):
+		"""
+		Attributes of the pixel are set as usual. Processing parameters
+		(e.g. pix.roi = 3e-4 or pix.fit_form = 'sum') replace this pixel's
+		config with a validated copy, so pixels sharing the old config are not
+		changed. Any other name is kept with the extras of that copy.
+		"""
+		if hasattr(type(self), name):
+			object.__setattr__(self, name, value)
+			return
+
+		config = self.config
+		if name in config._fields:
+			config = config._replace(**{name: value})
+			config.validate()
+		else:
+			extras = dict(config.extras)
+			extras[name] = value
+			config = config._replace(extras=extras)
+
+		object.__setattr__(self, 'config', config)
 
 		return
 
@@ -260,6 +366,30 @@ class Pixel:
 
 		return
 
+	def _along_axis(self, values, like=None):
+		"""values (a 1D array along axis 0) shaped to broadcast against like, default self.signal"""
+
+		if like is None:
+			like = self.signal
+
+		return np.reshape(values, (-1,) + (1,) * (np.ndim(like) - 1))
+
+	def _by_drive_freq(self, func, values):
+		"""
+		Applies func(values, drive_freq) along axis 0. For a block of pixels
+		(see from_block) this is done once per distinct drive frequency, which
+		is usually the same for all of them.
+		"""
+		if np.ndim(self.drive_freq) == 0:
+			return func(values, self.drive_freq)
+
+		result = np.empty_like(values)
+		for drive_freq in np.unique(self.drive_freq):
+			cols = self.drive_freq == drive_freq
+			result[:, cols] = func(values[:, cols], drive_freq)
+
+		return result
+
 	def remove_dc(self):
 		"""Removes DC components from signals."""
 
@@ -286,7 +416,7 @@ class Pixel:
 		"""Averages signals."""
 
 		if self.n_signals != 1:  # if not multi-signal, don't average
-			self.signal = self.signal_array.mean(axis=1)
+			self.signal = self.signal_array.mean(axis=-1)
 
 		else:
 			self.signal = np.copy(self.signal_array)
@@ -302,22 +432,26 @@ class Pixel:
 
 		# Calculate drive frequency from maximum power of the FFT spectrum.
 		signal = self.signal[:n_fft]
-		fft_amplitude = np.abs(np.fft.rfft(signal))
-		drive_freq = fft_amplitude.argmax() * dfreq
+		fft_amplitude = np.abs(np.fft.rfft(signal, axis=0))
+		drive_freq = fft_amplitude.argmax(axis=0) * dfreq
 
 		# Difference between given and calculated drive frequencies.
 		difference = np.abs(drive_freq - self.drive_freq)
 
 		# If difference is too big, reassign. Otherwise, continue. != 0 for accidental DC errors
-		if difference >= dfreq and drive_freq != 0:
-			self.drive_freq = drive_freq
+		reassign = (difference >= dfreq) & (drive_freq != 0)
+		if np.ndim(reassign) == 0:
+			if reassign:
+				self.drive_freq = drive_freq
+		else:
+			self.drive_freq = np.where(reassign, drive_freq, self.drive_freq)
 
 		return
 
 	def apply_window(self):
 		"""Applies the window given in parameters."""
 
-		self.signal *= sps.get_window(self.window, self.n_points)
+		self.signal *= self._along_axis(sps.get_window(self.window, self.n_points))
 
 		return
 
@@ -333,25 +467,29 @@ class Pixel:
 	def fir_filter(self):
 		"""Filters signal with a FIR bandpass filter."""
 
-		# Calculate bandpass region from given parameters.
-		nyq_rate = 0.5 * self.sampling_rate
-		bw_half = self.filter_bandwidth / 2
+		def _filter(signal, drive_freq):
 
-		freq_low = (self.drive_freq - bw_half) / nyq_rate
-		freq_high = (self.drive_freq + bw_half) / nyq_rate
+			# Calculate bandpass region from given parameters.
+			nyq_rate = 0.5 * self.sampling_rate
+			bw_half = self.filter_bandwidth / 2
 
-		band = [freq_low, freq_high]
+			freq_low = (drive_freq - bw_half) / nyq_rate
+			freq_high = (drive_freq + bw_half) / nyq_rate
 
-		# Create taps using window method.
-		try:
-			taps = sps.firwin(int(self.n_taps), band, pass_zero=False,
-							  window='blackman')
-		except:
-			print('band=', band)
-			print('nyq=', nyq_rate)
-			print('drive=', self.drive_freq)
+			band = [freq_low, freq_high]
+
+			# Create taps using window method.
+			try:
+				taps = sps.firwin(int(self.n_taps), band, pass_zero=False,
+								  window='blackman')
+			except:
+				print('band=', band)
+				print('nyq=', nyq_rate)
+				print('drive=', drive_freq)
 
-		self.signal = sps.fftconvolve(self.signal, taps, mode='same')
+			return sps.fftconvolve(signal, self._along_axis(taps, signal), mode='same', axes=0)
+
+		self.signal = self._by_drive_freq(_filter, self.signal)
 
 		# Shifts trigger due to causal nature of FIR filter
 		self.tidx -= (self.n_taps - 1) / 2
@@ -363,20 +501,24 @@ class Pixel:
 		one highpass) using filtfilt. This method has linear phase and no
 		time delay."""
 
-		# Calculate bandpass region from given parameters.
-		nyq_rate = 0.5 * self.sampling_rate
-		bw_half = self.filter_bandwidth / 2
+		def _filter(signal, drive_freq):
+
+			# Calculate bandpass region from given parameters.
+			nyq_rate = 0.5 * self.sampling_rate
+			bw_half = self.filter_bandwidth / 2
+
+			freq_low = (drive_freq - bw_half) / nyq_rate
+			freq_high = (drive_freq + bw_half) / nyq_rate
 
-		freq_low = (self.drive_freq - bw_half) / nyq_rate
-		freq_high = (self.drive_freq + bw_half) / nyq_rate
+			# Do a high-pass filtfilt operation.
+			b, a = sps.butter(9, freq_low, btype='high')
+			signal = sps.filtfilt(b, a, signal, axis=0)
 
-		# Do a high-pass filtfilt operation.
-		b, a = sps.butter(9, freq_low, btype='high')
-		self.signal = sps.filtfilt(b, a, self.signal)
+			# Do a low-pass filtfilt operation.
+			b, a = sps.butter(9, freq_high, btype='low')
+			return sps.filtfilt(b, a, signal, axis=0)
 
-		# Do a low-pass filtfilt operation.
-		b, a = sps.butter(9, freq_high, btype='low')
-		self.signal = sps.filtfilt(b, a, self.signal)
+		self.signal = self._by_drive_freq(_filter, self.signal)
 
 		return
 
@@ -384,16 +526,20 @@ class Pixel:
 		'''
 		Filters the drive signal out of the amplitude response
 		'''
-		AMP = np.fft.fftshift(np.fft.fft(self.amplitude))
+		def _filter(amplitude, drive_freq):
 
-		DRIVE = self.drive_freq / (self.sampling_rate / self.n_points)  # drive location in frequency space
-		center = int(len(AMP) / 2)
+			AMP = np.fft.fftshift(np.fft.fft(amplitude, axis=0), axes=0)
 
-		# crude boxcar
-		AMP[:center - int(DRIVE / 2) + 1] = 0
-		AMP[center + int(DRIVE / 2) - 1:] = 0
+			DRIVE = drive_freq / (self.sampling_rate / self.n_points)  # drive location in frequency space
+			center = int(len(AMP) / 2)
 
-		self.amplitude = np.abs(np.fft.ifft(np.fft.ifftshift(AMP)))
+			# crude boxcar
+			AMP[:center - int(DRIVE / 2) + 1] = 0
+			AMP[center + int(DRIVE / 2) - 1:] = 0
+
+			return np.abs(np.fft.ifft(np.fft.ifftshift(AMP, axes=0), axis=0))
+
+		self.amplitude = self._by_drive_freq(_filter, self.amplitude)
 
 		return
 
@@ -402,22 +548,26 @@ class Pixel:
 		Filters the instantaneous frequency around DC peak to remove noise
 		Uses self.filter_bandwidth for the frequency filter
 		'''
-		FREQ = np.fft.fftshift(np.fft.fft(self.inst_freq))
+		def _filter(inst_freq, drive_freq):
 
-		center = int(len(FREQ) / 2)
+			FREQ = np.fft.fftshift(np.fft.fft(inst_freq, axis=0), axes=0)
 
-		df = self.sampling_rate / self.n_points
-		drive_bin = int(np.ceil(self.drive_freq / df))
-		bin_width = int(self.filter_bandwidth / df)
+			center = int(len(FREQ) / 2)
 
-		if bin_width > drive_bin:
-			print('width exceeds first resonance')
-			bin_width = drive_bin - 1
+			df = self.sampling_rate / self.n_points
+			drive_bin = int(np.ceil(drive_freq / df))
+			bin_width = int(self.filter_bandwidth / df)
 
-		FREQ[:center - bin_width] = 0
-		FREQ[center + bin_width:] = 0
+			if bin_width > drive_bin:
+				print('width exceeds first resonance')
+				bin_width = drive_bin - 1
 
-		self.inst_freq = np.real(np.fft.ifft(np.fft.ifftshift(FREQ)))
+			FREQ[:center - bin_width] = 0
+			FREQ[center + bin_width:] = 0
+
+			return np.real(np.fft.ifft(np.fft.ifftshift(FREQ, axes=0), axis=0))
+
+		self.inst_freq = self._by_drive_freq(_filter, self.inst_freq)
 
 		return
 
@@ -452,17 +602,22 @@ class Pixel:
 	def hilbert(self):
 		"""Analytical signal and calculate phase/frequency via Hilbert transform"""
 
-		self.hilbert_transform()
-		self.calculate_amplitude()
-		self.calculate_phase()
-		self.calculate_inst_freq()
+		with pixel_timing.stage(self.timer, 'hilbert'):
+			self.hilbert_transform()
+
+		with pixel_timing.stage(self.timer, 'phase'):
+			self.calculate_amplitude()
+			self.calculate_phase()
+
+		with pixel_timing.stage(self.timer, 'inst_freq'):
+			self.calculate_inst_freq()
 
 		return
 
 	def hilbert_transform(self):
 		"""Gets the analytical signal doing a Hilbert transform."""
 
-		self.signal = sps.hilbert(self.signal)
+		self.signal = sps.hilbert(self.signal, axis=0)
 
 		return
 
@@ -471,11 +626,11 @@ class Pixel:
 		signal to do this."""
 		#
 		if self.n_signals != 1:
-			signal_orig = self.signal_array.mean(axis=1)
+			signal_orig = self.signal_array.mean(axis=-1)
 		else:
 			signal_orig = self.signal_array
 
-		self.amplitude = np.abs(sps.hilbert(signal_orig))
+		self.amplitude = np.abs(sps.hilbert(signal_orig, axis=0))
 
 		if not np.isnan(self.AMPINVOLS):
 			self.amplitude *= self.AMPINVOLS
@@ -503,7 +658,7 @@ class Pixel:
 		the drive phase."""
 
 		# Unwrap the phase.
-		self.phase = np.unwrap(np.angle(self.signal))
+		self.phase = np.unwrap(np.angle(self.signal), axis=0)
 
 		if correct_slope:
 			# Remove the drive from phase.
@@ -514,11 +669,20 @@ class Pixel:
 			start = int(0.3 * self.tidx)
 			end = int(0.7 * self.tidx)
 			fit = self.phase[start:end]
-
-			xfit = np.polyfit(np.arange(start, end), fit, 1)
+			x = np.arange(start, end)
+
+			# One fit per pixel of a block (see from_block): fitting all the
+			# columns at once rounds differently, so results would depend on
+			# how many pixels are in the block
+			if fit.ndim == 1:
+				xfit = np.polyfit(x, fit, 1)
+			else:
+				cols = fit.reshape(fit.shape[0], -1)
+				xfit = np.array([np.polyfit(x, cols[:, i], 1) for i in range(cols.shape[1])])
+				xfit = xfit.T.reshape((2,) + fit.shape[1:])
 
 			# Remove the fit from phase.
-			self.phase -= (xfit[0] * np.arange(self.n_points)) + xfit[1]
+			self.phase -= np.multiply.outer(np.arange(self.n_points), xfit[0]) + xfit[1]
 
 		self.phase = -self.phase  # need to correct for negative in DDHO solution
 
@@ -536,8 +700,17 @@ class Pixel:
 		# using 5 point 1st order polynomial.
 
 		# -self.phase to correct for sign in DDHO solution
-		self.inst_freq_raw = sps.savgol_filter(-self.phase, 5, 1, deriv=1,
-											   delta=dtime)
+		# The edges are fit per column, for the same reason as in calculate_phase
+		if self.phase.ndim == 1:
+			self.inst_freq_raw = sps.savgol_filter(-self.phase, 5, 1, deriv=1,
+												   delta=dtime, axis=0)
+		else:
+			cols = self.phase.reshape(self.phase.shape[0], -1)
+			self.inst_freq_raw = np.empty(cols.shape)
+			for i in range(cols.shape[1]):
+				self.inst_freq_raw[:, i] = sps.savgol_filter(-cols[:, i], 5, 1, deriv=1,
+															 delta=dtime)
+			self.inst_freq_raw = self.inst_freq_raw.reshape(self.phase.shape)
 
 		# Bring trigger to zero.
 		self.tidx = int(self.tidx)
@@ -553,34 +726,87 @@ class Pixel:
 		self.cut = cut
 		t = np.arange(cut.shape[0]) / self.sampling_rate
 
-		if not self.fit:
+		try:
+
+			if not self.fit:
+
+				tfp_calc.find_minimum(self, cut)
 
-			tfp_calc.find_minimum(self, cut)
+			elif self.fit_form == 'sum':
 
-		elif self.fit_form == 'sum':
+				tfp_calc.fit_freq_sum(self, ridx, cut, t)
 
-			tfp_calc.fit_freq_sum(self, cut, t)
+			elif self.fit_form == 'exp':
 
-		elif self.fit_form == 'exp':
+				tfp_calc.fit_freq_exp(self, ridx, cut, t)
 
-			tfp_calc.fit_freq_exp(self, cut, t)
+			elif self.fit_form == 'ringdown':
 
-		elif self.fit_form == 'ringdown':
+				cut = self.amplitude[self.tidx:(self.tidx + ridx)]
+				tfp_calc.fit_ringdown(self, ridx, cut, t)
 
-			cut = self.amplitude[self.tidx:(self.tidx + ridx)]
-			tfp_calc.fit_ringdown(self, ridx, cut, t)
+			elif self.fit_form == 'product':
 
-		elif self.fit_form == 'product':
+				tfp_calc.fit_freq_product(self, cut, t)
 
-			tfp_calc.fit_freq_product(self, cut, t)
+			elif self.fit_form == 'phase':
 
-		elif self.fit_form == 'phase':
+				cut = -1 * (self.phase[self.tidx:(self.tidx + ridx)] - self.phase[self.tidx])
+				tfp_calc.fit_phase(self, ridx, cut, t)
 
-			cut = -1 * (self.phase[self.tidx:(self.tidx + ridx)] - self.phase[self.tidx])
-			tfp_calc.fit_phase(self, cut, t)
+		except (ValueError, RuntimeError) as e:
+
+			# e.g. initial guess outside the fit bounds; see Notes in the class
+			logging.warning('Fit failed (%s): %s', self.fit_form, e)
+			self.tfp = np.nan
+			self.shift = np.nan
+			self.best_fit = np.full(cut.shape[0], np.nan)
+
+		if np.isfinite(self.tfp) and np.isfinite(self.shift):
+			self.fit_status = pixel_results.FIT_OK
+		else:
+			self.fit_status = pixel_results.FIT_FAILED
 
 		return
 
+	def fill_results(self, results, index=0, window=None):
+		"""
+		Writes this pixel's outputs into row index of a PixelResults, in place.
+
+		Traces are matched by name to the attributes of this pixel
+		(e.g. 'inst_freq', 'amplitude'); outputs that were not calculated
+		are left untouched.
+
+		Parameters
+		----------
+		results : ffta.pixel_utils.results.PixelResults
+			Preallocated results block, e.g. for a Line or a Process batch
+		index : int, optional
+			Row of this pixel in results
+		window : slice, optional
+			Part of each trace to store, e.g. slice(start, stop) in points
+
+		Returns
+		-------
+		results : PixelResults
+		"""
+		if self.fit_status == pixel_results.FIT_SKIPPED:
+			results.set_scalars(index, status=pixel_results.FIT_SKIPPED, drive_freq=self.drive_freq)
+		else:
+			results.set_scalars(index, self.tfp, self.shift,
+								getattr(self, 'rms', np.nan),
+								getattr(self, 'popt', None),
+								self.fit_status, self.drive_freq)
+
+		for name in results.traces:
+			values = getattr(self, name, None)
+			if values is not None:
+				if window is not None:
+					values = np.asarray(values)[window]
+				results.set_trace(name, index, values)
+
+		return results
+
 	def restore_signal(self):
 		"""Restores the signal length and position of trigger to original
 		values."""
@@ -589,29 +815,26 @@ class Pixel:
 		d_trig = int(self._tidx_orig - self.tidx)
 		d_points = int(self._n_points_orig - self.n_points)
 
+		# e.g. the traces of from_traces
+		if d_trig == 0 and d_points == 0:
+			return
+
 		# Check if the signal length can accomodate the shift or not.
 		if d_trig >= d_points:
 
 			# Pad from left and set the original length.
-			self.inst_freq = np.pad(self.inst_freq, (d_trig, 0), 'edge')
-			self.inst_freq = self.inst_freq[:self._n_points_orig]
-
-			self.phase = np.pad(self.phase, (d_trig, 0), 'edge')
-			self.phase = self.phase[:self._n_points_orig]
-
-			self.amplitude = np.pad(self.amplitude, (d_trig, 0), 'edge')
-			self.amplitude = self.amplitude[:self._n_points_orig]
+			pad, stop = (d_trig, 0), self._n_points_orig
 
 		else:
 
 			# Calculate how many points is needed for padding from right.
-			pad_right = d_points - d_trig
-			self.inst_freq = np.pad(self.inst_freq, (d_trig, pad_right),
-									'edge')
-			self.phase = np.pad(self.phase, (d_trig, pad_right),
-								'edge')
-			self.amplitude = np.pad(self.amplitude, (d_trig, pad_right),
-									'edge')
+			pad, stop = (d_trig, d_points - d_trig), None
+
+		# Amplitude and phase can be missing, see from_traces
+		for name in ('inst_freq', 'phase', 'amplitude'):
+			trace = getattr(self, name, None)
+			if trace is not None:
+				setattr(self, name, np.pad(trace, pad, 'edge')[:stop])
 
 		# Set the public variables back to original values.
 		self.tidx = self._tidx_orig
@@ -831,14 +1054,16 @@ class Pixel:
 		# self.phase_lock()
 
 		# Average signals.
-		self.average()
+		with pixel_timing.stage(self.timer, 'average'):
+			self.average()
 
 		# Remove DC component again, introduced by phase-locking.
 		# self.remove_dc()
 
 		# Check the drive frequency.
 		if self.check_drive:
-			self.check_drive_freq()
+			with pixel_timing.stage(self.timer, 'check_drive_freq'):
+				self.check_drive_freq()
 
 		# DWT Denoise
 		# self.dwt_denoise()
@@ -846,28 +1071,33 @@ class Pixel:
 		if self.method == 'wavelet':
 
 			# Calculate instantenous frequency using wavelet transform.
-			self.calculate_cwt(**self.wavelet_params)
+			with pixel_timing.stage(self.timer, 'inst_freq'):
+				self.calculate_cwt(**(self.wavelet_params or {}))
 
 		elif self.method == 'stft':
 
 			# Calculate instantenous frequency using sliding FFT
-			self.calculate_stft(**self.fft_params)
+			with pixel_timing.stage(self.timer, 'inst_freq'):
+				self.calculate_stft(**(self.fft_params or {}))
 
 		elif self.method == 'hilbert':
 			# Hilbert transform method
 
 			# Apply window.
 			if self.window != 0:
-				self.apply_window()
+				with pixel_timing.stage(self.timer, 'window'):
+					self.apply_window()
 
 			# Filter the signal with a filter, if wanted.
 			if self.bandpass_filter == 1:
 
-				self.fir_filter()
+				with pixel_timing.stage(self.timer, 'filter'):
+					self.fir_filter()
 
 			elif self.bandpass_filter == 2:
 
-				self.iir_filter()
+				with pixel_timing.stage(self.timer, 'filter'):
+					self.iir_filter()
 
 			# Get the analytical signal doing a Hilbert transform.
 			self.hilbert()
@@ -884,7 +1114,8 @@ class Pixel:
 
 		# Filter out oscillatory noise from instantaneous frequency
 		if self.filter_frequency:
-			self.frequency_filter()
+			with pixel_timing.stage(self.timer, 'filter'):
+				self.frequency_filter()
 
 		return self.inst_freq, self.amplitude, self.phase
 
@@ -904,16 +1135,39 @@ class Pixel:
 
 		self.inst_freq, self.amplitude, self.phase = self.generate_inst_freq()
 
+		return self.fit_inst_freq()
+
+	def fit_inst_freq(self):
+		"""
+		Finds tFP and shift from an instantaneous frequency (and amplitude and
+		phase) that was already calculated, e.g. by generate_inst_freq or for a
+		whole line at once by Line.analyze.
+
+		Returns
+		-------
+		tfp : float
+			Time from trigger to first-peak, in seconds.
+		shift : float
+			Frequency shift from trigger to first-peak, in Hz.
+		inst_freq : (n_points,) array_like
+			Instantenous frequency of the signal.
+		"""
+
+		if self.roi is None:
+			raise ValueError('roi is required to fit tfp')
+
 		# If it's a recombination image invert it to find minimum.
 		if self.recombination:
 			self.inst_freq = self.inst_freq * -1
 
 		# Find where the minimum is.
-		self.find_tfp()
+		with pixel_timing.stage(self.timer, 'fit'):
+			self.find_tfp()
 
 		# Restore the length due to FIR filter being causal
 		if self.method == 'hilbert':
-			self.restore_signal()
+			with pixel_timing.stage(self.timer, 'restore'):
+				self.restore_signal()
 
 		# If it's a recombination image invert it to find minimum.
 		if self.recombination:
@@ -0,0 +1,185 @@
+"""liveplot.py: Live tfp/shift images that are redrawn at a capped frame rate, apart from the analysis."""
+
+__author__ = "Rajiv Giridharagopal"
+__copyright__ = "Copyright 2020"
+__maintainer__ = "Rajiv Giridharagopal"
+__email__ = "rgiri@uw.edu"
+__status__ = "Development"
+
+import queue
+import threading
+import time
+
+import numpy as np
+
+"""
+The analysis only queues each finished line (update never blocks); the figure
+is redrawn from the main thread, which matplotlib requires, at most max_fps
+times per second by changing the data of the existing images.
+
+Example usage:
+	>> live = LiveImages((num_rows, num_cols))
+	>> def analyze_lines():
+	>>     for i, line_inst in get_utils.iter_lines(h5_avg):
+	>>         tfp[i, :], shift[i, :], _ = line_inst.analyze()
+	>>         live.update(i, tfp[i, :], shift[i, :])
+	>> live.run(analyze_lines)  # analyzes on a thread, draws until it is done
+"""
+
+
+class LiveImages:
+	"""
+	Live images of the tfp and shift maps
+
+	Parameters
+	----------
+	shape : tuple
+		(num_rows, num_cols) of each image
+	axes : list of matplotlib Axes, optional
+		One per image. By default a new figure with two panels is made.
+	artists : list of matplotlib AxesImage, optional
+		Existing images to update (e.g. from usid plot_map) instead of making new ones
+	titles : tuple of str, optional
+	scales : tuple of float, optional
+		Multiplies each image for display, e.g. 1e6 for tfp in us
+	cmaps : tuple of str, optional
+	max_fps : float, optional
+		Most redraws per second
+	"""
+
+	def __init__(self, shape, axes=None, artists=None, titles=('tFP Image', 'Shift Image'),
+				 scales=(1e6, 1), cmaps=('inferno', 'cubehelix'), max_fps=4):
+
+		from matplotlib import pyplot as plt
+
+		self.shape = tuple(shape)
+		self.scales = scales
+		self.min_interval = 1.0 / max_fps
+
+		if artists is not None:
+			axes = [artist.axes for artist in artists]
+
+		if axes is None:
+			plt.ion()
+			fig, axes = plt.subplots(nrows=1, ncols=len(titles), figsize=(12, 6), tight_layout=True)
+			for ax in axes:
+				plt.setp(ax.get_xticklabels(), visible=False)
+				plt.setp(ax.get_yticklabels(), visible=False)
+			for ax, title in zip(axes, titles):
+				ax.set_title(title)
+			plt.show(block=False)
+
+		self.axes = axes
+		self.fig = axes[0].figure
+
+		self.images = [np.full(self.shape, np.nan) for _ in axes]
+		self.limits = [[np.inf, -np.inf] for _ in axes]
+		if artists is None:
+			artists = [ax.imshow(img, cmap=cmap, origin='lower', aspect='equal')
+					   for ax, img, cmap in zip(axes, self.images, cmaps)]
+		self.artists = artists
+		self.text = self.fig.text(0.35, 0.02, '')
+
+		self._queue = queue.SimpleQueue()
+		self._last_draw = 0.0
+		self._last_line = None
+
+		return
+
+	def update(self, i, *rows):
+		"""
+		Queues line i for display; safe to call from any thread
+
+		Parameters
+		----------
+		i : int
+			Line number
+		rows : array_like
+			One (num_cols,) row per image, e.g. tfp[i, :], shift[i, :]
+		"""
+		self._queue.put((i, [np.array(row, dtype=float) for row in rows]))
+
+		return
+
+	def render(self, force=False):
+		"""
+		Copies the queued lines into the images and redraws if enough time has
+		passed since the last redraw (or if force)
+
+		Returns
+		-------
+		bool
+			Whether the figure was redrawn
+		"""
+		changed = False
+		while True:
+
+			try:
+				i, rows = self._queue.get_nowait()
+			except queue.Empty:
+				break
+
+			for img, lim, row, scale in zip(self.images, self.limits, rows, self.scales):
+
+				img[i, :] = row * scale
+				finite = img[i, np.isfinite(img[i, :]) & (img[i, :] != 0)]
+				if finite.shape[0]:
+					lim[0] = min(lim[0], finite.min())
+					lim[1] = max(lim[1], finite.max())
+
+			self._last_line = i
+			changed = True
+
+		now = time.perf_counter()
+		if not (changed or force) or (not force and now - self._last_draw < self.min_interval):
+			return False
+
+		for artist, img, lim in zip(self.artists, self.images, self.limits):
+
+			artist.set_data(img)
+			if lim[0] < lim[1]:
+				artist.set_clim(vmin=lim[0], vmax=lim[1])
+
+		if self._last_line is not None:
+
+			row = self.images[0][self._last_line, :]
+			self.text.set_text("Line {0:.0f}, average tFP (us) ="
+							   " {1:.2f} +/- {2:.2f}".format(self._last_line + 1,
+															 np.nanmean(row), np.nanstd(row)))
+
+		self.fig.canvas.draw_idle()
+		self.fig.canvas.flush_events()
+		self._last_draw = now
+
+		return True
+
+	def run(self, func, *args, **kwargs):
+		"""
+		Calls func(*args, **kwargs) on a background thread and redraws from
+		this thread until it returns
+
+		Returns
+		-------
+		The return value of func; exceptions in func are raised here
+		"""
+		result = {}
+
+		def _target():
+			try:
+				result['value'] = func(*args, **kwargs)
+			except BaseException as exc:
+				result['error'] = exc
+
+		worker = threading.Thread(target=_target, name='ffta-analysis', daemon=True)
+		worker.start()
+
+		while worker.is_alive():
+			self.render()
+			worker.join(self.min_interval)
+
+		self.render(force=True)
+
+		if 'error' in result:
+			raise result['error']
+
+		return result.get('value')
@@ -0,0 +1,480 @@
+"""output.py: Incremental binary storage of per-line results, with CSV export on request."""
+
+__author__ = "Rajiv Giridharagopal"
+__copyright__ = "Copyright 2020"
+__maintainer__ = "Rajiv Giridharagopal"
+__email__ = "rgiri@uw.edu"
+__status__ = "Development"
+
+import json
+import os
+import shutil
+
+import numpy as np
+
+from ffta.pixel_utils import badpixels
+
+FORMATS = ('npy', 'h5')
+
+"""
+Saves each finished line as soon as it is analyzed, so a run that dies keeps
+everything up to the last line, and text formatting only happens on request.
+
+Example usage:
+	>> writer = LineWriter('E:/Data/scan/ffta_results', n_lines, n_pixels, n_points)
+	>> for i, f in enumerate(data_files):
+	>>     tfp, shift, inst_freq = line.Line(load.signal(f), config, n_pixels).analyze()
+	>>     writer.write_line(i, tfp, shift, inst_freq)
+	>> writer.to_csv('E:/Data/scan')
+	>> writer.close()
+
+	Later:
+	>> tfp, shift = LineWriter('E:/Data/scan/ffta_results').read()
+"""
+
+
+class LineWriter:
+	"""
+	Binary store of tfp and shift images (and optionally inst_freq traces) that
+	is filled one line at a time.
+
+	Parameters
+	----------
+	path : str
+		Folder of .npy files (fmt='npy', memory-mapped) or an .h5 file (fmt='h5')
+	n_lines, n_pixels : int, optional
+		Image size. Not needed to open an existing store.
+	n_points : int, optional
+		Points per inst_freq trace. If given, inst_freq is stored as
+		(n_lines, n_pixels, n_points) float32; otherwise it is not stored.
+	fmt : str, optional
+		'npy' or 'h5'. Inferred from the extension of path if it ends in .h5
+	mode : str, optional
+		'a' (default) opens an existing store of the same size, keeping the lines
+		already written, or creates one. 'w' always creates a new store.
+
+	Attributes
+	----------
+	tfp, shift : (n_lines, n_pixels) array-like
+		memmaps or h5py Datasets
+	inst_freq : (n_lines, n_pixels, n_points) array-like or None
+	done : (n_lines,) bool array-like
+		Which lines have been written
+	"""
+
+	def __init__(self, path, n_lines=None, n_pixels=None, n_points=None, fmt=None, mode='a'):
+
+		if fmt is None:
+			fmt = 'h5' if path.endswith('.h5') else 'npy'
+		if fmt not in FORMATS:
+			raise ValueError('fmt must be one of ' + ', '.join(FORMATS))
+
+		self.path = path
+		self.fmt = fmt
+		self._file = None
+
+		exists = os.path.exists(self._name('done'))
+		if mode == 'a' and exists:
+			self._open()
+			if n_lines is not None and self.tfp.shape != (n_lines, n_pixels):
+				raise ValueError('Existing store {} has shape {}, not {}'.format(path, self.tfp.shape,
+																			   (n_lines, n_pixels)))
+		elif n_lines is None or n_pixels is None:
+			raise ValueError('n_lines and n_pixels are needed to create a store')
+		else:
+			self._create(int(n_lines), int(n_pixels), n_points)
+
+		return
+
+	def _name(self, key):
+
+		if self.fmt == 'h5':
+			return self.path
+
+		return os.path.join(self.path, key + '.npy')
+
+	def _create(self, n_lines, n_pixels, n_points):
+
+		shapes = {'tfp': (n_lines, n_pixels), 'shift': (n_lines, n_pixels), 'done': (n_lines,)}
+		dtypes = {'tfp': np.float64, 'shift': np.float64, 'done': np.bool_}
+		if n_points is not None:
+			shapes['inst_freq'] = (n_lines, n_pixels, int(n_points))
+			dtypes['inst_freq'] = np.float32
+
+		if self.fmt == 'h5':
+
+			import h5py
+			self._file = h5py.File(self.path, 'w')
+			for key, shape in shapes.items():
+				chunks = (1,) + shape[1:] if len(shape) > 1 else None  # one line per chunk
+				self._file.create_dataset(key, shape=shape, dtype=dtypes[key], chunks=chunks,
+										  fillvalue=np.nan if key in ('tfp', 'shift') else 0)
+
+		else:
+
+			os.makedirs(self.path, exist_ok=True)
+			# 'done' last, so that a store is only found once it is complete
+			for key in sorted(shapes, key=lambda k: k == 'done'):
+				arr = np.lib.format.open_memmap(self._name(key), mode='w+', dtype=dtypes[key],
+												shape=shapes[key])
+				if key in ('tfp', 'shift'):
+					arr[:] = np.nan
+				arr.flush()
+				del arr
+
+		self._open()
+
+		return
+
+	def _open(self):
+
+		if self.fmt == 'h5':
+
+			if self._file is None:
+				import h5py
+				self._file = h5py.File(self.path, 'r+')
+			get = self._file.get
+
+		else:
+
+			def get(key):
+				if not os.path.exists(self._name(key)):
+					return None
+				return np.load(self._name(key), mmap_mode='r+')
+
+		self.tfp = get('tfp')
+		self.shift = get('shift')
+		self.inst_freq = get('inst_freq')
+		self.done = get('done')
+
+		return
+
+	@property
+	def n_done(self):
+		"""Number of lines written so far"""
+
+		return int(np.count_nonzero(self.done[()]))
+
+	def write_line(self, i, tfp, shift, inst_freq=None):
+		"""
+		Stores line i and flushes it to disk
+
+		Parameters
+		----------
+		i : int
+			Line number
+		tfp, shift : (n_pixels,) array_like
+		inst_freq : (n_points, n_pixels) array_like, optional
+			As returned by Line.analyze. Ignored if the store has no inst_freq.
+		"""
+		self.tfp[i] = tfp
+		self.shift[i] = shift
+
+		if inst_freq is not None and self.inst_freq is not None:
+			self.inst_freq[i] = np.asarray(inst_freq).T[:, :self.inst_freq.shape[2]]
+
+		self.done[i] = True
+		self.flush()
+
+		return
+
+	def flush(self):
+
+		if self.fmt == 'h5':
+			self._file.flush()
+		else:
+			for arr in (self.tfp, self.shift, self.inst_freq, self.done):
+				if arr is not None:
+					arr.flush()
+
+		return
+
+	def read(self):
+		"""
+		Returns
+		-------
+		tfp, shift : (n_lines, n_pixels) ndarray
+			In-memory copies; lines not yet written are NaN
+		"""
+
+		return np.array(self.tfp), np.array(self.shift)
+
+	def to_csv(self, folder=None, suffix='', mirror=True, fixed=True):
+		"""
+		Writes tfp, shift and (if fixed) the bad-pixel-corrected tfp_fixed as CSV
+
+		Parameters
+		----------
+		folder : str, optional
+			Defaults to the folder containing the store
+		suffix : str, optional
+			Appended to the file names, e.g. '-scan1' gives tfp-scan1.csv
+		mirror : bool, optional
+			Flips left-right, as analyze.py always has
+		fixed : bool, optional
+			Also writes tfp_fixed
+
+		Returns
+		-------
+		list of str
+			Paths written
+		"""
+		if folder is None:
+			folder = os.path.dirname(os.path.abspath(self.path))
+
+		tfp, shift = self.read()
+		maps = {'tfp': tfp, 'shift': shift}
+		if fixed:
+			maps['tfp_fixed'] = fix_tfp(tfp)
+
+		return save_maps(folder, maps, suffix, mirror, fmt='csv')
+
+	def close(self):
+
+		self.flush()
+
+		if self.fmt == 'h5':
+			self._file.close()
+
+		self.tfp = self.shift = self.inst_freq = self.done = None
+
+		return
+
+	def copy_lines(self, source, rows):
+		"""
+		Copies lines from another store
+
+		Parameters
+		----------
+		source : LineWriter
+			With the same n_pixels
+		rows : dict
+			{line in this store: line in source}. Lines not yet done in source
+			are skipped. inst_freq is copied if both stores have the same length.
+		"""
+		traces = (self.inst_freq is not None and source.inst_freq is not None and
+				  self.inst_freq.shape[1:] == source.inst_freq.shape[1:])
+
+		for i, j in rows.items():
+
+			if not source.done[j]:
+				continue
+
+			self.tfp[i] = source.tfp[j]
+			self.shift[i] = source.shift[j]
+			if traces:
+				self.inst_freq[i] = source.inst_freq[j]
+			self.done[i] = True
+
+		self.flush()
+
+		return
+
+	def __enter__(self):
+
+		return self
+
+	def __exit__(self, *args):
+
+		self.close()
+
+		return
+
+
+def rebuild(path, n_lines, n_pixels, n_points=None, rows=None, fmt=None):
+	"""
+	Replaces the store at path with a new one of a different size, keeping
+	the lines given in rows (e.g. when lines were added to a scan folder)
+
+	Parameters
+	----------
+	path : str
+	n_lines, n_pixels, n_points : int
+		See LineWriter
+	rows : dict, optional
+		{new line: old line}
+	fmt : str, optional
+
+	Returns
+	-------
+	LineWriter
+		The new store, open at path
+	"""
+	new = LineWriter(path + '.new', n_lines, n_pixels, n_points, fmt=fmt, mode='w')
+	fmt = new.fmt
+
+	if rows and os.path.exists(path):
+		old = LineWriter(path, fmt=fmt)
+		new.copy_lines(old, rows)
+		old.close()
+
+	new.close()
+
+	if os.path.isdir(path):
+		shutil.rmtree(path)
+	os.replace(path + '.new', path)
+
+	return LineWriter(path, fmt=fmt)
+
+
+class Manifest:
+	"""
+	Record of which data file went into which line of a store, and with which
+	processing parameters, so that a re-run only analyzes new or changed files.
+
+	Files are identified by name, size and modification time. The manifest is
+	saved next to the store as <store>.json.
+
+	Parameters
+	----------
+	store_path : str
+		Path of the LineWriter store
+
+	Attributes
+	----------
+	params : str
+		Digest of the processing parameters (see PixelParameters.digest)
+	files : dict
+		{file name: [size, mtime_ns, line]}
+
+	Example usage:
+		>> run = Manifest(store_path)
+		>> todo = run.stale(data_files, config.digest(n_pixels))
+		>> ... analyze data_files[i] for i in todo, then run.record(data_files[i], i)
+	"""
+
+	def __init__(self, store_path):
+
+		self.path = store_path + '.json'
+		self.params = None
+		self.files = {}
+
+		if os.path.exists(self.path) and os.path.exists(store_path):
+			with open(self.path) as f:
+				saved = json.load(f)
+			self.params = saved['params']
+			self.files = saved['files']
+
+		return
+
+	@staticmethod
+	def stat(data_file):
+		"""[size, mtime_ns] of a file"""
+
+		info = os.stat(data_file)
+
+		return [info.st_size, info.st_mtime_ns]
+
+	def rows(self, data_files, params):
+		"""
+		Where the results of unchanged files are stored
+
+		Returns
+		-------
+		dict
+			{index in data_files: stored line}; empty if params changed
+		"""
+		if params != self.params:
+			return {}
+
+		rows = {}
+		for i, data_file in enumerate(data_files):
+
+			record = self.files.get(os.path.basename(data_file))
+			if record is not None and record[:2] == self.stat(data_file):
+				rows[i] = record[2]
+
+		return rows
+
+	def stale(self, data_files, params):
+		"""Indices of data_files that are new, changed, or were analyzed with other params"""
+
+		rows = self.rows(data_files, params)
+
+		return [i for i in range(len(data_files)) if i not in rows]
+
+	def reset(self, params, rows=None, data_files=None):
+		"""
+		Starts a manifest for new params, or renumbers the kept files
+
+		Parameters
+		----------
+		params : str
+		rows : dict, optional
+			{index in data_files: stored line} of the files to keep; their
+			lines become their index in data_files
+		data_files : list of str, optional
+		"""
+		kept = {}
+		if rows and params == self.params:
+			for i in rows:
+				name = os.path.basename(data_files[i])
+				kept[name] = self.files[name][:2] + [i]
+
+		self.params = params
+		self.files = kept
+		self.save()
+
+		return
+
+	def record(self, data_file, line):
+		"""Marks data_file as stored in line, and saves the manifest"""
+
+		self.files[os.path.basename(data_file)] = self.stat(data_file) + [int(line)]
+		self.save()
+
+		return
+
+	def save(self):
+
+		with open(self.path + '.tmp', 'w') as f:
+			json.dump({'params': self.params, 'files': self.files}, f, indent=1)
+
+		os.replace(self.path + '.tmp', self.path)
+
+		return
+
+
+def fix_tfp(tfp, threshold=2):
+	"""tfp with 'hot' pixels replaced, as saved in tfp_fixed"""
+
+	tfp_fixed, _ = badpixels.fix_array(tfp, threshold=threshold)
+
+	return np.array(tfp_fixed)
+
+
+def save_maps(folder, maps, suffix='', mirror=False, fmt='csv'):
+	"""
+	Saves 2D maps as <name><suffix>.csv (or .npy) in folder
+
+	Parameters
+	----------
+	folder : str
+	maps : dict
+		e.g. {'tfp': tfp, 'shift': shift}
+	suffix : str, optional
+	mirror : bool, optional
+		Flips each map left-right before saving
+	fmt : str, optional
+		'csv' (transposed, as the ffta CSV files always are) or 'npy'
+
+	Returns
+	-------
+	list of str
+		Paths written
+	"""
+	paths = []
+
+	for name, data in maps.items():
+
+		data = np.fliplr(data) if mirror else data
+		path = os.path.join(folder, name + suffix + '.' + fmt)
+
+		if fmt == 'npy':
+			np.save(path, data)
+		else:
+			np.savetxt(path, data.T, delimiter=',')
+
+		paths.append(path)
+
+	return paths
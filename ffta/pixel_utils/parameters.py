@@ -0,0 +1,285 @@
+"""parameters.py: Immutable, validated processing parameters for Pixel."""
+
+__author__ = "Rajiv Giridharagopal"
+__copyright__ = "Copyright 2020"
+__maintainer__ = "Rajiv Giridharagopal"
+__email__ = "rgiri@uw.edu"
+__status__ = "Development"
+
+import hashlib
+from typing import NamedTuple, Any
+
+import numpy as np
+
+# Keys that pyUSID/h5py attach to attributes dicts; these are HDF5 object
+# references and cannot be pickled or used for processing
+_IGNORED_KEYS = ('Position_Indices', 'Position_Values',
+				 'Spectroscopic_Indices', 'Spectroscopic_Values',
+				 'quantity', 'units')
+
+# Needed to construct a Pixel; the others are checked by the stages that use them
+_REQUIRED_KEYS = ('trigger', 'sampling_rate')
+
+METHODS = ('hilbert', 'wavelet', 'stft')
+FIT_FORMS = ('product', 'sum', 'exp', 'ringdown', 'phase')
+
+# Processing stages in order, with the fields each one adds to those of the
+# stages before it. The last stage (the fit) depends on every field.
+STAGES = ('inst_freq', 'tfp')
+_STAGE_FIELDS = {'inst_freq': ('trigger', 'total_time', 'sampling_rate', 'drive_freq',
+							   'window', 'bandpass_filter', 'filter_bandwidth', 'n_taps',
+							   'filter_amplitude', 'filter_frequency', 'wavelet', 'scales',
+							   'wavelet_params', 'fft_cycles', 'fft_params', 'method',
+							   'check_drive', 'AMPINVOLS')}
+
+
+class PixelParameters(NamedTuple):
+	"""
+	Processing parameters shared by every pixel of an image.
+
+	This is built (and validated) once per image with from_dict and then
+	handed to every Pixel, so a Pixel only carries its own signal and results.
+	Being a tuple, it is immutable and pickles compactly for parallel workers.
+	Use _replace(key=value) to derive a modified copy.
+
+	Attributes
+	----------
+	trigger, sampling_rate : float
+		Required acquisition parameters, see ffta.pixel.Pixel
+	total_time, drive_freq, roi : float
+		Acquisition parameters, None if not given. roi is only needed to fit
+		(e.g. not for if_only or G-KPFM analysis).
+	window : str or int
+		Window name for scipy.signal.get_window, or 0 for no window
+	bandpass_filter : int
+		0: no filtering, 1: FIR filter, 2: IIR filter
+	extras : dict
+		Any other keys in the supplied parameters (e.g. scan sizes from the
+		HDF5 attributes). These are not used by Pixel but kept for subclasses.
+	"""
+
+	# Acquisition
+	trigger: float
+	sampling_rate: float
+	total_time: float = None
+	drive_freq: float = None
+	roi: float = None
+
+	# FIR (Hilbert) filtering
+	window: Any = 'blackman'
+	bandpass_filter: int = 1
+	filter_bandwidth: float = 5000.0
+	n_taps: int = 1499
+	filter_amplitude: bool = False
+	filter_frequency: bool = False
+
+	# Wavelet and short time Fourier transform
+	wavelet: str = 'cmor1-1'  # default complex Morlet wavelet
+	scales: Any = None  # None is np.arange(100, 2, -1)
+	wavelet_params: Any = None  # currently just optimize flag is supported
+	fft_cycles: int = 2
+	fft_params: Any = None
+
+	# Analysis options
+	method: str = 'hilbert'
+	fit: bool = True
+	fit_form: str = 'product'
+	recombination: bool = False
+	phase_fitting: bool = False
+	check_drive: bool = True
+
+	# Cantilever parameters, plugging in some reasonable defaults
+	AMPINVOLS: float = 122e-9
+	SpringConstant: float = 23.2
+	k: float = 23.2
+	DriveAmplitude: float = 1.7e-9
+	Mass: float = 4.55e-12
+	Beta: float = 3114.0
+	Q: float = 360.0
+
+	extras: Any = None
+
+	@classmethod
+	def from_dict(cls, params, can_params=None, **options):
+		"""
+		Builds and validates the parameters from the usual dictionaries.
+
+		Precedence follows the original Pixel behavior: options (the Pixel
+		keyword arguments such as method or fit_form) are defaults that
+		are overwritten by params, which in turn are overwritten by can_params.
+
+		Parameters
+		----------
+		params : dict
+			Processing parameters, e.g. from pixel_utils.load.configuration
+			or the attributes of an HDF5 dataset
+		can_params : dict, optional
+			Cantilever parameters, see ffta.pixel_utils.load.cantilever_params
+		options : keyword arguments
+			Any field of PixelParameters
+
+		Returns
+		-------
+		PixelParameters
+		"""
+		if can_params is None:
+			can_params = {}
+
+		merged = dict(options)
+		merged.update(params)
+
+		for key, value in can_params.items():
+			try:
+				merged[key] = float(value)
+			except (TypeError, ValueError):
+				merged[key] = value
+
+		missing = [key for key in _REQUIRED_KEYS if key not in merged]
+		if any(missing):
+			raise ValueError('Missing required parameters: ' + ', '.join(missing))
+
+		fields = {}
+		extras = {}
+		for key, value in merged.items():
+
+			if key in _IGNORED_KEYS or key == 'extras':
+				continue
+
+			if key in cls._fields:
+				fields[key] = _coerce(cls.__annotations__[key], value)
+			else:
+				extras[key] = value
+
+		fields['extras'] = extras
+		fields['method'] = str(fields.get('method', 'hilbert')).lower()
+		fields['fit_form'] = str(fields.get('fit_form', 'product')).lower()
+
+		config = cls(**fields)
+		config.validate()
+
+		return config
+
+	def validate(self):
+		"""Raises ValueError for inconsistent parameters."""
+
+		if self.sampling_rate <= 0:
+			raise ValueError('sampling_rate must be positive')
+
+		if self.drive_freq is not None and not 0 < self.drive_freq < self.sampling_rate / 2:
+			raise ValueError('drive_freq must be between 0 and the Nyquist frequency')
+
+		if self.total_time is not None and not 0 <= self.trigger <= self.total_time:
+			raise ValueError('trigger must be within total_time')
+
+		if self.roi is not None and self.roi < 0:
+			raise ValueError('roi must be non-negative')
+
+		if self.method not in METHODS:
+			raise ValueError('Invalid analysis method! Valid options: ' + ', '.join(METHODS))
+
+		if self.fit_form not in FIT_FORMS:
+			raise ValueError('Invalid fit_form! Valid options: ' + ', '.join(FIT_FORMS))
+
+		if self.bandpass_filter not in (0, 1, 2):
+			raise ValueError('bandpass_filter must be 0, 1, or 2')
+
+		return
+
+	def to_dict(self):
+		"""Returns a flat parameters dictionary, including the extras."""
+
+		params = dict(self.extras)
+		params.update(self._asdict())
+		del params['extras']
+
+		return params
+
+	def digest(self, *extra):
+		"""
+		Hash of the processing parameters, e.g. to tell whether stored results
+		were made with the same settings. Extras (scan sizes and other keys
+		that Pixel does not use) are not included.
+
+		Parameters
+		----------
+		extra : optional
+			Anything else the results depend on, e.g. n_pixels
+
+		Returns
+		-------
+		str
+			SHA-1 hex digest
+		"""
+		fields = [(key, _plain(value)) for key, value in self._asdict().items() if key != 'extras']
+
+		return hashlib.sha1(repr((fields, _plain(extra))).encode()).hexdigest()
+
+	def stage_digest(self, stage, *extra):
+		"""
+		Hash of the parameters that one processing stage depends on, see STAGES.
+		e.g. the instantaneous frequency does not depend on roi or fit_form, so
+		stored traces with the same 'inst_freq' digest can be refit instead of
+		being calculated again.
+
+		Parameters
+		----------
+		stage : str
+			One of STAGES; the last one is the same as digest
+		extra : optional
+			Anything else the results depend on, e.g. the dataset name
+
+		Returns
+		-------
+		str
+			SHA-1 hex digest
+		"""
+		if stage not in STAGES:
+			raise ValueError('Invalid stage! Valid options: ' + ', '.join(STAGES))
+
+		if stage == STAGES[-1]:
+			return self.digest(*extra)
+
+		keys = []
+		for name in STAGES[:STAGES.index(stage) + 1]:
+			keys.extend(_STAGE_FIELDS[name])
+		fields = [(key, _plain(getattr(self, key))) for key in keys]
+
+		return hashlib.sha1(repr((stage, fields, _plain(extra))).encode()).hexdigest()
+
+
+def _coerce(kind, value):
+	"""Converts value to the annotated type (HDF5 attributes are numpy types)"""
+
+	if value is None:
+		return value
+
+	if kind in (float, int):
+		return kind(value)
+
+	if kind is bool:
+		return bool(value)
+
+	if kind is str:
+		if isinstance(value, bytes):
+			return value.decode()
+		return str(value)
+
+	if isinstance(value, np.ndarray) and value.ndim == 0:
+		return value.item()
+
+	return value
+
+
+def _plain(value):
+	"""Python equivalent of value, so that its repr does not depend on numpy types"""
+
+	if isinstance(value, (np.ndarray, np.generic)):
+		return np.asarray(value).tolist()
+
+	if isinstance(value, (list, tuple)):
+		return [_plain(v) for v in value]
+
+	if isinstance(value, dict):
+		return sorted((str(k), _plain(v)) for k, v in value.items())
+
+	return value
@@ -0,0 +1,229 @@
+"""results.py: Preallocated result records shared by Pixel, Line, and the Process classes."""
+
+__author__ = "Rajiv Giridharagopal"
+__copyright__ = "Copyright 2020"
+__maintainer__ = "Rajiv Giridharagopal"
+__email__ = "rgiri@uw.edu"
+__status__ = "Development"
+
+import numpy as np
+
+# Fit status codes stored in the 'status' field
+FIT_OK = 0
+FIT_FAILED = 1  # fit ran but returned non-finite tfp/shift
+FIT_SKIPPED = 2  # no fit, e.g. instantaneous frequency only
+
+# Largest number of fit parameters (fitting.fit_sum); shorter popt are NaN-padded
+N_POPT = 4
+
+SCALAR_DTYPE = np.dtype([('tfp', np.float64),
+						 ('shift', np.float64),
+						 ('rms', np.float64),
+						 ('popt', np.float64, (N_POPT,)),
+						 ('status', np.int8),
+						 ('drive_freq', np.float64)])
+
+# Trace outputs of the FF-trEFM pipeline; names match the Pixel attributes
+FFTREFM_TRACES = ('inst_freq', 'amplitude', 'phase', 'power_dissipated')
+
+
+class PixelResults:
+	"""
+	Struct-of-arrays container for the outputs of a block of pixels.
+
+	Scalars (tfp, shift, rms, popt, status, drive_freq) are one NumPy structured array and
+	each trace output (e.g. inst_freq) is a contiguous (n_pixels, n_points)
+	array. Pixels fill their own row in place (Pixel.fill_results), so a Line
+	or a Process batch can hand the arrays to HDF5 without repacking.
+
+	Parameters
+	----------
+	n_pixels : int
+		Number of rows (pixels) in the block
+	trace_points : dict, optional
+		Maps the name of each trace output to its number of points,
+		e.g. {'inst_freq': 16000}
+	dtype : numpy dtype, optional
+		Data type of the trace arrays
+
+	Attributes
+	----------
+	scalars : (n_pixels,) structured ndarray
+		Fields 'tfp', 'shift', 'rms', 'popt', 'status', and 'drive_freq' (the
+		drive frequency the pixel was analyzed with, see Pixel.check_drive_freq)
+	traces : dict
+		Maps trace name to a (n_pixels, n_points) ndarray
+	timer : timing.StageTimer or None
+		Stage timings of the pixels in this block, if they were recorded.
+		This is how timings from parallel workers get back to the Process.
+
+	Examples
+	--------
+	>>> results = PixelResults(n_pixels, {'inst_freq': n_points})
+	>>> pix.analyze()
+	>>> pix.fill_results(results, 0)
+	>>> results['tfp'], results['inst_freq']
+	"""
+
+	__slots__ = ('scalars', 'traces', 'timer')
+
+	def __init__(self, n_pixels, trace_points={}, dtype=np.float64):
+
+		self.scalars = np.zeros(n_pixels, dtype=SCALAR_DTYPE)
+		self.scalars['tfp'] = np.nan
+		self.scalars['shift'] = np.nan
+		self.scalars['rms'] = np.nan
+		self.scalars['popt'] = np.nan
+		self.scalars['status'] = FIT_SKIPPED
+		self.scalars['drive_freq'] = np.nan
+
+		self.traces = {}
+		for name, n_points in trace_points.items():
+			self.traces[name] = np.zeros((n_pixels, int(n_points)), dtype=dtype)
+
+		self.timer = None
+
+		return
+
+	def __len__(self):
+
+		return self.scalars.shape[0]
+
+	def __getitem__(self, key):
+		"""Returns a scalar field or a trace array by name (views, not copies)"""
+
+		if key in self.traces:
+			return self.traces[key]
+
+		return self.scalars[key]
+
+	def set_trace(self, name, index, values):
+		"""
+		Writes one trace into row index, truncating to the stored length
+
+		Parameters
+		----------
+		name : str
+			Name of the trace, e.g. 'inst_freq'
+		index : int
+			Row (pixel) in this block
+		values : array_like
+			The trace. Scalars (e.g. 0 for skipped outputs) fill the row.
+		"""
+		row = self.traces[name][index]
+		values = np.asarray(values)
+
+		if values.ndim == 0:
+			row[:] = values
+		else:
+			n = min(row.shape[0], values.shape[0])
+			row[:n] = values[:n]
+
+		return
+
+	def set_scalars(self, index, tfp=np.nan, shift=np.nan, rms=np.nan,
+					popt=None, status=FIT_OK, drive_freq=np.nan):
+		"""Writes the scalar outputs of one pixel into row index"""
+
+		self.scalars['tfp'][index] = tfp
+		self.scalars['shift'][index] = shift
+		self.scalars['rms'][index] = rms
+		self.scalars['status'][index] = status
+		self.scalars['drive_freq'][index] = drive_freq
+
+		if popt is not None:
+			popt = np.ravel(popt)[:N_POPT]
+			self.scalars['popt'][index, :popt.shape[0]] = popt
+
+		return
+
+	def insert(self, start, other):
+		"""
+		Copies all rows of another PixelResults into this one starting at row start.
+		Shorter traces are zero-padded.
+
+		Parameters
+		----------
+		start : int
+			First row to write
+		other : PixelResults
+			Block with the same trace names
+		"""
+		stop = start + len(other)
+		self.scalars[start:stop] = other.scalars
+
+		for name, arr in self.traces.items():
+			n = min(arr.shape[1], other.traces[name].shape[1])
+			arr[start:stop, :n] = other.traces[name][:, :n]
+			arr[start:stop, n:] = 0
+
+		return
+
+	@classmethod
+	def from_arrays(cls, scalars, traces):
+		"""
+		A PixelResults over existing arrays (e.g. in shared memory), without copying
+
+		Parameters
+		----------
+		scalars : (n_pixels,) structured ndarray of SCALAR_DTYPE
+		traces : dict
+			Maps trace name to a (n_pixels, n_points) ndarray
+
+		Returns
+		-------
+		PixelResults
+		"""
+		out = cls.__new__(cls)
+		out.scalars = scalars
+		out.traces = dict(traces)
+		out.timer = None
+
+		return out
+
+	def fits(self, n_pixels, trace_points, dtype):
+		"""Whether this block has exactly these rows, traces, and trace dtype"""
+
+		if len(self) != n_pixels or set(self.traces) != set(trace_points):
+			return False
+
+		return all(arr.shape[1] == trace_points[name] and arr.dtype == dtype
+				   for name, arr in self.traces.items())
+
+	@classmethod
+	def concatenate(cls, blocks, out=None):
+		"""
+		Combines a list of PixelResults (e.g. from parallel_compute) into
+		one preallocated block, in order. Stage timers are merged.
+
+		Parameters
+		----------
+		blocks : list of PixelResults
+		out : PixelResults, optional
+			Block to fill, e.g. the one of the previous batch, so the buffers
+			are reused. A new block is made if it does not fit.
+
+		Returns
+		-------
+		PixelResults
+		"""
+		n_pixels = sum(len(b) for b in blocks)
+		first = blocks[0]
+		trace_points = {k: v.shape[1] for k, v in first.traces.items()}
+		dtype = first.traces[next(iter(first.traces))].dtype if any(first.traces) else np.float64
+
+		if out is None or not out.fits(n_pixels, trace_points, dtype):
+			out = cls(n_pixels, trace_points, dtype=dtype)
+		out.timer = None
+
+		start = 0
+		for b in blocks:
+			out.insert(start, b)
+			start += len(b)
+
+			if b.timer is not None:
+				if out.timer is None:
+					out.timer = type(b.timer)(b.timer.allocations)
+				out.timer.merge(b.timer)
+
+		return out
@@ -25,6 +25,8 @@ def find_minimum(pix, cut):
 		tFP value
 	pix.shift : float
 		frequency shift value at time t=tfp
+	pix.rms : float
+		error between the spline and the data
 	pix.best_fit : ndarray
 		Best-fit line calculated from spline function
 
@@ -54,6 +56,8 @@ def find_minimum(pix, cut):
 	pix.tfp = idx / pix.sampling_rate
 	pix.shift = func(0) - func(idx)
 
+	pix.rms = np.sqrt(np.mean(np.square(pix.best_fit - cut)))
+
 	return
 
 
@@ -144,6 +148,8 @@ def fit_freq_sum(pix, ridx, cut, t):
 	pix.tfp = np.argmin(pix.best_fit) / pix.sampling_rate
 	pix.shift = np.min(pix.best_fit)
 
+	pix.rms = np.sqrt(np.mean(np.square(pix.best_fit - cut)))
+
 	return
 
 
@@ -167,6 +173,8 @@ def fit_freq_exp(pix, ridx, cut, t):
 		tFP value
 	pix.shift : float
 		frequency shift value at time t=tfp
+	pix.rms : float
+		fitting error
 	pix.popt : ndarray
 		The fit parameters for the function fitting.fit_exp
 	pix.best_fit : ndarray
@@ -183,6 +191,8 @@ def fit_freq_exp(pix, ridx, cut, t):
 	pix.shift = A
 	pix.tfp = tau
 
+	pix.rms = np.sqrt(np.mean(np.square(pix.best_fit - cut)))
+
 	return
 
 
@@ -207,6 +217,8 @@ def fit_ringdown(pix, ridx, cut, t):
 		Same as tFP. This is the actual variable, tFP is there for code simplicity
 	pix.shift : float
 		amplitude of the single exponential decay
+	pix.rms : float
+		fitting error
 	pix.popt : ndarray
 		The fit parameters for the function fitting.fit_ringdown
 	pix.best_fit : ndarray
@@ -226,6 +238,8 @@ def fit_ringdown(pix, ridx, cut, t):
 	pix.tfp = np.pi * pix.drive_freq * tau  # same as ringdown_Q to help with pycroscopy bugs that call tfp
 	pix.ringdown_Q = np.pi * pix.drive_freq * tau
 
+	pix.rms = np.sqrt(np.mean(np.square(pix.best_fit - cut)))
+
 	return
 
 
@@ -249,6 +263,8 @@ def fit_phase(pix, ridx, cut, t):
 		tFP value
 	pix.shift : float
 		frequency shift value at time t=tfp
+	pix.rms : float
+		fitting error
 	pix.popt : ndarray
 		The fit parameters for the function fitting.fit_phase
 	pix.best_fit : ndarray
@@ -272,4 +288,6 @@ def fit_phase(pix, ridx, cut, t):
 	pix.best_fit = -A * np.exp(-t / tau1) * np.expm1(-t / tau2)
 	pix.best_phase = A * tau1 * np.exp(-t / tau1) * postfactor + A * tau1 * (1 - tau2 / (tau1 + tau2))
 
+	pix.rms = np.sqrt(np.mean(np.square(pix.best_phase - cut)))
+
 	return
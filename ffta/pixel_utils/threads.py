@@ -0,0 +1,77 @@
+"""threads.py: Shared thread pools for processing pixels concurrently within one process."""
+
+__author__ = "Rajiv Giridharagopal"
+__copyright__ = "Copyright 2020"
+__maintainer__ = "Rajiv Giridharagopal"
+__email__ = "rgiri@uw.edu"
+__status__ = "Development"
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+_EXECUTORS = {}
+_LOCK = threading.Lock()
+
+
+def get_executor(n_threads):
+	"""
+	Returns the process-wide ThreadPoolExecutor with n_threads workers
+
+	Pools are created on first use and reused afterwards, so processing many
+	lines (e.g. during live imaging) does not start new threads for each line.
+
+	Parameters
+	----------
+	n_threads : int
+
+	Returns
+	-------
+	concurrent.futures.ThreadPoolExecutor
+	"""
+	with _LOCK:
+
+		if n_threads not in _EXECUTORS:
+			_EXECUTORS[n_threads] = ThreadPoolExecutor(n_threads, thread_name_prefix='ffta')
+
+		return _EXECUTORS[n_threads]
+
+
+def map_ordered(func, items, n_threads=1):
+	"""
+	Applies func to every item, on the shared pool if n_threads > 1
+
+	Parameters
+	----------
+	func : callable
+		Must not itself wait on the same pool
+	items : iterable
+	n_threads : int, optional
+		1 (default) runs in the calling thread
+
+	Returns
+	-------
+	list
+		Results in the order of items, whatever order the tasks finish in
+	"""
+	if n_threads is None or n_threads <= 1:
+		return [func(item) for item in items]
+
+	return list(get_executor(int(n_threads)).map(func, items))
+
+
+def split_blocks(n_items, n_threads, per_thread=4):
+	"""
+	Splits range(n_items) into contiguous blocks for n_threads workers
+
+	Several blocks per thread balance pixels whose fits take longer.
+
+	Returns
+	-------
+	list of (start, stop) tuples
+	"""
+	n_blocks = max(1, min(n_items, per_thread * max(1, n_threads)))
+	edges = np.linspace(0, n_items, n_blocks + 1).astype(int)
+
+	return [(int(a), int(b)) for a, b in zip(edges[:-1], edges[1:]) if b > a]
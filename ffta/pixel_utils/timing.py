@@ -0,0 +1,215 @@
+"""timing.py: Opt-in per-stage timing (and allocation) statistics for the processing pipeline."""
+
+__author__ = "Rajiv Giridharagopal"
+__copyright__ = "Copyright 2020"
+__maintainer__ = "Rajiv Giridharagopal"
+__email__ = "rgiri@uw.edu"
+__status__ = "Development"
+
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+STATS_DTYPE = np.dtype([('stage', 'S32'),
+						('count', np.int64),
+						('total', np.float64),
+						('mean', np.float64),
+						('min', np.float64),
+						('max', np.float64),
+						('peak_bytes', np.int64)])
+
+_NULL_STAGE = nullcontext()
+
+
+def stage(timer, name):
+	"""
+	Context manager timing a stage on timer, or a no-op if timer is None.
+
+	This is what processing code calls, so that timing is zero-cost unless
+	a StageTimer was supplied:
+
+	>>> with timing.stage(self.timer, 'hilbert'):
+	>>>     self.hilbert()
+
+	Parameters
+	----------
+	timer : StageTimer or None
+	name : str
+		Name of the stage
+	"""
+	if timer is None:
+		return _NULL_STAGE
+
+	return timer.stage(name)
+
+
+class StageTimer:
+	"""
+	Registry of wall-clock time, and optionally peak allocated memory, per stage.
+
+	One StageTimer can be shared by many pixels; timers recorded in parallel
+	workers are combined with merge(). The summary table can be printed or
+	written into an HDF5 results group.
+
+	Parameters
+	----------
+	allocations : bool, optional
+		Also record the peak memory allocated within each stage using
+		tracemalloc. This is considerably slower than timing alone.
+
+	Examples
+	--------
+	>>> timer = StageTimer()
+	>>> pix = Pixel(signal_array, params, timer=timer)
+	>>> pix.analyze()
+	>>> print(timer)
+	"""
+
+	def __init__(self, allocations=False):
+
+		self.allocations = allocations
+		self._stats = {}  # stage: [count, total, min, max, peak_bytes]
+		self._frames = []  # [baseline, peak] of the stages currently running
+		self._started_tracing = False  # tracing was started by this timer, not the caller
+
+		return
+
+	@contextmanager
+	def stage(self, name):
+		"""Times the enclosed block and records it under name"""
+
+		if self.allocations:
+			self._enter_allocations()
+
+		t0 = time.perf_counter()
+		try:
+			yield
+		finally:
+			elapsed = time.perf_counter() - t0
+			peak = self._exit_allocations() if self.allocations else 0
+			self.record(name, elapsed, peak)
+
+	def _enter_allocations(self):
+
+		if not tracemalloc.is_tracing():
+			tracemalloc.start()
+			self._started_tracing = True
+
+		current, peak = tracemalloc.get_traced_memory()
+
+		# Keep the peak of an enclosing stage before resetting it for this one
+		if self._frames:
+			self._frames[-1][1] = max(self._frames[-1][1], peak)
+
+		tracemalloc.reset_peak()
+		self._frames.append([current, current])
+
+		return
+
+	def _exit_allocations(self):
+
+		_, peak = tracemalloc.get_traced_memory()
+		baseline, frame_peak = self._frames.pop()
+		frame_peak = max(frame_peak, peak)
+
+		if self._frames:
+			self._frames[-1][1] = max(self._frames[-1][1], frame_peak)
+			tracemalloc.reset_peak()
+		elif self._started_tracing:
+			tracemalloc.stop()
+			self._started_tracing = False
+
+		return frame_peak - baseline
+
+	def record(self, name, seconds, peak_bytes=0):
+		"""Adds one measurement of a stage"""
+
+		if name not in self._stats:
+			self._stats[name] = [0, 0.0, np.inf, 0.0, 0]
+
+		s = self._stats[name]
+		s[0] += 1
+		s[1] += seconds
+		s[2] = min(s[2], seconds)
+		s[3] = max(s[3], seconds)
+		s[4] = max(s[4], int(peak_bytes))
+
+		return
+
+	def merge(self, other):
+		"""Combines the statistics of another StageTimer (e.g. from a worker) into this one"""
+
+		if other is None:
+			return self
+
+		for name, (count, total, t_min, t_max, peak) in other._stats.items():
+
+			if name not in self._stats:
+				self._stats[name] = [0, 0.0, np.inf, 0.0, 0]
+
+			s = self._stats[name]
+			s[0] += count
+			s[1] += total
+			s[2] = min(s[2], t_min)
+			s[3] = max(s[3], t_max)
+			s[4] = max(s[4], peak)
+
+		return self
+
+	def reset(self):
+		"""Clears all statistics"""
+
+		self._stats = {}
+
+		return
+
+	def summary(self):
+		"""
+		Returns
+		-------
+		table : structured ndarray
+			One row per stage, in the order stages were first seen, with fields
+			stage, count, total, mean, min, max (seconds) and peak_bytes
+		"""
+		table = np.zeros(len(self._stats), dtype=STATS_DTYPE)
+
+		for i, (name, (count, total, t_min, t_max, peak)) in enumerate(self._stats.items()):
+			table[i] = (name.encode(), count, total, total / max(count, 1), t_min, t_max, peak)
+
+		return table
+
+	def write(self, h5_group, name='stage_timing'):
+		"""
+		Writes the summary table as a dataset into an HDF5 group, replacing any existing one
+
+		Parameters
+		----------
+		h5_group : h5py.Group
+			e.g. the results group of a Process
+		name : str, optional
+			Name of the dataset
+
+		Returns
+		-------
+		h5py.Dataset
+		"""
+		if name in h5_group:
+			del h5_group[name]
+
+		return h5_group.create_dataset(name, data=self.summary())
+
+	def __str__(self):
+
+		lines = ['{:<20}{:>10}{:>14}{:>14}{:>14}{:>14}'.format('Stage', 'Count', 'Total (s)',
+															   'Mean (ms)', 'Max (ms)', 'Peak (MB)')]
+		for row in self.summary():
+			lines.append('{:<20}{:>10d}{:>14.3f}{:>14.3f}{:>14.3f}{:>14.2f}'.format(row['stage'].decode(),
+																				row['count'],
+																				row['total'],
+																				row['mean'] * 1e3,
+																				row['max'] * 1e3,
+																				row['peak_bytes'] / 1e6))
+
+		return '\n'.join(lines)
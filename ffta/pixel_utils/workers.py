@@ -0,0 +1,274 @@
+"""workers.py: A persistent process pool that exchanges batches through shared memory."""
+
+__author__ = "Rajiv Giridharagopal"
+__copyright__ = "Copyright 2020"
+__maintainer__ = "Rajiv Giridharagopal"
+__email__ = "rgiri@uw.edu"
+__status__ = "Development"
+
+import multiprocessing
+import os
+from collections import OrderedDict
+from multiprocessing import shared_memory
+if os.name == 'posix':
+	from multiprocessing import resource_tracker
+
+import numpy as np
+
+from ffta.pixel_utils.results import PixelResults, SCALAR_DTYPE
+
+"""
+The pool is started once and kept until close(). For each batch the pixel data
+is copied into one shared input buffer, and every worker reads its block from
+there and writes its rows of results into shared output buffers, so neither the
+data nor the results are pickled; only a small task description per block is.
+
+Example usage:
+	>> pool = WorkerPool(8)
+	>> results = pool.map_blocks(FFtrEFM._map_block, data, 64, args, {'inst_freq': 16000})
+	>> results['tfp'], results['inst_freq']  # a PixelResults of the whole batch
+	>> pool.close()
+"""
+
+# Shared buffers attached in this (worker) process, most recently used last
+_ATTACHED = OrderedDict()
+_MAX_ATTACHED = 8
+
+
+class SharedArray:
+	"""
+	An ndarray in a new block of shared memory, owned by this process
+
+	Parameters
+	----------
+	shape : tuple
+	dtype : numpy dtype
+	"""
+
+	def __init__(self, shape, dtype):
+
+		self.shape = tuple(int(n) for n in shape)
+		self.dtype = np.dtype(dtype)
+		size = max(1, int(np.prod(self.shape)) * self.dtype.itemsize)
+
+		self.shm = shared_memory.SharedMemory(create=True, size=size)
+		self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+		return
+
+	@property
+	def spec(self):
+		"""(name, shape, dtype), all a worker needs to attach to this array"""
+
+		return self.shm.name, self.shape, self.dtype.descr if self.dtype.names else self.dtype.str
+
+	def close(self):
+		"""Frees the shared memory; the array must not be used afterwards"""
+
+		self.array = None
+		try:
+			self.shm.close()
+		except BufferError:
+			pass  # views of it are still around; the memory goes with them
+		self.shm.unlink()
+
+		return
+
+
+def attach(spec):
+	"""
+	The array described by SharedArray.spec, in a worker
+
+	Attachments are cached, as the same buffers are used batch after batch.
+	"""
+	name, shape, dtype = spec
+
+	if name in _ATTACHED:
+		_ATTACHED.move_to_end(name)
+	else:
+		_ATTACHED[name] = shared_memory.SharedMemory(name=name)
+		while len(_ATTACHED) > _MAX_ATTACHED:
+			_ATTACHED.popitem(last=False)[1].close()
+
+	if isinstance(dtype, list):
+		dtype = [tuple(field) for field in dtype]
+
+	return np.ndarray(shape, dtype=np.dtype(dtype), buffer=_ATTACHED[name].buf)
+
+
+def _run_block(task):
+	"""
+	Worker side of WorkerPool.map_blocks: analyzes rows start:stop of the
+	shared input into the same rows of the shared results
+
+	Returns
+	-------
+	timer : StageTimer or None
+		Stage timings of this block, if func recorded any
+	"""
+	func, data_spec, start, stop, scalars_spec, trace_specs, args = task
+
+	data = attach(data_spec)
+	out = PixelResults.from_arrays(attach(scalars_spec),
+								   {name: attach(spec) for name, spec in trace_specs.items()})
+
+	results = func(data[start:stop], *args)
+	out.insert(start, results)
+
+	return results.timer
+
+
+class WorkerPool:
+	"""
+	Process pool kept for many batches, with batches passed in shared memory
+
+	Parameters
+	----------
+	processes : int
+		Number of worker processes
+	n_outputs : int, optional
+		Number of result blocks used in turn. The results returned by
+		map_blocks stay valid until it has been called n_outputs more times,
+		e.g. 2 so one batch can be written while the next is computed.
+	"""
+
+	def __init__(self, processes, n_outputs=2):
+
+		self.processes = int(processes)
+
+		# Started before the workers so they share it; otherwise each worker's
+		# own tracker would unlink the buffers it attached to when it exits
+		if os.name == 'posix':
+			resource_tracker.ensure_running()
+
+		self._pool = multiprocessing.Pool(self.processes)
+
+		self._input = None
+		self._outputs = [None] * n_outputs
+		self._turn = 0
+
+		return
+
+	def map_blocks(self, func, data, block_size, args, trace_points, dtype=np.float32):
+		"""
+		Calls func(data[start:stop], *args) for contiguous blocks of rows, in the workers
+
+		Parameters
+		----------
+		func : callable
+			Picklable, e.g. a static method; returns a PixelResults of the block
+		data : (n_pixels, n_points) array_like
+			The batch, copied once into shared memory
+		block_size : int
+			Most rows per task
+		args : list
+			Passed to every call; keep it small, it is pickled for each block
+		trace_points : dict
+			Name and length of each trace func returns; longer traces are cut
+		dtype : numpy dtype, optional
+			Data type of the traces
+
+		Returns
+		-------
+		PixelResults
+			Results of all the rows, in shared memory owned by this pool
+		"""
+		data = np.asarray(data)
+		n_pixels = data.shape[0]
+
+		if self._input is None or self._input.shape != data.shape or self._input.dtype != data.dtype:
+			if self._input is not None:
+				self._input.close()
+			self._input = SharedArray(data.shape, data.dtype)
+		self._input.array[...] = data
+
+		out = self._output(n_pixels, trace_points, dtype)
+		scalars_spec = out[0].spec
+		trace_specs = {name: arr.spec for name, arr in out[1].items()}
+
+		size = max(1, min(int(block_size), -(-n_pixels // self.processes)))
+		tasks = [(func, self._input.spec, start, min(start + size, n_pixels),
+				  scalars_spec, trace_specs, args) for start in range(0, n_pixels, size)]
+
+		timers = self._pool.map(_run_block, tasks, chunksize=1)
+
+		results = PixelResults.from_arrays(out[0].array, {name: arr.array for name, arr in out[1].items()})
+		for timer in timers:
+			if timer is not None:
+				if results.timer is None:
+					results.timer = type(timer)(timer.allocations)
+				results.timer.merge(timer)
+
+		return results
+
+	def imap_unordered(self, func, tasks, chunksize=1):
+		"""
+		Calls func(task) for each task in the workers, as Pool.imap_unordered
+
+		For work that is not a batch of rows, e.g. one file per task, so that
+		the same workers can be kept for both.
+		"""
+
+		return self._pool.imap_unordered(func, tasks, chunksize=chunksize)
+
+	def _output(self, n_pixels, trace_points, dtype):
+		"""The next (scalars, traces) pair of shared result blocks, reallocated if the shape changed"""
+
+		turn = self._turn
+		self._turn = (turn + 1) % len(self._outputs)
+
+		out = self._outputs[turn]
+		if out is not None:
+			scalars, traces = out
+			fits = (scalars.shape[0] == n_pixels and set(traces) == set(trace_points) and
+					all(arr.shape[1] == trace_points[name] and arr.dtype == np.dtype(dtype)
+						for name, arr in traces.items()))
+			if fits:
+				return out
+			self._free(out)
+
+		scalars = SharedArray((n_pixels,), SCALAR_DTYPE)
+		traces = {name: SharedArray((n_pixels, int(n_points)), dtype)
+				  for name, n_points in trace_points.items()}
+		self._outputs[turn] = (scalars, traces)
+
+		return self._outputs[turn]
+
+	@staticmethod
+	def _free(out):
+
+		scalars, traces = out
+		scalars.close()
+		for arr in traces.values():
+			arr.close()
+
+		return
+
+	def close(self):
+		"""Stops the workers and frees the shared memory"""
+
+		if self._pool is not None:
+			self._pool.close()
+			self._pool.join()
+			self._pool = None
+
+		if self._input is not None:
+			self._input.close()
+			self._input = None
+
+		for i, out in enumerate(self._outputs):
+			if out is not None:
+				self._free(out)
+				self._outputs[i] = None
+
+		return
+
+	def __enter__(self):
+
+		return self
+
+	def __exit__(self, *args):
+
+		self.close()
+
+		return
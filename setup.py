@@ -28,10 +28,10 @@ setup(
                       'pycroscopy>=0.60',
                       'pywavelets>=1.1.1'],
 
-    # entry_points={
-    #      'console_scripts': [
-    #          'ffta-analyze = ffta.analyze:main',
-    #      ],
-    # },
+    entry_points={
+         'console_scripts': [
+             'ffta-analyze = ffta.analyze:main',
+         ],
+    },
 
 )
@@ -0,0 +1,56 @@
+"""test_line.py: Tests of ffta.line.Line against per-pixel processing."""
+
+__author__ = "Rajiv Giridharagopal"
+__copyright__ = "Copyright 2020"
+__maintainer__ = "Rajiv Giridharagopal"
+__email__ = "rgiri@uw.edu"
+__status__ = "Development"
+
+import numpy as np
+import pytest
+
+from ffta.benchmarks import synthetic
+from ffta.line import Line
+from ffta.pixel import Pixel
+
+# Line processes all pixels at once, but steps whose rounding depends on the
+# number of pixels are done per pixel (see Pixel.calculate_phase), so Line and
+# Pixel agree to round-off. Larger differences can move the 'product' fit to
+# another optimum, changing tfp by several percent.
+INST_FREQ_ATOL = 1e-6  # Hz
+TFP_RTOL = 1e-6
+
+
+@pytest.mark.parametrize('bandpass_filter', [1, 2])
+@pytest.mark.parametrize('fit', [dict(fit_form='product'), dict(fit_form='sum'), dict(fit=False)])
+def test_line_matches_pixels(bandpass_filter, fit):
+
+    taus = synthetic.tau_map(1, 6).ravel()
+    n_avgs = 2
+    signal_array, params = synthetic.simulate_line(taus, n_avgs, noise=0.01)
+    params = dict(params, recombination=0, bandpass_filter=bandpass_filter, **fit)
+
+    tfp, shift, inst_freq = Line(signal_array, params, len(taus)).analyze()
+
+    for i in range(len(taus)):
+
+        pix = Pixel(signal_array[:, i * n_avgs:(i + 1) * n_avgs], params)
+        pix_tfp, pix_shift, pix_inst_freq = pix.analyze()
+
+        np.testing.assert_allclose(inst_freq[:, i], pix_inst_freq, rtol=0, atol=INST_FREQ_ATOL)
+        np.testing.assert_allclose(tfp[i], pix_tfp, rtol=TFP_RTOL)
+        np.testing.assert_allclose(shift[i], pix_shift, rtol=TFP_RTOL)
+
+
+def test_line_threads():
+
+    taus = synthetic.tau_map(1, 6).ravel()
+    signal_array, params = synthetic.simulate_line(taus, 2, noise=0.01)
+    params = dict(params, recombination=0)
+
+    tfp, shift, inst_freq = [np.copy(x) for x in Line(signal_array, params, len(taus)).analyze()]
+    threaded = Line(signal_array, params, len(taus), n_threads=2).analyze()
+
+    np.testing.assert_array_equal(threaded[0], tfp)
+    np.testing.assert_array_equal(threaded[1], shift)
+    np.testing.assert_array_equal(threaded[2], inst_freq)
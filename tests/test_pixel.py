@@ -0,0 +1,62 @@
+"""test_pixel.py: Tests of ffta.pixel.Pixel on simulated signals."""
+
+__author__ = "Rajiv Giridharagopal"
+__copyright__ = "Copyright 2020"
+__maintainer__ = "Rajiv Giridharagopal"
+__email__ = "rgiri@uw.edu"
+__status__ = "Development"
+
+import pytest
+
+from ffta.benchmarks import synthetic
+from ffta.pixel import Pixel
+from ffta.pixel_utils.parameters import PixelParameters
+
+
+@pytest.fixture(scope='module')
+def simulated():
+
+    signal_array, params = synthetic.simulate_pixel(tau=1e-5, noise=0.01)
+    config = PixelParameters.from_dict(dict(params, recombination=0))
+
+    return signal_array, config
+
+
+def test_set_parameters(simulated):
+
+    signal_array, config = simulated
+    pix = Pixel(signal_array, config)
+    other = Pixel(signal_array, config)
+
+    pix.roi = config.roi / 2
+    pix.fit_form = 'sum'
+    pix.n_taps = 999
+
+    assert (pix.roi, pix.fit_form, pix.n_taps) == (config.roi / 2, 'sum', 999)
+    assert pix.config.roi == config.roi / 2
+
+    # Pixels sharing the original parameters are not changed
+    assert other.config is config
+    assert (other.roi, other.fit_form) == (config.roi, config.fit_form)
+
+    # Other names are kept with the extras, as attributes of the pixel
+    pix.note = 'tuning'
+    assert pix.note == 'tuning'
+    assert 'note' not in config.extras
+
+    with pytest.raises(ValueError):
+        pix.method = 'fourier'
+
+
+def test_set_parameter_before_analyze(simulated):
+
+    signal_array, config = simulated
+
+    pix = Pixel(signal_array, config)
+    pix.roi = config.roi / 2
+    tfp, shift, _ = pix.analyze()
+
+    ref = Pixel(signal_array, config._replace(roi=config.roi / 2))
+    ref_tfp, ref_shift, _ = ref.analyze()
+
+    assert (tfp, shift) == (ref_tfp, ref_shift)
@@ -0,0 +1,118 @@
+"""test_process.py: Tests of the FFtrEFM and TfpFit Processes on a simulated image."""
+
+__author__ = "Rajiv Giridharagopal"
+__copyright__ = "Copyright 2020"
+__maintainer__ = "Rajiv Giridharagopal"
+__email__ = "rgiri@uw.edu"
+__status__ = "Development"
+
+import numpy as np
+import pytest
+
+usid = pytest.importorskip('pyUSID')
+
+from ffta.benchmarks import synthetic
+from ffta.hdf_utils.process import FFtrEFM, TfpFit
+
+N_ROWS, N_COLS = 2, 4
+
+
+@pytest.fixture
+def h5_avg(tmp_path):
+
+    signals, params, _ = synthetic.simulate_image(N_ROWS, N_COLS, noise=0.01)
+    params = dict(params, recombination=0)
+
+    h5_avg = synthetic.write_h5(str(tmp_path / 'image.h5'), signals, params, N_ROWS, N_COLS)
+    yield h5_avg
+
+    h5_avg.file.close()
+
+
+def _results_groups(h5_avg):
+
+    return usid.hdf_utils.find_results_groups(h5_avg, 'Fast_Free')
+
+
+def test_rerun_returns_results(h5_avg):
+
+    parm_dict = usid.hdf_utils.get_attributes(h5_avg)
+
+    h5_grp = FFtrEFM(h5_avg, parm_dict=parm_dict, verbose=False).compute()
+    again = FFtrEFM(h5_avg, parm_dict=parm_dict, verbose=False).compute()
+
+    assert again == h5_grp
+    assert len(_results_groups(h5_avg)) == 1
+
+
+@pytest.mark.parametrize('pipeline', [False, True])
+def test_rerun_with_other_pixel_params(h5_avg, pipeline):
+
+    parm_dict = usid.hdf_utils.get_attributes(h5_avg)
+
+    h5_grp = FFtrEFM(h5_avg, parm_dict=parm_dict, pipeline=pipeline, verbose=False).compute()
+
+    # fit_form is not in parm_dict, so pyUSID alone would return h5_grp
+    data = FFtrEFM(h5_avg, parm_dict=parm_dict, pixel_params={'fit_form': 'sum'},
+                   pipeline=pipeline, verbose=False)
+    assert data.duplicate_h5_groups == []
+
+    new_grp = data.compute()
+
+    assert new_grp != h5_grp
+    assert len(_results_groups(h5_avg)) == 2
+    assert new_grp.attrs['tfp_digest'] != h5_grp.attrs['tfp_digest']
+
+
+def test_cache_refits_with_measured_drive_freq(h5_avg):
+
+    # check_drive_freq corrects the drive frequency of each pixel, which the
+    # refit must use rather than the one in parm_dict
+    parm_dict = usid.hdf_utils.get_attributes(h5_avg)
+    parm_dict['drive_freq'] = parm_dict['drive_freq'] * 1.05
+    parm_dict['check_drive'] = True
+
+    FFtrEFM(h5_avg, parm_dict=parm_dict, cache=True, verbose=False).compute()
+
+    parm_dict['roi'] = parm_dict['roi'] * 0.8
+    refit = FFtrEFM(h5_avg, parm_dict=parm_dict, cache=True, verbose=False).compute()
+    tfp, shift = refit['tfp'][()], refit['shift'][()]
+
+    # override analyzes the deflection again, in a new group
+    full = FFtrEFM(h5_avg, parm_dict=parm_dict, override=True, verbose=False).compute(override=True)
+
+    np.testing.assert_array_equal(tfp, full['tfp'][()])
+    np.testing.assert_array_equal(shift, full['shift'][()])
+
+
+@pytest.mark.parametrize('if_only', [False, True])
+def test_fit_windowed_source(h5_avg, if_only):
+
+    parm_dict = usid.hdf_utils.get_attributes(h5_avg)
+    trigger, roi = parm_dict['trigger'], parm_dict['roi']
+
+    full = FFtrEFM(h5_avg, parm_dict=parm_dict, if_only=if_only, verbose=False)
+    full.compute()
+    windowed = FFtrEFM(h5_avg, parm_dict=parm_dict, if_only=if_only,
+                       trace_window=(trigger - 1e-4, trigger + roi + 1e-4), verbose=False)
+    windowed.compute()
+    assert windowed.h5_if.shape[1] < full.h5_if.shape[1]
+
+    fit = {'roi': roi * 0.8}
+    ref = TfpFit(full.h5_if, parm_dict=fit, verbose=False).compute()
+    h5_grp = TfpFit(windowed.h5_if, parm_dict=fit, verbose=False).compute()
+
+    assert h5_grp != ref
+    np.testing.assert_array_equal(h5_grp['tfp'][()], ref['tfp'][()])
+    np.testing.assert_array_equal(h5_grp['shift'][()], ref['shift'][()])
+
+
+def test_fit_window_without_trigger(h5_avg):
+
+    parm_dict = usid.hdf_utils.get_attributes(h5_avg)
+
+    data = FFtrEFM(h5_avg, parm_dict=parm_dict, trace_window=(0, parm_dict['trigger'] / 2), verbose=False)
+    data.compute()
+
+    with pytest.raises(ValueError):
+        TfpFit(data.h5_if, verbose=False)